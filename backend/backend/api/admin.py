@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from api.models import Chat, ChatMessage, CustomUser
+from api.models import Chat, ChatArchive, ChatMessage, CustomUser, UsageRollup
 
 # Register your models here.
 
@@ -19,4 +19,16 @@ class ChatAdmin(admin.ModelAdmin):
 
 @admin.register(ChatMessage)
 class ChatMessageAdmin(admin.ModelAdmin):
-    list_display = ("id", "role", "content", "created_at")
\ No newline at end of file
+    list_display = ("id", "role", "content", "created_at")
+
+
+@admin.register(ChatArchive)
+class ChatArchiveAdmin(admin.ModelAdmin):
+    list_display = ("chat", "message_count", "raw_bytes", "archived_at")
+    exclude = ("payload",)
+
+
+@admin.register(UsageRollup)
+class UsageRollupAdmin(admin.ModelAdmin):
+    list_display = ("user", "day", "model", "messages", "tokens")
+    list_filter = ("model",)
@@ -0,0 +1,131 @@
+"""
+JWT authentication that resolves users from a cache instead of the database
+"""
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+class UserCache:
+    """
+    Two-level cache of users keyed by user id and version
+
+    Each user has a version stored in the shared Django cache. Saving or
+    deleting the user drops that version, so every worker's in-process entry
+    and every shared entry stored under the old version stops matching.
+
+    Entries hold the user's field values without the password hash, plus the
+    digest of it that access tokens carry for CHECK_REVOKE_TOKEN. Users built
+    from them load the password from the database only if it is read.
+    """
+
+    def __init__(self, local_ttl: int, shared_ttl: int):
+        self.local_ttl = local_ttl
+        self.shared_ttl = shared_ttl
+        self._local = {}
+        self._lock = threading.Lock()
+
+    def _version_key(self, user_id):
+        return f"api:jwt-user-version:{user_id}"
+
+    def _user_key(self, user_id, version):
+        return f"api:jwt-user:{user_id}:{version}"
+
+    def get(self, user_id):
+        """Return a fresh user and their password digest, or None on a miss"""
+        version = cache.get(self._version_key(user_id))
+        if version is None:
+            return None
+        entry = self._local.get(user_id)
+        if entry and entry[0] == version and entry[1] > time.monotonic():
+            return self._build(entry[2])
+        record = cache.get(self._user_key(user_id, version))
+        if record is None:
+            return None
+        self._store_local(user_id, version, record)
+        return self._build(record)
+
+    def version(self, user_id):
+        """
+        The user's current version, created if missing
+
+        Read it before loading the user and pass it to ``set``: if the user
+        changes in between, the entry is stored under a version that has
+        already been dropped, and is never served.
+        """
+        version_key = self._version_key(user_id)
+        cache.add(version_key, uuid.uuid4().hex, None)
+        return cache.get(version_key)
+
+    def set(self, user_id, version, user):
+        if version is None:
+            return
+        fields = {
+            field.attname: getattr(user, field.attname)
+            for field in user._meta.concrete_fields if field.attname != 'password'
+        }
+        record = {'fields': fields, 'password_digest': get_md5_hash_password(user.password)}
+        cache.set(self._user_key(user_id, version), record, self.shared_ttl)
+        self._store_local(user_id, version, record)
+
+    def invalidate(self, user_id):
+        cache.delete(self._version_key(user_id))
+        with self._lock:
+            self._local.pop(user_id, None)
+
+    def _build(self, record):
+        names = list(record['fields'])
+        user = get_user_model().from_db(DEFAULT_DB_ALIAS, names, [record['fields'][name] for name in names])
+        return user, record['password_digest']
+
+    def _store_local(self, user_id, version, record):
+        with self._lock:
+            self._local[user_id] = (version, time.monotonic() + self.local_ttl, record)
+
+
+user_cache = UserCache(
+    local_ttl=getattr(settings, 'JWT_USER_CACHE_LOCAL_TTL', 30),
+    shared_ttl=getattr(settings, 'JWT_USER_CACHE_SHARED_TTL', 300),
+)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that serves warm requests without a user query"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        cached = user_cache.get(user_id)
+        if cached is None:
+            version = user_cache.version(user_id)
+            try:
+                user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+            user_cache.set(user_id, version, user)
+            password_digest = get_md5_hash_password(user.password)
+        else:
+            user, password_digest = cached
+
+        # Same checks as JWTAuthentication, applied to cached users too
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_digest:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
@@ -0,0 +1,291 @@
+"""
+Django cache backend shared by every worker process on a host
+
+The default LocMemCache lives inside one process, so with several gunicorn
+or uvicorn workers each one has its own copy: a cancel flag, a resumable
+generation buffer or a blacklist generation counter written by one worker
+is invisible to the others. This backend keeps entries in one SQLite file
+that all local workers open, with no server to run:
+
+- WAL mode lets readers proceed while a writer commits, and the file is
+  memory-mapped so hot pages are read straight from the page cache.
+- Every operation is one statement (set_many one transaction), so ``add``,
+  ``incr`` and ``count`` are atomic across processes.
+- Integers are stored as SQL integers, which is what lets ``incr`` add to
+  them in place; anything else is pickled.
+- Once the table holds more than MAX_ENTRIES rows, expired entries and
+  then the least recently read 1/CULL_FREQUENCY of the rest are evicted.
+  A read refreshes an entry's access time at most every ACCESS_RESOLUTION
+  seconds, so reads of hot keys do not all turn into writes.
+
+Configured as::
+
+    CACHES = {'default': {'BACKEND': 'api.cache.SQLiteCache', 'LOCATION': '/path/to/cache.sqlite3'}}
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from django.core.cache import cache as default_cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    # Losing the last writes on power failure is acceptable for a cache
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+]
+# Seconds a writer waits for another process's write to finish
+BUSY_TIMEOUT = 5
+# Seconds between access-time updates of an entry that keeps being read
+ACCESS_RESOLUTION = 1.0
+# SQLite integers are 64-bit; larger ints are pickled like any other value
+INT_RANGE = range(-2 ** 63, 2 ** 63)
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS cache_entries (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expires REAL,
+        accessed REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (accessed)",
+]
+LIVE = "(expires IS NULL OR expires > ?)"
+
+
+def _encode(value):
+    if type(value) is int and value in INT_RANGE:
+        return value
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _decode(value):
+    return value if isinstance(value, int) else pickle.loads(value)
+
+
+class SQLiteCache(BaseCache):
+    """Cache entries and counters in a SQLite file shared by local processes"""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = Path(location)
+        self._local = threading.local()
+        self._writes = 0
+        # Counting rows is a scan, so only check the size every so many writes
+        self._cull_interval = max(1, self._max_entries // 100)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections are per thread and must not cross a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self._path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                         check_same_thread=False)
+            for pragma in PRAGMAS:
+                connection.execute(pragma)
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def _wrote(self, connection: sqlite3.Connection, now: float, rows: int = 1) -> None:
+        """Count writes, and cull once enough have been made since the last size check"""
+        self._writes += rows
+        if self._writes >= self._cull_interval:
+            self._writes = 0
+            self._cull(connection, now)
+
+    def _cull(self, connection: sqlite3.Connection, now: float) -> None:
+        count = connection.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        if count <= self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            self.clear()
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            count -= connection.execute("DELETE FROM cache_entries WHERE expires <= ?", (now,)).rowcount
+            if count > self._max_entries:
+                connection.execute(
+                    "DELETE FROM cache_entries WHERE key IN "
+                    "(SELECT key FROM cache_entries ORDER BY accessed LIMIT ?)",
+                    (max(count - self._max_entries, count // self._cull_frequency),),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._get_many({key: key}).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = {self.make_and_validate_key(key, version=version): key for key in keys}
+        return self._get_many(keys)
+
+    def _get_many(self, keys):
+        """Live values by the caller's key, given a map from cache keys to those keys"""
+        if not keys:
+            return {}
+        connection = self._connection()
+        now = time.time()
+        # SQLite caps the number of bound parameters per statement
+        found, stale = {}, []
+        names = list(keys)
+        for start in range(0, len(names), 500):
+            batch = names[start:start + 500]
+            rows = connection.execute(
+                f"SELECT key, value, accessed FROM cache_entries "
+                f"WHERE key IN ({', '.join('?' * len(batch))}) AND {LIVE}",
+                (*batch, now),
+            )
+            for name, value, accessed in rows:
+                found[keys[name]] = _decode(value)
+                if now - accessed > ACCESS_RESOLUTION:
+                    stale.append((now, name))
+        if stale:
+            connection.executemany("UPDATE cache_entries SET accessed = ? WHERE key = ?", stale)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._set_many({key: value}, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._set_many({self.make_and_validate_key(key, version=version): value for key, value in data.items()},
+                       timeout)
+        return []
+
+    def _set_many(self, data, timeout) -> None:
+        connection = self._connection()
+        now = time.time()
+        expires = self.get_backend_timeout(timeout)
+        rows = [(key, _encode(value), expires, now) for key, value in data.items()]
+        sql = (
+            "INSERT INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires, "
+            "accessed = excluded.accessed"
+        )
+        if len(rows) == 1:
+            connection.execute(sql, rows[0])
+        else:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(sql, rows)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        self._wrote(connection, now, len(rows))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        now = time.time()
+        # The upsert only replaces an entry that has expired
+        added = connection.execute(
+            "INSERT INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires, "
+            "accessed = excluded.accessed WHERE cache_entries.expires <= excluded.accessed",
+            (key, _encode(value), self.get_backend_timeout(timeout), now),
+        ).rowcount > 0
+        if added:
+            self._wrote(connection, now)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        return self._connection().execute(
+            f"UPDATE cache_entries SET expires = ?, accessed = ? WHERE key = ? AND {LIVE}",
+            (self.get_backend_timeout(timeout), now, key, now),
+        ).rowcount > 0
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._connection().execute(
+            f"SELECT 1 FROM cache_entries WHERE key = ? AND {LIVE}", (key, time.time())
+        ).fetchone() is not None
+
+    def incr(self, key, delta=1, version=None):
+        """Add ``delta`` to an integer entry in place; ValueError if the key is missing"""
+        made_key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        rows = self._connection().execute(
+            f"UPDATE cache_entries SET value = value + ?, accessed = ? "
+            f"WHERE key = ? AND typeof(value) = 'integer' AND {LIVE} RETURNING value",
+            (delta, now, made_key, now),
+        ).fetchall()
+        if rows:
+            return rows[0][0]
+        # Missing, or not an integer: the base class raises the matching error
+        return super().incr(key, delta, version)
+
+    def count(self, key, delta=1, timeout=DEFAULT_TIMEOUT, version=None) -> int:
+        """
+        Add ``delta`` to a counter, creating it with ``timeout`` if missing, and return the new value
+
+        Increments keep the counter's expiry, so a counter created with a
+        timeout counts over a fixed window and restarts from ``delta`` once
+        it has passed.
+        """
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        now = time.time()
+        rows = connection.execute(
+            "INSERT INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "value = CASE WHEN cache_entries.expires <= excluded.accessed OR typeof(cache_entries.value) != 'integer' "
+            "THEN excluded.value ELSE cache_entries.value + excluded.value END, "
+            "expires = CASE WHEN cache_entries.expires <= excluded.accessed OR typeof(cache_entries.value) != 'integer' "
+            "THEN excluded.expires ELSE cache_entries.expires END, "
+            "accessed = excluded.accessed "
+            "RETURNING value",
+            (key, delta, self.get_backend_timeout(timeout), now),
+        ).fetchall()
+        self._wrote(connection, now)
+        return rows[0][0]
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,)).rowcount > 0
+
+    def delete_many(self, keys, version=None):
+        keys = [(self.make_and_validate_key(key, version=version),) for key in keys]
+        if keys:
+            self._connection().executemany("DELETE FROM cache_entries WHERE key = ?", keys)
+
+    def clear(self):
+        self._connection().execute("DELETE FROM cache_entries")
+
+    def close(self, **kwargs):
+        # Connections stay open across requests; Django calls this after each one
+        pass
+
+
+def increment(key: str, delta: int = 1, timeout: Optional[float] = DEFAULT_TIMEOUT, cache=None) -> int:
+    """
+    Atomically add ``delta`` to a counter in a cache, creating it if missing
+
+    Uses SQLiteCache.count where available. Other backends get add-then-incr,
+    which is atomic in the ones that implement incr atomically; when the
+    counter already exists its expiry is kept.
+    """
+    cache = cache or default_cache
+    if hasattr(cache, 'count'):
+        return cache.count(key, delta, timeout)
+    if cache.add(key, delta, timeout):
+        return delta
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # Expired between add and incr
+        cache.set(key, delta, timeout)
+        return delta
@@ -0,0 +1,67 @@
+"""
+Custom model fields for the api app
+"""
+import base64
+import zlib
+
+from django.db import models
+
+# Compressed values are stored as text so the column type stays portable; the
+# prefix (starting with a control character no chat message begins with) is
+# the flag telling compressed rows apart from plain ones.
+COMPRESSED_PREFIX = '\x1fz:'
+DEFAULT_COMPRESS_THRESHOLD = 1024
+COMPRESSION_LEVEL = 6
+
+
+def compress_text(value: str, threshold: int = DEFAULT_COMPRESS_THRESHOLD) -> str:
+    """Return the stored form of a value, compressing it when it is large enough to pay off"""
+    # Values that look compressed are always encoded so reads stay unambiguous
+    if len(value) < threshold and not value.startswith(COMPRESSED_PREFIX):
+        return value
+    packed = zlib.compress(value.encode('utf-8'), COMPRESSION_LEVEL)
+    stored = COMPRESSED_PREFIX + base64.b64encode(packed).decode('ascii')
+    if len(stored) >= len(value) and not value.startswith(COMPRESSED_PREFIX):
+        return value
+    return stored
+
+
+def decompress_text(stored: str) -> str:
+    """Inverse of compress_text; plain values are returned unchanged"""
+    if not stored.startswith(COMPRESSED_PREFIX):
+        return stored
+    packed = base64.b64decode(stored[len(COMPRESSED_PREFIX):])
+    return zlib.decompress(packed).decode('utf-8')
+
+
+class CompressedTextField(models.TextField):
+    """
+    TextField that zlib-compresses values of at least ``compress_threshold`` characters
+
+    Values are decompressed as rows are loaded, so model instances, values()
+    and values_list() all return plain str. Lookups compare against the stored
+    form and so only match uncompressed rows; use the full-text index to
+    search content.
+    """
+
+    def __init__(self, *args, compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD, **kwargs):
+        self.compress_threshold = compress_threshold
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.compress_threshold != DEFAULT_COMPRESS_THRESHOLD:
+            kwargs['compress_threshold'] = self.compress_threshold
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, str):
+            return decompress_text(value)
+        return value
+
+    def get_db_prep_save(self, value, connection):
+        # Compress on writes only, so lookup values are compared as given
+        value = super().get_db_prep_save(value, connection)
+        if value is None:
+            return value
+        return compress_text(value, self.compress_threshold)
@@ -0,0 +1,24 @@
+"""
+Synthetic data shared by the benchmark commands
+"""
+WORDS = (
+    "request response model token cache query index user chat message stream provider "
+    "value result error handler config setting database table field record batch "
+    "async thread worker queue timeout retry limit buffer offset cursor page"
+).split()
+
+
+def synthetic_reply(rng):
+    """An assistant-style Markdown reply with prose, a list and a code block"""
+    def sentence():
+        return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + '.'
+
+    name = '_'.join(rng.sample(WORDS, 2))
+    parts = [f"## {sentence()}", ' '.join(sentence() for _ in range(rng.randint(2, 6)))]
+    parts += [f"- **{rng.choice(WORDS)}**: {sentence()}" for _ in range(rng.randint(2, 6))]
+    code = [f"def {name}({rng.choice(WORDS)}, {rng.choice(WORDS)}=None):"]
+    for _ in range(rng.randint(4, 30)):
+        code.append(f"    {rng.choice(WORDS)} = {rng.choice(WORDS)}.{rng.choice(WORDS)}({rng.randint(0, 999)})")
+    code.append(f"    return {rng.choice(WORDS)}")
+    parts += ["```python", *code, "```", ' '.join(sentence() for _ in range(rng.randint(1, 4)))]
+    return '\n\n'.join(parts)
@@ -0,0 +1,77 @@
+"""
+Move messages of inactive chats into compressed cold storage
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Func, IntegerField, Sum
+from django.utils import timezone
+
+from api.models import Chat, ChatMessage
+from api.services.archive import archive_chat
+
+
+class OctetLength(Func):
+    """Bytes a text column takes in the database, compressed values included"""
+    function = 'OCTET_LENGTH'
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='LENGTH(CAST(%(expressions)s AS BLOB))', **extra_context)
+
+
+class Command(BaseCommand):
+    help = "Archive chats that have not been updated for --days days and report the hot-table reduction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--limit', type=int, default=None, help="Archive at most this many chats")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        chats = (
+            Chat.objects.filter(updated_at__lt=cutoff, archived_at__isnull=True, messages__isnull=False)
+            .distinct()
+            .order_by('updated_at')
+        )
+        if options['limit']:
+            chats = chats[:options['limit']]
+
+        rows_before, bytes_before = self._hot_table_size()
+        if options['dry_run']:
+            self.stdout.write(f"{chats.count()} chats would be archived (cutoff {cutoff:%Y-%m-%d})")
+            return
+
+        archived = messages = raw_bytes = compressed_bytes = 0
+        for chat in list(chats):
+            result = archive_chat(chat, cutoff)
+            if not result['messages']:
+                # Used or archived since it was picked
+                continue
+            archived += 1
+            messages += result['messages']
+            raw_bytes += result['raw_bytes']
+            compressed_bytes += result['compressed_bytes']
+
+        rows_after, bytes_after = self._hot_table_size()
+        self.stdout.write(f"Archived {archived} chats ({messages} messages) not updated since {cutoff:%Y-%m-%d}")
+        self.stdout.write(
+            f"Hot table: {rows_before} -> {rows_after} rows "
+            f"({self._percent(rows_before - rows_after, rows_before)} fewer), "
+            f"{bytes_before} -> {bytes_after} stored content bytes "
+            f"({self._percent(bytes_before - bytes_after, bytes_before)} smaller)"
+        )
+        if raw_bytes:
+            self.stdout.write(
+                f"Archive: {raw_bytes} content bytes stored as {compressed_bytes} bytes "
+                f"(ratio {raw_bytes / compressed_bytes:.1f}x)"
+            )
+
+    def _hot_table_size(self):
+        """Row count and stored content bytes of the ChatMessage table"""
+        totals = ChatMessage.objects.aggregate(bytes=Sum(OctetLength('content')))
+        return ChatMessage.objects.count(), totals['bytes'] or 0
+
+    def _percent(self, part, whole):
+        return f"{100 * part / whole:.1f}%" if whole else "0.0%"
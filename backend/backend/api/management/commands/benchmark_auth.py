@@ -0,0 +1,43 @@
+"""
+Benchmark per-request JWT user resolution with and without the user cache
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.authentication import CachedJWTAuthentication, user_cache
+from api.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Compare time and DB queries per authenticated request for JWTAuthentication and CachedJWTAuthentication."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        with transaction.atomic():
+            user = CustomUser.objects.create_user(username=f"auth-bench-{time.time_ns()}", password=None)
+            token = str(RefreshToken.for_user(user).access_token)
+            request = APIRequestFactory().get('/api/chats/', HTTP_AUTHORIZATION=f"Bearer {token}")
+
+            for label, backend in (('JWTAuthentication', JWTAuthentication()),
+                                   ('CachedJWTAuthentication', CachedJWTAuthentication())):
+                backend.authenticate(request)  # warm up
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    for _ in range(count):
+                        backend.authenticate(request)
+                    elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"{label}: {elapsed / count * 1e6:.1f} us/request, "
+                    f"{len(queries) / count:.2f} queries/request"
+                )
+            user_cache.invalidate(user.pk)
+            transaction.set_rollback(True)
@@ -0,0 +1,105 @@
+"""
+Benchmark the shared SQLite cache against Django's local-memory and file caches
+"""
+import multiprocessing
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from api.cache import SQLiteCache, increment
+
+BACKENDS = ('locmem', 'file', 'sqlite')
+
+
+def _backend(name: str, scratch_dir: Path, max_entries: int):
+    params = {'OPTIONS': {'MAX_ENTRIES': max_entries}}
+    if name == 'locmem':
+        return LocMemCache('bench', params)
+    if name == 'file':
+        return FileBasedCache(str(scratch_dir / 'files'), params)
+    return SQLiteCache(scratch_dir / 'cache.sqlite3', params)
+
+
+def _count_in_process(args):
+    backend_args, increments = args
+    cache = _backend(*backend_args)
+    for _ in range(increments):
+        increment('bench:counter', timeout=None, cache=cache)
+    return cache.get('bench:counter')
+
+
+class Command(BaseCommand):
+    help = (
+        "Time get, set, get_many and incr on LocMemCache, FileBasedCache and SQLiteCache, then have "
+        "several processes increment one counter to check which backends they actually share."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', type=int, default=5000)
+        parser.add_argument('--keys', type=int, default=1000)
+        parser.add_argument('--value-bytes', type=int, default=1024)
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--increments', type=int, default=2000, help="Per process")
+
+    def handle(self, *args, **options):
+        scratch_dir = Path(tempfile.mkdtemp(prefix="cache-bench-"))
+        try:
+            max_entries = options['keys'] * 10
+            self.stdout.write(f"{'backend':8s} {'set/s':>10s} {'get/s':>10s} {'get_many/s':>11s} {'incr/s':>10s}")
+            for name in BACKENDS:
+                rates = self._throughput(_backend(name, scratch_dir, max_entries), options)
+                self.stdout.write(f"{name:8s} " + " ".join(f"{rate:10,.0f}" for rate in rates))
+
+            self.stdout.write(
+                f"\n{options['processes']} processes x {options['increments']} increments of one counter"
+            )
+            expected = options['processes'] * options['increments']
+            context = multiprocessing.get_context('fork')
+            for name in BACKENDS:
+                backend_args = (name, scratch_dir, max_entries)
+                _backend(*backend_args).clear()
+                begin = time.perf_counter()
+                with context.Pool(options['processes']) as pool:
+                    seen = pool.map(_count_in_process, [(backend_args, options['increments'])] * options['processes'])
+                elapsed = time.perf_counter() - begin
+                final = _backend(*backend_args).get('bench:counter')
+                self.stdout.write(
+                    f"  {name:8s} final {final if final is not None else '-':>8} of {expected} "
+                    f"(each process saw {max(seen)} at most), {expected / elapsed:,.0f} increments/s"
+                )
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    def _throughput(self, cache, options):
+        operations, keys = options['operations'], options['keys']
+        value = 'x' * options['value_bytes']
+        cache.clear()
+        rates = []
+
+        begin = time.perf_counter()
+        for i in range(operations):
+            cache.set(f'bench:{i % keys}', value)
+        rates.append(operations / (time.perf_counter() - begin))
+
+        begin = time.perf_counter()
+        for i in range(operations):
+            cache.get(f'bench:{i % keys}')
+        rates.append(operations / (time.perf_counter() - begin))
+
+        batches = operations // 10
+        begin = time.perf_counter()
+        for i in range(batches):
+            cache.get_many([f'bench:{(i * 10 + j) % keys}' for j in range(10)])
+        rates.append(batches / (time.perf_counter() - begin))
+
+        cache.set('bench:counter', 0, None)
+        begin = time.perf_counter()
+        for _ in range(operations):
+            cache.incr('bench:counter')
+        rates.append(operations / (time.perf_counter() - begin))
+        return rates
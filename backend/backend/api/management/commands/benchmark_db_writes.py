@@ -0,0 +1,102 @@
+"""
+Benchmark concurrent chat message writes under each database profile
+"""
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+
+from api.models import Chat, ChatMessage, CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure ChatMessage inserts per second from concurrent threads. "
+        "The SQLite development and production profiles run against scratch "
+        "databases; --live also benchmarks the configured default database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--messages', type=int, default=200, help="Messages written per thread")
+        parser.add_argument('--live', action='store_true', help="Also benchmark DATABASES['default']")
+
+    def handle(self, *args, **options):
+        scratch_dir = Path(tempfile.mkdtemp(prefix="db-bench-"))
+        try:
+            profiles = {
+                'sqlite-development': {
+                    'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': scratch_dir / 'development.sqlite3',
+                },
+                'sqlite-production': {
+                    'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': scratch_dir / 'production.sqlite3',
+                    'CONN_MAX_AGE': 600,
+                    'OPTIONS': {
+                        'timeout': 20,
+                        'transaction_mode': 'IMMEDIATE',
+                        'init_command': "; ".join(settings.SQLITE_PRODUCTION_PRAGMAS),
+                    },
+                },
+            }
+            for alias, config in profiles.items():
+                self._register_database(alias, config)
+                call_command('migrate', database=alias, verbosity=0)
+                self._run(alias, options['threads'], options['messages'])
+                connections[alias].close()
+
+            if options['live']:
+                label = f"default ({settings.DB_ENGINE}, {settings.DB_PROFILE})"
+                self._run('default', options['threads'], options['messages'], label=label)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    def _register_database(self, alias, config):
+        databases = {**settings.DATABASES, alias: config}
+        connections.settings[alias] = connections.configure_settings(databases)[alias]
+
+    def _run(self, alias, thread_count, per_thread, label=None):
+        user = CustomUser.objects.db_manager(alias).create_user(
+            username=f"db-bench-{time.time_ns()}",
+            email=f"db-bench-{time.time_ns()}@example.com",
+            password=None,
+        )
+        chats = [
+            Chat.objects.using(alias).create(user=user, title=f"bench {i}")
+            for i in range(thread_count)
+        ]
+        errors = []
+        barrier = threading.Barrier(thread_count)
+
+        def worker(chat):
+            barrier.wait()
+            try:
+                for i in range(per_thread):
+                    try:
+                        ChatMessage.objects.using(alias).create(chat=chat, role="user", content=f"message {i}")
+                    except OperationalError as e:
+                        errors.append(e)
+            finally:
+                connections[alias].close()
+
+        threads = [threading.Thread(target=worker, args=(chat,)) for chat in chats]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        written = thread_count * per_thread - len(errors)
+        self.stdout.write(
+            f"{label or alias}: {written} writes in {elapsed:.2f}s "
+            f"({written / elapsed:.0f} writes/s, {len(errors)} lock errors)"
+        )
+        user.delete()
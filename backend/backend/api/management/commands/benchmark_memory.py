@@ -0,0 +1,95 @@
+"""
+Benchmark cross-chat memory appends and queries at shard scale
+"""
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import ChatMessage
+from api.services import lexical_vectors, memory
+from api.services.lexical_vectors import VECTOR_DIM
+
+from .benchmark_rag import _percentiles, synthetic_chunks
+
+# Cosine similarities of the neighbours planted for each query
+PLANTED_SIMILARITIES = (0.4, 0.6, 0.8)
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill a scratch memory index with --rows random vectors, then time single-message appends "
+        "(vectorizing included) and top-k queries, and report how often planted neighbours are found."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=getattr(settings, 'MEMORY_SHARD_ROWS', 1_000_000))
+        parser.add_argument('--chats', type=int, default=20_000, help="Chats the rows are spread over")
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--appends', type=int, default=200)
+        parser.add_argument('--k', type=int, default=getattr(settings, 'MEMORY_TOP_K', 3))
+
+    def handle(self, *args, **options):
+        if not lexical_vectors.available():
+            raise CommandError("NumPy is required for cross-chat memory")
+        import numpy as np
+
+        rng = np.random.default_rng(0)
+        rows, k = options['rows'], options['k']
+        chat_keys = np.array([memory.chat_key(uuid.uuid4()) for _ in range(options['chats'])], dtype=np.int64)
+        # Each query gets one planted neighbour per similarity, to measure recall of the approximate search
+        queries = rng.standard_normal((options['queries'], VECTOR_DIM), dtype=np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        planted = {}
+        for number, query in enumerate(queries):
+            for similarity in PLANTED_SIMILARITIES:
+                other = rng.standard_normal(VECTOR_DIM, dtype=np.float32)
+                other -= (other @ query) * query
+                other /= np.linalg.norm(other)
+                planted[int(rng.integers(rows))] = (number, similarity, similarity * query + np.sqrt(1 - similarity ** 2) * other)
+
+        scratch_dir = Path(tempfile.mkdtemp(prefix="memory-bench-"))
+        try:
+            index = memory.MemoryIndex(scratch_dir)
+            begin = time.perf_counter()
+            # Random unit vectors: vectorizing a million synthetic messages would dominate the run
+            for start in range(0, rows, 100_000):
+                count = min(100_000, rows - start)
+                vectors = rng.standard_normal((count, VECTOR_DIM), dtype=np.float32)
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                for row, (_number, _similarity, vector) in planted.items():
+                    if start <= row < start + count:
+                        vectors[row - start] = vector
+                index.append(range(start, start + count), rng.choice(chat_keys, count), vectors)
+            size = sum(path.stat().st_size for path in scratch_dir.iterdir())
+            self.stdout.write(
+                f"Build: {len(index)} rows in {len(index.shards())} shard(s), "
+                f"{time.perf_counter() - begin:.1f} s, {size / 2 ** 20:.1f} MiB on disk"
+            )
+
+            texts = synthetic_chunks(options['appends'], 30, vocabulary=50_000, seed=2)
+            append_times = []
+            for number, text in enumerate(texts):
+                message = ChatMessage(id=rows + number, chat_id=uuid.uuid4(), content=text)
+                begin = time.perf_counter()
+                index.append([message.id], [memory.chat_key(message.chat_id)], [lexical_vectors.vectorize(text)])
+                append_times.append(time.perf_counter() - begin)
+            self.stdout.write(f"Append of one message, vectorizing included: {_percentiles(append_times)}")
+
+            search_times, found = [], set()
+            for number, query in enumerate(queries):
+                begin = time.perf_counter()
+                hits = index.search(query, k * 2, exclude_chat=int(chat_keys[0]))
+                search_times.append(time.perf_counter() - begin)
+                found.update((number, message_id) for message_id, _score in hits)
+            self.stdout.write(f"Top-{k} search over {len(index)} rows: {_percentiles(search_times)}")
+            for similarity in PLANTED_SIMILARITIES:
+                rows_at = [(number, row) for row, (number, s, _vector) in planted.items() if s == similarity]
+                recalled = sum((number, row) in found for number, row in rows_at)
+                self.stdout.write(f"Recall of neighbours at similarity {similarity}: {recalled / len(rows_at):.0%}")
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
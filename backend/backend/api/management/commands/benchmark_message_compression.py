@@ -0,0 +1,86 @@
+"""
+Benchmark storage size and read/write cost of compressed message content
+"""
+import random
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.fields import compress_text, decompress_text
+from api.management.benchmarks import synthetic_reply
+from api.models import Chat, ChatMessage, CustomUser
+
+
+class Command(BaseCommand):
+    help = "Compare stored bytes and encode/decode/DB cost of compressed vs plain message content."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--from-db', action='store_true', help="Use existing assistant replies as the corpus")
+
+    def handle(self, *args, **options):
+        corpus = self._corpus(options['messages'], options['from_db'])
+        field = ChatMessage._meta.get_field('content')
+        threshold = field.compress_threshold
+
+        start = time.perf_counter()
+        stored = [compress_text(text, threshold) for text in corpus]
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for value in stored:
+            decompress_text(value)
+        decode_time = time.perf_counter() - start
+
+        raw_bytes = sum(len(text.encode('utf-8')) for text in corpus)
+        stored_bytes = sum(len(value.encode('utf-8')) for value in stored)
+        compressed = sum(1 for text, value in zip(corpus, stored) if value is not text)
+        self.stdout.write(
+            f"Corpus: {len(corpus)} messages, {raw_bytes} bytes, "
+            f"{compressed} over the {threshold}-character threshold"
+        )
+        self.stdout.write(f"Stored: {stored_bytes} bytes ({stored_bytes / raw_bytes:.1%} of raw)")
+        self.stdout.write(
+            f"Encode {encode_time / len(corpus) * 1e6:.1f} us/message, "
+            f"decode {decode_time / len(corpus) * 1e6:.1f} us/message"
+        )
+
+        plain = self._database_roundtrip(corpus, field, sys.maxsize)
+        packed = self._database_roundtrip(corpus, field, threshold)
+        for label, (write, read) in (('plain', plain), ('compressed', packed)):
+            self.stdout.write(
+                f"DB {label}: write {write / len(corpus) * 1e6:.1f} us/message, "
+                f"read {read / len(corpus) * 1e6:.1f} us/message"
+            )
+
+    def _corpus(self, count, from_db):
+        if from_db:
+            replies = ChatMessage.objects.filter(role='assistant').order_by('-id')[:count]
+            corpus = [message.content for message in replies]
+            if corpus:
+                return corpus
+            self.stdout.write("No assistant messages found, using the synthetic corpus")
+        rng = random.Random(42)
+        return [synthetic_reply(rng) for _ in range(count)]
+
+    def _database_roundtrip(self, corpus, field, threshold):
+        """Insert and read back the corpus in a rolled back transaction"""
+        original = field.compress_threshold
+        field.compress_threshold = threshold
+        try:
+            with transaction.atomic():
+                user = CustomUser.objects.create_user(username=f"compression-bench-{time.time_ns()}", password=None)
+                chat = Chat.objects.create(user=user)
+                messages = [ChatMessage(chat=chat, role='assistant', content=text) for text in corpus]
+                start = time.perf_counter()
+                ChatMessage.objects.bulk_create(messages, batch_size=500)
+                write = time.perf_counter() - start
+                start = time.perf_counter()
+                for message in ChatMessage.objects.filter(chat=chat):
+                    message.content
+                read = time.perf_counter() - start
+                transaction.set_rollback(True)
+        finally:
+            field.compress_threshold = original
+        return write, read
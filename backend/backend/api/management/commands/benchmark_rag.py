@@ -0,0 +1,79 @@
+"""
+Benchmark document index build and top-k query latency
+"""
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services import lexical_vectors
+from api.services.documents import VectorIndex
+
+
+def synthetic_chunks(count: int, words: int, vocabulary: int, seed: int = 0):
+    """Chunks of Zipf-distributed words, roughly how word frequencies fall in real text"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    terms = np.array([f"term{i}" for i in range(vocabulary)])
+    ranks = np.minimum(rng.zipf(1.2, size=(count, words)), vocabulary) - 1
+    return [' '.join(terms[row]) for row in ranks]
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e3  # noqa: E731
+    return f"p50 {pick(0.50):.2f} ms, p95 {pick(0.95):.2f} ms, p99 {pick(0.99):.2f} ms"
+
+
+class Command(BaseCommand):
+    help = "Vectorize and index synthetic chunks in a scratch directory, then time top-k queries against the memory-mapped index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunks', type=int, default=100_000)
+        parser.add_argument('--batch', type=int, default=1000, help="Chunks appended per write, as one upload would")
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=getattr(settings, 'RAG_TOP_K', 4))
+
+    def handle(self, *args, **options):
+        if not lexical_vectors.available():
+            raise CommandError("NumPy is required for document retrieval")
+        words = getattr(settings, 'RAG_CHUNK_WORDS', 200)
+        chunks = synthetic_chunks(options['chunks'], words, vocabulary=50_000)
+        queries = synthetic_chunks(options['queries'], 12, vocabulary=50_000, seed=1)
+
+        scratch_dir = Path(tempfile.mkdtemp(prefix="rag-bench-"))
+        try:
+            index = VectorIndex(scratch_dir / 'bench')
+            vectorize_time = write_time = 0.0
+            for start in range(0, len(chunks), options['batch']):
+                batch = chunks[start:start + options['batch']]
+                begin = time.perf_counter()
+                vectors = lexical_vectors.vectorize_texts(batch)
+                vectorize_time += time.perf_counter() - begin
+                begin = time.perf_counter()
+                index.append(range(start, start + len(batch)), vectors)
+                write_time += time.perf_counter() - begin
+            size = index.vectors_path.stat().st_size + index.ids_path.stat().st_size
+            self.stdout.write(
+                f"Build: {len(chunks)} chunks of {words} words, vectorized in {vectorize_time:.1f} s "
+                f"({len(chunks) / vectorize_time:.0f} chunks/s), written in {write_time * 1e3:.0f} ms, "
+                f"{size / 2 ** 20:.1f} MiB on disk"
+            )
+
+            search_times, total_times = [], []
+            for query in queries:
+                begin = time.perf_counter()
+                vector = lexical_vectors.vectorize(query)
+                searched = time.perf_counter()
+                index.search(vector, options['k'])
+                end = time.perf_counter()
+                search_times.append(end - searched)
+                total_times.append(end - begin)
+            self.stdout.write(f"Top-{options['k']} search over {len(index)} vectors: {_percentiles(search_times)}")
+            self.stdout.write(f"Query including vectorizing: {_percentiles(total_times)}")
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
@@ -0,0 +1,84 @@
+"""
+Benchmark JSON rendering and response compression for a large chat
+"""
+import gzip
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api.management.benchmarks import synthetic_reply
+from api.models import Chat, ChatMessage, CustomUser
+from api.renderers import ORJSONRenderer, orjson
+from api.serializers import ChatMessageSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = "Compare DRF vs orjson rendering time and gzip/brotli bytes for a get_chat_messages payload."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def handle(self, *args, **options):
+        count, rounds = options['messages'], options['rounds']
+        if orjson is None:
+            self.stdout.write("orjson is not installed; ORJSONRenderer falls back to the stock renderer")
+
+        with transaction.atomic():
+            chat = self._chat(count)
+            start = time.perf_counter()
+            data = ChatMessageSerializer(ChatMessage.objects.filter(chat=chat), many=True).data
+            serialize_time = time.perf_counter() - start
+            transaction.set_rollback(True)
+        self.stdout.write(f"Chat with {count} messages, serializer: {serialize_time * 1e3:.1f} ms")
+
+        for label, renderer in (('DRF JSONRenderer', JSONRenderer()), ('ORJSONRenderer', ORJSONRenderer())):
+            body = renderer.render(data, 'application/json')
+            start = time.perf_counter()
+            for _ in range(rounds):
+                renderer.render(data, 'application/json')
+            elapsed = (time.perf_counter() - start) / rounds
+            self.stdout.write(f"{label}: {elapsed * 1e3:.2f} ms, {len(body)} bytes")
+
+        self._wire_sizes(body, rounds)
+
+    def _chat(self, count):
+        rng = random.Random(42)
+        name = f"render-bench-{time.time_ns()}"
+        user = CustomUser.objects.create_user(username=name, email=f"{name}@example.invalid", password=None)
+        chat = Chat.objects.create(user=user)
+        ChatMessage.objects.bulk_create(
+            [
+                ChatMessage(chat=chat, role='assistant', content=synthetic_reply(rng), model_used='gemini')
+                if i % 2 else
+                ChatMessage(chat=chat, role='user', content=' '.join(synthetic_reply(rng).split()[:30]))
+                for i in range(count)
+            ],
+            batch_size=500,
+        )
+        return chat
+
+    def _wire_sizes(self, body, rounds):
+        codecs = [('gzip -6', lambda raw: gzip.compress(raw, compresslevel=6, mtime=0))]
+        if brotli is not None:
+            codecs.append(('brotli q5', lambda raw: brotli.compress(raw, quality=5)))
+        else:
+            self.stdout.write("brotli is not installed; skipping it")
+        self.stdout.write(f"Identity: {len(body)} bytes")
+        for label, compress in codecs:
+            packed = compress(body)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                compress(body)
+            elapsed = (time.perf_counter() - start) / rounds
+            self.stdout.write(
+                f"{label}: {len(packed)} bytes ({len(packed) / len(body):.1%}), {elapsed * 1e3:.2f} ms"
+            )
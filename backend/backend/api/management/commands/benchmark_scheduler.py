@@ -0,0 +1,75 @@
+"""
+Benchmark how the provider scheduler shares saturated slots between users
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from api.services.provider_limits import AdaptiveLimiter
+from api.services.scheduler import Priority, ProviderScheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Saturate a simulated provider with one heavy user's burst while light users send single "
+        "requests, and compare their queue waits with first-come-first-served and fair queuing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slots', type=int, default=4)
+        parser.add_argument('--heavy-requests', type=int, default=80)
+        parser.add_argument('--light-users', type=int, default=8)
+        parser.add_argument('--call-ms', type=float, default=50)
+
+    def handle(self, *args, **options):
+        for label, fair in (("First come, first served", False), ("Fair queuing", True)):
+            waits = self._run(fair, options)
+            self.stdout.write(label)
+            for group in ('heavy', 'light', 'title'):
+                samples = sorted(waits[group])
+                self.stdout.write(
+                    f"  {group:5s} {len(samples):3d} requests, wait p50 {samples[len(samples) // 2] * 1e3:7.1f} ms, "
+                    f"max {samples[-1] * 1e3:7.1f} ms"
+                )
+
+    def _run(self, fair, options):
+        slots = options['slots']
+        scheduler = ProviderScheduler(AdaptiveLimiter(initial=slots, maximum=slots))
+        waits = defaultdict(list)
+        lock = threading.Lock()
+
+        def call(group, user, priority):
+            start = time.monotonic()
+            # Without fairness every request shares one key and one class, so they are served in arrival order
+            granted = scheduler.acquire(user if fair else None, priority if fair else Priority.INTERACTIVE,
+                                        deadline=start + 60)
+            waited = time.monotonic() - start
+            if granted:
+                time.sleep(options['call_ms'] / 1e3)
+                # No latency: keep the simulated limit fixed
+                scheduler.release(None)
+            with lock:
+                waits[group].append(waited)
+
+        threads = [
+            threading.Thread(target=call, args=('heavy', 'heavy', Priority.INTERACTIVE))
+            for _ in range(options['heavy_requests'])
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.01)
+        # Light users and a few title requests arrive just after the burst
+        late = [
+            threading.Thread(target=call, args=('light', f'light{number}', Priority.INTERACTIVE))
+            for number in range(options['light_users'])
+        ] + [
+            threading.Thread(target=call, args=('title', f'light{number}', Priority.TITLE))
+            for number in range(options['light_users'] // 2)
+        ]
+        for thread in late:
+            thread.start()
+        for thread in threads + late:
+            thread.join()
+        return waits
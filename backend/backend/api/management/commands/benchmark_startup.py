@@ -0,0 +1,81 @@
+"""
+Profile process startup with ``python -X importtime``
+
+Each scenario runs in a fresh interpreter, so nothing is shared with the
+process running this command. "worker boot" loads what an ASGI worker loads
+before its first request: the application and the URLconf (and so the views).
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+WORKER_BOOT = (
+    "from backend.asgi import application\n"
+    "from django.urls import get_resolver\n"
+    "get_resolver().url_patterns\n"
+)
+
+SCENARIOS = {
+    'manage.py check': ['manage.py', 'check'],
+    'worker boot': ['-c', WORKER_BOOT],
+}
+
+
+def parse_importtime(stderr: str):
+    """
+    Sum ``-X importtime`` output per top-level package
+
+    Returns:
+        (total self time in seconds, {package: self time in seconds})
+    """
+    packages = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        self_us, _cumulative, name = line[len('import time:'):].split('|', 2)
+        packages[name.strip().split('.')[0]] += int(self_us) / 1e6
+    return sum(packages.values()), packages
+
+
+class Command(BaseCommand):
+    help = "Measure interpreter startup and module import time for manage.py check and an ASGI worker boot."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="Runs per scenario; the median is reported")
+        parser.add_argument('--top', type=int, default=10, help="Slowest top-level packages to list")
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+        for label, arguments in SCENARIOS.items():
+            wall, imports, packages = [], [], defaultdict(list)
+            for _ in range(options['runs']):
+                start = time.perf_counter()
+                result = subprocess.run(
+                    [sys.executable, '-X', 'importtime', *arguments],
+                    cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+                )
+                wall.append(time.perf_counter() - start)
+                if result.returncode != 0:
+                    self.stderr.write(f"{label} failed:\n{result.stderr[-2000:]}")
+                    break
+                total, per_package = parse_importtime(result.stderr)
+                imports.append(total)
+                for name, seconds in per_package.items():
+                    packages[name].append(seconds)
+            if not imports:
+                continue
+
+            self.stdout.write(
+                f"{label}: {statistics.median(wall) * 1e3:.0f} ms wall, "
+                f"{statistics.median(imports) * 1e3:.0f} ms importing modules"
+            )
+            slowest = sorted(packages.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+            for name, samples in slowest[:options['top']]:
+                self.stdout.write(f"    {statistics.median(samples) * 1e3:8.1f} ms  {name}")
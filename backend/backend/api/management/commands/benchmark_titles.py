@@ -0,0 +1,35 @@
+"""
+Benchmark local chat title extraction
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.services import titles
+
+SAMPLES = [
+    "hi",
+    "Can you help me sort a list of dictionaries by a key in Python?",
+    "Please explain the difference between TCP and UDP, and when I should use each one for a multiplayer game.",
+    "I need a recipe for a vegetarian lasagna that can be made the day before and reheated.",
+    "ما هي أفضل طريقة لتعلم اللغة الإنجليزية بسرعة في المنزل؟",
+    "اكتب لي رسالة رسمية إلى مدير الشركة لطلب إجازة لمدة أسبوع",
+    "Summarize this: " + "The quarterly report shows revenue growth in the European market driven by new customers. " * 20,
+]
+
+
+class Command(BaseCommand):
+    help = "Measure the time per local chat title and print the titles of a few sample prompts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"NumPy scoring: {'yes' if titles.np is not None else 'no (pure Python)'}")
+        for sample in SAMPLES:
+            titles.local_title(sample)  # warm up, and load the IDF table
+            start = time.perf_counter()
+            for _ in range(options['iterations']):
+                title = titles.local_title(sample)
+            elapsed = (time.perf_counter() - start) / options['iterations']
+            self.stdout.write(f"{elapsed * 1e6:8.1f} us  {len(sample):5d} chars  {title!r}")
@@ -0,0 +1,97 @@
+"""
+Benchmark the database work of a chat turn, with the provider left out
+
+Compares the old autocommit write path (one commit per statement, title saved
+before the reply) against the two-transaction pipeline in
+api.services.chat_turn. Both write to the configured default database under a
+throwaway user, which is deleted afterwards. With the provider stubbed out,
+the time per turn is database time (including commits) plus ORM overhead.
+"""
+import time
+import uuid
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.models import Chat, ChatMessage, CustomUser
+from api.services import chat_turn
+
+REPLY = "A synthetic reply that stands in for the provider's output. " * 8
+
+
+class StatementCounter:
+    """Execute wrapper counting the statements a turn sends"""
+
+    def __init__(self):
+        self.statements = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements += 1
+        return execute(sql, params, many, context)
+
+
+def legacy_turn(user, chat_id, content):
+    """The write path before the pipeline: autocommit, title first"""
+    chat, created = Chat.objects.get_or_create(
+        id=chat_id, defaults={'user': user, 'model_type': 'gemini', 'language': 'en'},
+    )
+    if created or not chat.title:
+        chat.title = content[:50]
+        chat.model_type = 'gemini'
+        chat.language = 'en'
+        chat.save()
+    ChatMessage.objects.create(role="user", chat=chat, content=content)
+    history = [{"role": msg.role, "content": msg.content} for msg in chat.messages.order_by("created_at")]
+    ChatMessage.objects.create(
+        role="assistant", content=REPLY, chat=chat, model_used='gemini', tokens_used=len(history),
+    )
+
+
+def pipeline_turn(user, chat_id, content):
+    turn = chat_turn.prepare_turn(user, chat_id, content)
+    chat_turn.complete_turn(turn, {
+        'content': REPLY, 'model_used': 'gemini', 'tokens_used': len(turn.history), 'is_truncated': False,
+    })
+
+
+class Command(BaseCommand):
+    help = "Measure database time and queries per chat turn for the legacy and pipelined write paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chats', type=int, default=50)
+        parser.add_argument('--turns', type=int, default=10, help="Turns per chat; the first one creates the chat")
+
+    def handle(self, *args, **options):
+        stamp = time.time_ns()
+        user = CustomUser.objects.create_user(
+            username=f"turn-bench-{stamp}", email=f"turn-bench-{stamp}@example.invalid", password=None,
+        )
+        self.stdout.write(f"Database: {connection.vendor} {connection.settings_dict['NAME']}")
+        try:
+            # The title call is a provider call too; use the fallback title
+            with mock.patch.object(chat_turn, 'create_chat_title', lambda content, model_name='gemini', user_id=None: content[:50]):
+                for label, run in (('legacy', legacy_turn), ('pipeline', pipeline_turn)):
+                    self._run(label, run, user, options['chats'], options['turns'])
+        finally:
+            user.delete()
+
+    def _run(self, label, run, user, chat_count, turns):
+        counters = {'first': StatementCounter(), 'follow-up': StatementCounter()}
+        elapsed = {'first': 0.0, 'follow-up': 0.0}
+        for _ in range(chat_count):
+            chat_id = uuid.uuid4()
+            for i in range(turns):
+                kind = 'first' if i == 0 else 'follow-up'
+                start = time.perf_counter()
+                with connection.execute_wrapper(counters[kind]):
+                    run(user, chat_id, f"Question number {i} about something worth a title")
+                elapsed[kind] += time.perf_counter() - start
+        counts = {'first': chat_count, 'follow-up': chat_count * (turns - 1)}
+        for kind, counter in counters.items():
+            if not counts[kind]:
+                continue
+            self.stdout.write(
+                f"{label:>8} {kind:<9}: {elapsed[kind] / counts[kind] * 1e3:.2f} ms per turn, "
+                f"{counter.statements / counts[kind]:.1f} statements"
+            )
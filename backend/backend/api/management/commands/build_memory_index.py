@@ -0,0 +1,47 @@
+"""
+Rebuild users' cross-chat memory indexes from their stored messages
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import ChatMessage, CustomUser
+from api.services import lexical_vectors, memory
+from api.services.archive import iter_archived_messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the cross-chat memory index of every user (or of --user) from their messages, "
+        "including archived ones. Use it to backfill messages stored before memory existed and to "
+        "drop rows of deleted messages."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, default=None, help="Only rebuild this user id's index")
+        parser.add_argument('--batch', type=int, default=1000, help="Messages vectorized per write")
+
+    def handle(self, *args, **options):
+        if not lexical_vectors.available():
+            raise CommandError("NumPy is required for cross-chat memory")
+        users = CustomUser.objects.order_by('id')
+        if options['user'] is not None:
+            users = users.filter(id=options['user'])
+        for user in users.iterator():
+            index = memory.MemoryIndex.for_user(user.id)
+            index.delete()
+            batch, total = [], 0
+            hot = ChatMessage.objects.filter(chat__user=user).only('id', 'chat_id', 'content').order_by('id')
+            archived = (
+                ChatMessage(id=record['id'], chat_id=record['chat_id'], content=record['content'])
+                for record in iter_archived_messages(user)
+            )
+            for messages in (hot.iterator(chunk_size=options['batch']), archived):
+                for message in messages:
+                    batch.append(message)
+                    if len(batch) >= options['batch']:
+                        memory.remember(user.id, batch)
+                        total += len(batch)
+                        batch = []
+            if batch:
+                memory.remember(user.id, batch)
+                total += len(batch)
+            self.stdout.write(f"User {user.id}: {total} messages, {len(index)} indexed")
@@ -0,0 +1,51 @@
+"""
+Build the IDF table used for local chat titles from stored user messages
+"""
+import json
+import os
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.models import ChatMessage
+from api.services.titles import idf_value, keywords
+
+
+class Command(BaseCommand):
+    help = (
+        "Count in how many user messages each keyword appears and write the "
+        "inverse document frequencies to CHAT_TITLE_IDF_PATH. Workers read the "
+        "table on their first title, so restart them to pick up a new one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help="Defaults to CHAT_TITLE_IDF_PATH")
+        parser.add_argument('--min-df', type=int, default=2, help="Drop terms seen in fewer messages")
+        parser.add_argument('--max-terms', type=int, default=50000, help="Keep the most frequent terms")
+
+    def handle(self, *args, **options):
+        output = Path(options['output'] or settings.CHAT_TITLE_IDF_PATH)
+        document_frequency = Counter()
+        documents = 0
+        contents = ChatMessage.objects.filter(role='user').values_list('content', flat=True)
+        for content in contents.iterator(chunk_size=2000):
+            document_frequency.update(set(keywords(content)))
+            documents += 1
+
+        kept = [
+            (term, count) for term, count in document_frequency.most_common(options['max_terms'])
+            if count >= options['min_df']
+        ]
+        table = {
+            'documents': documents,
+            'idf': {term: round(idf_value(documents, count), 4) for term, count in kept},
+        }
+        output.parent.mkdir(parents=True, exist_ok=True)
+        temporary = output.with_suffix('.tmp')
+        temporary.write_text(json.dumps(table, ensure_ascii=False), encoding='utf-8')
+        os.replace(temporary, output)
+        self.stdout.write(
+            f"Wrote {len(kept)} of {len(document_frequency)} terms from {documents} messages to {output}"
+        )
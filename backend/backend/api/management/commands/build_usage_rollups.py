@@ -0,0 +1,29 @@
+"""
+Rebuild users' usage rollups from their stored messages
+"""
+from django.core.management.base import BaseCommand
+
+from api.models import CustomUser
+from api.services import usage
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-day, per-model usage rollups of every user (or of --user) from their assistant "
+        "messages, including archived ones. Use it to backfill usage from before rollups existed; usage of "
+        "messages deleted since is not recovered."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, default=None, help="Only rebuild this user id's rollups")
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.order_by('id')
+        if options['user'] is not None:
+            users = users.filter(id=options['user'])
+        total = 0
+        for user in users.iterator():
+            rows = usage.rebuild(user)
+            total += rows
+            self.stdout.write(f"User {user.id}: {rows} rollups")
+        self.stdout.write(f"Rebuilt {total} rollups")
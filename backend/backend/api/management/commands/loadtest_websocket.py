@@ -0,0 +1,143 @@
+"""
+In-process load test of the WebSocket chat transport
+
+Drives api.websocket.websocket_application directly with in-memory ASGI
+channels, so it measures the cost of the transport itself (authentication,
+per-connection state, fan-out) without a network or an ASGI server in front.
+"""
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.authentication import user_cache
+from api.models import CustomUser
+from api.services.realtime import broadcaster
+from api.websocket import websocket_application
+
+
+class Client:
+    """An in-memory WebSocket client speaking raw ASGI to the application"""
+
+    def __init__(self, token: str):
+        self.token = token
+        self.inbox = asyncio.Queue()
+        self.outbox = asyncio.Queue()
+        self.task = None
+
+    async def connect(self):
+        scope = {
+            'type': 'websocket', 'path': '/ws/chat/', 'query_string': b'', 'headers': [], 'subprotocols': [],
+        }
+        self.task = asyncio.create_task(websocket_application(scope, self.inbox.get, self.outbox.put))
+        await self.inbox.put({'type': 'websocket.connect'})
+        accept = await self.outbox.get()
+        assert accept['type'] == 'websocket.accept', accept
+        await self.inbox.put({'type': 'websocket.receive', 'text': json.dumps({'type': 'auth', 'token': self.token})})
+        ready = await self.event()
+        assert ready['type'] == 'ready', ready
+
+    async def event(self):
+        message = await self.outbox.get()
+        if message['type'] != 'websocket.send':
+            raise RuntimeError(f"Connection closed: {message}")
+        return json.loads(message['text'])
+
+    async def request(self, data):
+        await self.inbox.put({'type': 'websocket.receive', 'text': json.dumps(data)})
+        return await self.event()
+
+    async def close(self):
+        await self.inbox.put({'type': 'websocket.disconnect', 'code': 1000})
+        await self.task
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e3  # noqa: E731
+    return f"p50 {pick(0.50):.2f} ms, p95 {pick(0.95):.2f} ms, p99 {pick(0.99):.2f} ms"
+
+
+class Command(BaseCommand):
+    help = "Open many concurrent WebSocket connections in one process and measure handshake, ping and fan-out cost."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=100, help="Connections are spread evenly over this many users")
+        parser.add_argument('--pings', type=int, default=5, help="Pings per connection")
+
+    def handle(self, *args, **options):
+        stamp = time.time_ns()
+        users = [
+            CustomUser.objects.create_user(
+                username=f"ws-load-{stamp}-{i}", email=f"ws-load-{stamp}-{i}@example.invalid", password=None,
+            )
+            for i in range(options['users'])
+        ]
+        try:
+            tokens = [str(RefreshToken.for_user(user).access_token) for user in users]
+            asyncio.run(self._run(users, tokens, options['connections'], options['pings']))
+        finally:
+            for user in users:
+                user_cache.invalidate(user.pk)
+            CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    async def _run(self, users, tokens, count, pings):
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        clients = [Client(tokens[i % len(tokens)]) for i in range(count)]
+
+        start = time.perf_counter()
+        handshakes = []
+        for batch in range(0, count, 100):
+            async def timed(client):
+                begin = time.perf_counter()
+                await client.connect()
+                handshakes.append(time.perf_counter() - begin)
+            await asyncio.gather(*(timed(client) for client in clients[batch:batch + 100]))
+        connect_time = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0] - baseline
+        self.stdout.write(
+            f"{count} connections for {len(users)} users open in {connect_time:.2f} s "
+            f"({broadcaster.connection_count()} subscribed), ~{memory / count / 1024:.1f} KiB each"
+        )
+        self.stdout.write(f"Handshake with JWT auth: {_percentiles(handshakes)}")
+
+        round_trips = []
+
+        async def ping(client):
+            for _ in range(pings):
+                begin = time.perf_counter()
+                reply = await client.request({'type': 'ping'})
+                assert reply['type'] == 'pong', reply
+                round_trips.append(time.perf_counter() - begin)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(ping(client) for client in clients))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Ping: {len(round_trips) / elapsed:.0f} round trips/s with all connections active, "
+            f"{_percentiles(round_trips)}"
+        )
+
+        # One event per user reaches every connection of that user, as a streamed delta would
+        fan_out = []
+
+        async def receive(client, sent_at):
+            event = await client.event()
+            assert event['type'] == 'delta', event
+            fan_out.append(time.perf_counter() - sent_at)
+
+        sent_at = time.perf_counter()
+        for user in users:
+            broadcaster.publish(user.pk, {'type': 'delta', 'chat_id': 'load-test', 'content': 'x' * 32})
+        await asyncio.gather(*(receive(client, sent_at) for client in clients))
+        self.stdout.write(f"Fan-out of one event per user to {count} connections: {_percentiles(fan_out)}")
+
+        await asyncio.gather(*(client.close() for client in clients))
+        tracemalloc.stop()
+        self.stdout.write(f"Closed; {broadcaster.connection_count()} connections left subscribed")
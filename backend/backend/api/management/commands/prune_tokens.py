@@ -0,0 +1,39 @@
+"""
+Delete expired outstanding and blacklisted JWT refresh tokens in batches
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired rows from the token blacklist tables. Unlike "
+        "flushexpiredtokens it works in short batches so it can run "
+        "periodically (e.g. hourly from cron) without holding long locks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        outstanding = blacklisted = 0
+        while True:
+            ids = list(
+                OutstandingToken.objects.filter(expires_at__lte=now)
+                .order_by('id')
+                .values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                blacklisted += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+                outstanding += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+
+        remaining = OutstandingToken.objects.count()
+        self.stdout.write(
+            f"Pruned {outstanding} expired outstanding tokens and {blacklisted} blacklist entries; "
+            f"{remaining} outstanding tokens remain"
+        )
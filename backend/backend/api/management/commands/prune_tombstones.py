@@ -0,0 +1,33 @@
+"""
+Delete chat tombstones older than the sync retention window in batches
+"""
+from django.core.management.base import BaseCommand
+
+from api.models import ChatTombstone
+from api.services.sync import tombstone_horizon
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete tombstones of chats deleted more than SYNC_TOMBSTONE_RETENTION_DAYS "
+        "ago. Clients that last synced before then are told to resync fully, so "
+        "nothing relies on them. Run it periodically, e.g. daily from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        horizon = tombstone_horizon()
+        pruned = 0
+        while True:
+            ids = list(
+                ChatTombstone.objects.filter(deleted_at__lt=horizon)
+                .values_list('chat_id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            pruned += ChatTombstone.objects.filter(chat_id__in=ids).delete()[0]
+
+        remaining = ChatTombstone.objects.count()
+        self.stdout.write(f"Pruned {pruned} tombstones deleted before {horizon:%Y-%m-%d}; {remaining} remain")
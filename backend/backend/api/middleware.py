@@ -0,0 +1,226 @@
+"""
+Middleware for the api app
+"""
+import gzip
+import logging
+import math
+import re
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+
+from api.utils.error_messages import ErrorMessages, get_user_language
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+_ACCEPT_ENCODING_RE = re.compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?')
+
+
+def _accepted_encodings(header: str) -> set:
+    """Codings from an Accept-Encoding header, minus the ones refused with q=0"""
+    accepted = set()
+    for part in header.split(','):
+        match = _ACCEPT_ENCODING_RE.match(part)
+        if not match:
+            continue
+        coding, quality = match.group(1).lower(), match.group(2)
+        try:
+            if quality is not None and float(quality) <= 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding)
+    return accepted
+
+
+class CompressionMiddleware:
+    """
+    Brotli or gzip compression for API responses
+
+    Only responses under API_COMPRESSION_PATH_PREFIX of at least
+    API_COMPRESSION_MIN_SIZE bytes are compressed. Streaming responses (chat
+    export, generation streams) are passed through untouched so every chunk
+    still reaches the client as soon as it is written. Brotli is used when the
+    ``brotli`` package is installed and the client accepts it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'API_COMPRESSION_MIN_SIZE', 1024)
+        self.path_prefix = getattr(settings, 'API_COMPRESSION_PATH_PREFIX', '/api/')
+        self.gzip_level = getattr(settings, 'API_COMPRESSION_GZIP_LEVEL', 6)
+        self.brotli_quality = getattr(settings, 'API_COMPRESSION_BROTLI_QUALITY', 5)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not request.path.startswith(self.path_prefix):
+            return response
+        return self.compress(request, response)
+
+    def compress(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        # Whether or not this response is compressed, caches must key on the header
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < self.min_size:
+            return response
+
+        accepted = _accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in accepted:
+            coding = 'br'
+            body = brotli.compress(response.content, quality=self.brotli_quality)
+        elif 'gzip' in accepted:
+            coding = 'gzip'
+            body = gzip.compress(response.content, compresslevel=self.gzip_level, mtime=0)
+        else:
+            return response
+        if len(body) >= len(response.content):
+            return response
+
+        response.content = body
+        response.headers['Content-Length'] = str(len(body))
+        response.headers['Content-Encoding'] = coding
+        # The compressed body differs byte for byte, so a strong ETag would be wrong
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
+
+
+class BackpressureMiddleware:
+    """
+    Bound the generation requests a worker process serves at once
+
+    Requests to the views named in BACKPRESSURE_VIEWS (the reply endpoints,
+    which hold a worker thread for as long as the provider takes) run at most
+    BACKPRESSURE_MAX_IN_FLIGHT at a time. Up to BACKPRESSURE_MAX_QUEUE more
+    wait for a slot, each for at most BACKPRESSURE_QUEUE_TIMEOUT seconds.
+    Anything beyond that is shed at once with 503 and a Retry-After estimated
+    from recent request durations, so a provider slowdown cannot take every
+    thread of the process and every other endpoint keeps responding. A
+    streamed reply keeps its slot until the server closes the response.
+
+    Under ASGI the middleware runs on the event loop, and a queued request
+    waits in an executor thread rather than on the loop or on the single
+    thread Django runs sync code on, so it queues just as under WSGI while
+    other requests carry on.
+    """
+
+    # Weight of the newest request in the average duration
+    SMOOTHING = 0.2
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.views = set(getattr(settings, 'BACKPRESSURE_VIEWS', ('prompt_gpt',)))
+        self.max_in_flight = getattr(settings, 'BACKPRESSURE_MAX_IN_FLIGHT', 16)
+        self.max_queue = getattr(settings, 'BACKPRESSURE_MAX_QUEUE', 32)
+        self.queue_timeout = getattr(settings, 'BACKPRESSURE_QUEUE_TIMEOUT', 2.0)
+        self.in_flight = 0
+        self.waiting = 0
+        self.average_duration = 1.0
+        self._condition = threading.Condition()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self._limited(request):
+            return self.get_response(request)
+        if not self._acquire():
+            return self._shed(request)
+        start = time.monotonic()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self._release(start)
+            raise
+        return self._hold_until_closed(response, start)
+
+    async def __acall__(self, request):
+        if not self._limited(request):
+            return await self.get_response(request)
+        if not await sync_to_async(self._acquire, thread_sensitive=False)():
+            return self._shed(request)
+        start = time.monotonic()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            self._release(start)
+            raise
+        return self._hold_until_closed(response, start)
+
+    def _hold_until_closed(self, response, start: float):
+        """Release the slot now, or for a streamed response once it is closed"""
+        if not response.streaming:
+            self._release(start)
+            return response
+        close = response.close
+        released = threading.Lock()
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                # Servers may close a response more than once; only the first close releases
+                if released.acquire(blocking=False):
+                    self._release(start)
+
+        response.close = close_and_release
+        return response
+
+    def _limited(self, request) -> bool:
+        if request.method != 'POST':
+            return False
+        try:
+            return resolve(request.path_info).url_name in self.views
+        except Resolver404:
+            return False
+
+    def _acquire(self) -> bool:
+        with self._condition:
+            if self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                return True
+            if self.waiting >= self.max_queue:
+                return False
+            self.waiting += 1
+            try:
+                if not self._condition.wait_for(lambda: self.in_flight < self.max_in_flight, self.queue_timeout):
+                    return False
+                self.in_flight += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def _release(self, start: float) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self.average_duration += self.SMOOTHING * (time.monotonic() - start - self.average_duration)
+            self._condition.notify()
+
+    def _shed(self, request):
+        with self._condition:
+            # Time for the requests ahead to drain through the slots
+            retry_after = max(1, math.ceil(self.average_duration * (self.waiting + 1) / self.max_in_flight))
+            logger.warning(
+                f"Shedding {request.path}: {self.in_flight} in flight, {self.waiting} waiting, retry after {retry_after}s"
+            )
+        error_response = ErrorMessages.create_error_response('server_overloaded', get_user_language(request))
+        response = JsonResponse(error_response, status=503)
+        response['Retry-After'] = str(retry_after)
+        return response
@@ -0,0 +1,85 @@
+import re
+
+from django.db import migrations
+
+# Frozen copies of api.services.search as of this migration, so it replays
+# the same way whatever that module becomes
+FTS_TABLE = 'api_chatmessage_fts'
+PG_TABLE = 'api_chatmessage_search'
+
+_ARABIC_DIACRITICS = re.compile('[\u064B-\u065F\u0670\u0640]')
+_ARABIC_LETTER_VARIANTS = str.maketrans({
+    '\u0623': '\u0627',
+    '\u0625': '\u0627',
+    '\u0622': '\u0627',
+    '\u0671': '\u0627',
+    '\u0649': '\u064A',
+})
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def normalize_text(text):
+    return _ARABIC_DIACRITICS.sub('', text or '').translate(_ARABIC_LETTER_VARIANTS)
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "user_id UNINDEXED, chat_id UNINDEXED, content, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        insert_sql = f"INSERT INTO {FTS_TABLE} (rowid, user_id, chat_id, content) VALUES (%s, %s, %s, %s)"
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE {PG_TABLE} ("
+            "message_id bigint PRIMARY KEY REFERENCES api_chatmessage (id) ON DELETE CASCADE "
+            "DEFERRABLE INITIALLY DEFERRED, "
+            "user_id bigint NOT NULL, "
+            "chat_id uuid NOT NULL, "
+            "content text NOT NULL, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(f"CREATE INDEX {PG_TABLE}_document_gin ON {PG_TABLE} USING GIN (document)")
+        schema_editor.execute(f"CREATE INDEX {PG_TABLE}_user_id ON {PG_TABLE} (user_id)")
+        insert_sql = (
+            f"INSERT INTO {PG_TABLE} (message_id, user_id, chat_id, content, document) "
+            "VALUES (%s, %s, %s::uuid, %s, to_tsvector('simple', %s))"
+        )
+    else:
+        return
+
+    ChatMessage = apps.get_model('api', 'ChatMessage')
+    messages = ChatMessage.objects.values_list('id', 'chat__user_id', 'chat_id', 'content').order_by('id')
+    batch = []
+    with connection.cursor() as cursor:
+        for message_id, user_id, chat_id, content in messages.iterator(chunk_size=BACKFILL_BATCH_SIZE):
+            text = normalize_text(content)
+            row = (message_id, user_id, chat_id.hex, text)
+            batch.append(row if connection.vendor == 'sqlite' else (*row, text))
+            if len(batch) >= BACKFILL_BATCH_SIZE:
+                cursor.executemany(insert_sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert_sql, batch)
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {PG_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_alter_chat_model_type'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_preserve_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatArchive',
+            fields=[
+                ('chat', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='api.chat')),
+                ('payload', models.BinaryField(help_text='zlib-compressed JSON list of the archived messages')),
+                ('message_count', models.IntegerField()),
+                ('raw_bytes', models.IntegerField(help_text='Size of the uncompressed message content')),
+                ('last_message', models.JSONField(blank=True, help_text='Preview of the newest message for chat lists', null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, help_text='Set while the messages live in ChatArchive', null=True),
+        ),
+    ]
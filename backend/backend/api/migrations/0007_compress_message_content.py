@@ -0,0 +1,67 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:17
+
+import api.fields
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def _rewrite_messages(schema_editor, min_length, transform):
+    """Apply transform to stored content of messages at least min_length long, in id order"""
+    last_id = 0
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                "SELECT id, content FROM api_chatmessage WHERE id > %s AND LENGTH(content) >= %s "
+                "ORDER BY id LIMIT %s",
+                [last_id, min_length, BATCH_SIZE],
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            updates = [(transform(content), pk) for pk, content in rows]
+            cursor.executemany(
+                "UPDATE api_chatmessage SET content = %s WHERE id = %s",
+                [(content, pk) for content, pk in updates if content is not None],
+            )
+            last_id = rows[-1][0]
+
+
+def compress_existing_messages(apps, schema_editor):
+    def compress(content):
+        if content.startswith(api.fields.COMPRESSED_PREFIX):
+            return None
+        stored = api.fields.compress_text(content)
+        return stored if stored != content else None
+
+    _rewrite_messages(schema_editor, api.fields.DEFAULT_COMPRESS_THRESHOLD, compress)
+
+
+def decompress_messages(apps, schema_editor):
+    def decompress(content):
+        if not content.startswith(api.fields.COMPRESSED_PREFIX):
+            return None
+        return api.fields.decompress_text(content)
+
+    _rewrite_messages(schema_editor, len(api.fields.COMPRESSED_PREFIX), decompress)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_chat_archive'),
+    ]
+
+    operations = [
+        # The column stays a text column, so only the model state changes
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='chatmessage',
+                    name='content',
+                    field=api.fields.CompressedTextField(),
+                ),
+            ],
+        ),
+        migrations.RunPython(compress_existing_messages, decompress_messages),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_compress_message_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatTombstone',
+            fields=[
+                ('chat_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['user', 'updated_at'], name='api_chat_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['chat', 'created_at', 'id'], name='api_msg_chat_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='chattombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_tombstones', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='chattombstone',
+            index=models.Index(fields=['user', 'deleted_at'], name='api_tombstone_user_del_idx'),
+        ),
+    ]
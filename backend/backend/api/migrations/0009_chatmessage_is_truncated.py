@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_chat_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='is_truncated',
+            field=models.BooleanField(default=False, help_text='Generation was stopped before the reply was complete'),
+        ),
+    ]
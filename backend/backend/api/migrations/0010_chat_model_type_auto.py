@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_chatmessage_is_truncated'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chat',
+            name='model_type',
+            field=models.CharField(choices=[('gemini', 'Google Gemini'), ('deepseek', 'DeepSeek'), ('llama', 'Meta Llama'), ('gpt-4', 'OpenAI GPT-4'), ('claude', 'Anthropic Claude'), ('groq', 'Groq (Llama 3.3)'), ('auto', 'Automatic')], default='gemini', max_length=50),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_documents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('model', models.CharField(blank=True, default='', help_text='model_used of the messages; blank if unknown', max_length=50)),
+                ('messages', models.IntegerField(default=0)),
+                ('tokens', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['day', 'model'],
+                'indexes': [models.Index(fields=['day'], name='api_usage_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'day', 'model'), name='api_usage_user_day_model_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+INDEX_NAME = 'api_blacklisted_at_idx'
+
+
+class Migration(migrations.Migration):
+    """
+    Index the blacklist by time, which api.token_blacklist syncs by
+
+    The table belongs to rest_framework_simplejwt.token_blacklist, so this is
+    deliberately plain SQL outside that app's model state: its migrations
+    never see the index and cannot clash with the api_ prefixed name. An
+    AlterField of blacklisted_at in a future simplejwt release may rebuild
+    the table without it on SQLite; the filter then syncs by a table scan
+    until a new migration here recreates it. Both statements are valid on
+    SQLite and PostgreSQL, and a test runs them on the configured backend.
+    """
+
+    dependencies = [
+        ('api', '0012_usage_rollups'),
+        ('token_blacklist', '0013_alter_blacklistedtoken_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON token_blacklist_blacklistedtoken (blacklisted_at)",
+            reverse_sql=f"DROP INDEX IF EXISTS {INDEX_NAME}",
+        ),
+    ]
@@ -2,6 +2,9 @@ import uuid
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.fields import CompressedTextField
 
 # Create your models here.
 
@@ -33,6 +36,7 @@ class Chat(models.Model):
         ('gpt-4', 'OpenAI GPT-4'),
         ('claude', 'Anthropic Claude'),
         ('groq', 'Groq (Llama 3.3)'),
+        ('auto', 'Automatic'),
     ]
     
     LANGUAGE_CHOICES = [
@@ -45,21 +49,31 @@ class Chat(models.Model):
     title = models.CharField(max_length=255, blank=True, null=True)  # Optional, for UI display
     model_type = models.CharField(max_length=50, choices=MODEL_CHOICES, default='gemini')
     language = models.CharField(max_length=5, choices=LANGUAGE_CHOICES, default='en')
-    created_at = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add so imported chats keep their timestamps
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
+    archived_at = models.DateTimeField(blank=True, null=True, help_text="Set while the messages live in ChatArchive")
 
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Chat lists and the "chats changed since" sync feed
+            models.Index(fields=['user', 'updated_at'], name='api_chat_user_updated_idx'),
+        ]
 
     def __str__(self):
         return self.title or f"Chat {self.id}"
 
     def get_message_count(self):
         """Return the number of messages in this chat"""
+        if self.archived_at:
+            return self.archive.message_count
         return self.messages.count()
 
     def get_last_message(self):
         """Return the last message in this chat"""
+        if self.archived_at:
+            return self.archive.get_last_message()
         return self.messages.order_by('-created_at').first()
 
 
@@ -73,13 +87,107 @@ class ChatMessage(models.Model):
 
     chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name="messages")
     role = models.CharField(max_length=15, choices=ROLES)
-    content = models.TextField()
+    content = CompressedTextField()
     model_used = models.CharField(max_length=50, blank=True, null=True, help_text="Specific model used for this message")
     tokens_used = models.IntegerField(blank=True, null=True, help_text="Number of tokens used for this message")
-    created_at = models.DateTimeField(auto_now_add=True)
+    is_truncated = models.BooleanField(default=False, help_text="Generation was stopped before the reply was complete")
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Keyset reads of a chat's messages in (created_at, id) order
+            models.Index(fields=['chat', 'created_at', 'id'], name='api_msg_chat_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.role}: {self.content[:50]}"
+
+
+class ChatArchive(models.Model):
+    """Cold storage for the messages of an inactive chat, as one compressed blob"""
+    chat = models.OneToOneField(Chat, on_delete=models.CASCADE, primary_key=True, related_name="archive")
+    payload = models.BinaryField(help_text="zlib-compressed JSON list of the archived messages")
+    message_count = models.IntegerField()
+    raw_bytes = models.IntegerField(help_text="Size of the uncompressed message content")
+    last_message = models.JSONField(blank=True, null=True, help_text="Preview of the newest message for chat lists")
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archive of {self.chat_id} ({self.message_count} messages)"
+
+    def get_last_message(self):
+        """Return the newest archived message as an unsaved ChatMessage"""
+        if not self.last_message:
+            return None
+        return ChatMessage(
+            chat_id=self.chat_id,
+            role=self.last_message['role'],
+            content=self.last_message['content'],
+            created_at=parse_datetime(self.last_message['created_at']),
+        )
+
+
+class ChatTombstone(models.Model):
+    """Record of a deleted chat, so sync clients can drop it from their local state"""
+    chat_id = models.UUIDField(primary_key=True)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="chat_tombstones")
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='api_tombstone_user_del_idx'),
+        ]
+
+    def __str__(self):
+        return f"Deleted chat {self.chat_id}"
+
+
+class Document(models.Model):
+    """A text document a user uploaded to ground their chats in"""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="documents")
+    name = models.CharField(max_length=255)
+    size_bytes = models.IntegerField()
+    chunk_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.name
+
+
+class DocumentChunk(models.Model):
+    """One retrievable passage of a document; its vector lives in the user's index file"""
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name="chunks")
+    position = models.IntegerField(help_text="Order of the chunk within its document")
+    content = CompressedTextField()
+
+    class Meta:
+        ordering = ['document', 'position']
+
+    def __str__(self):
+        return f"{self.document.name} #{self.position}"
+
+
+class UsageRollup(models.Model):
+    """Assistant messages and tokens of one user, model and day, kept up to date as replies are saved"""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="usage_rollups")
+    day = models.DateField()
+    model = models.CharField(max_length=50, blank=True, default='', help_text="model_used of the messages; blank if unknown")
+    messages = models.IntegerField(default=0)
+    tokens = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ['day', 'model']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day', 'model'], name='api_usage_user_day_model_uniq'),
+        ]
+        indexes = [
+            # Usage across all users over a range of days
+            models.Index(fields=['day'], name='api_usage_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.day} {self.model or '-'}: {self.tokens} tokens"
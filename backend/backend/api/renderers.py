@@ -0,0 +1,59 @@
+"""
+orjson-backed DRF renderer, falling back to the stock renderer when orjson is missing,
+and the event stream renderer for streamed replies
+"""
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    Render JSON with orjson
+
+    Output matches JSONRenderer: compact, UTF-8, and types orjson does not
+    handle itself (datetimes included, so they keep DRF's millisecond 'Z'
+    format) go through DRF's JSONEncoder. Indented output, requested via the
+    media type or the browsable API, is left to the stock renderer.
+    """
+    if orjson is not None:
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        ret = orjson.dumps(data, default=_default, option=self.options)
+        # Keep the output a strict JavaScript subset, as JSONRenderer does
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    return _encoder.default(obj)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets views that stream server-sent events pass content negotiation
+
+    The events themselves are written by a StreamingHttpResponse; this only
+    renders the plain Responses such views return on errors, as one event.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        event = 'error' if response is not None and response.status_code >= 400 else 'message'
+        return f"event: {event}\ndata: {ORJSONRenderer().render(data).decode()}\n\n".encode()
@@ -1,7 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
-from api.models import Chat, ChatMessage, CustomUser, UserProfile
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from api.models import Chat, ChatMessage, CustomUser, Document, UserProfile
+from api.token_blacklist import FilteredRefreshToken
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -62,6 +64,11 @@ class UserLoginSerializer(serializers.Serializer):
             raise serializers.ValidationError('Must provide email and password')
 
 
+class FilteredTokenRefreshSerializer(TokenRefreshSerializer):
+    """Token refresh that checks the blacklist filter before the database"""
+    token_class = FilteredRefreshToken
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomUser
@@ -107,8 +114,15 @@ class ChatSerializer(serializers.ModelSerializer):
 class ChatMessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatMessage 
-        fields = ['id', 'role', 'content', 'model_used', 'tokens_used', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'role', 'content', 'model_used', 'tokens_used', 'is_truncated', 'created_at']
+        read_only_fields = ['id', 'is_truncated', 'created_at']
+
+
+class DocumentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Document
+        fields = ['id', 'name', 'size_bytes', 'chunk_count', 'created_at']
+        read_only_fields = fields
 
 
 class ChatMessageCreateSerializer(serializers.ModelSerializer):
@@ -123,4 +137,5 @@ class AIModelSerializer(serializers.Serializer):
     name = serializers.CharField()
     provider = serializers.CharField()
     display_name = serializers.CharField()
-    is_available = serializers.BooleanField(default=True)
\ No newline at end of file
+    is_available = serializers.BooleanField(default=True)
+    status = serializers.CharField(default='unknown')
\ No newline at end of file
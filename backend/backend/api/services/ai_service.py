@@ -2,8 +2,19 @@
 Abstract AI Provider base class and service manager for handling multiple AI providers
 """
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+import hashlib
+import json
 import logging
+import threading
+import time
+
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from api.services import routing
+from api.services.provider_limits import backoff_delay, is_retryable
+from api.services.scheduler import Priority, ProviderScheduler, queue_deadline
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +40,22 @@ class AIProvider(ABC):
         """
         pass
     
+    def stream_response(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[Dict[str, Any]]:
+        """
+        Generate a response as a stream of events
+        
+        Yields {'type': 'delta', 'content': ...} for each piece of text, then
+        a final {'type': 'done', ...} with 'tokens_used', 'model_used' and
+        'provider', or {'type': 'error', 'error': ...} if the call failed.
+        Providers without native streaming deliver the whole reply as one delta.
+        """
+        response = self.generate_response(messages, **kwargs)
+        if 'error' in response:
+            yield {'type': 'error', **response}
+            return
+        yield {'type': 'delta', 'content': response.get('content', '')}
+        yield {'type': 'done', **{k: v for k, v in response.items() if k != 'content'}}
+    
     @abstractmethod
     def validate_api_key(self) -> bool:
         """Validate the API key for this provider"""
@@ -47,39 +74,88 @@ class AIProvider(ABC):
         pass
 
 
+def iter_sse_data(response) -> Iterator[Dict[str, Any]]:
+    """Decode the JSON payloads of a server-sent events HTTP response"""
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith('data:'):
+            continue
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return
+        try:
+            yield json.loads(data)
+        except ValueError:
+            logger.warning(f"Skipping malformed stream event: {data[:100]}")
+
+
+class ProviderHealth:
+    """Rolling latency and error statistics for one model, fed by real calls"""
+
+    # Weight of the newest observation in the moving averages
+    SMOOTHING = 0.2
+
+    def __init__(self):
+        self.calls = 0
+        self.latency = None
+        self.error_rate = 0.0
+
+    def record(self, ok: bool, latency: float) -> None:
+        self.calls += 1
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.SMOOTHING * (latency - self.latency)
+        self.error_rate += self.SMOOTHING * ((0.0 if ok else 1.0) - self.error_rate)
+
+    @property
+    def status(self) -> str:
+        if self.calls == 0:
+            return 'unknown'
+        if self.error_rate > 0.5:
+            return 'down'
+        if self.error_rate > 0.2:
+            return 'degraded'
+        return 'healthy'
+
+
 class AIServiceManager:
     """Manager class for handling multiple AI providers"""
-    
+
+    PROVIDER_LABELS = {
+        'gemini': 'Google Gemini',
+        'gpt-4': 'OpenAI',
+        'deepseek': 'DeepSeek',
+        'claude': 'Anthropic Claude',
+        'groq': 'Groq',
+    }
+
+    # Model name -> (API key setting, provider class). Provider modules, and the
+    # SDKs they wrap, are imported on a model's first use, not at startup.
+    PROVIDER_REGISTRY = {
+        'gemini': ('GEMINI_API_KEY', 'api.services.gemini_provider.GeminiProvider'),
+        'gpt-4': ('OPENAI_API_KEY', 'api.services.openai_provider.OpenAIProvider'),
+        # DeepSeek uses OpenAI-compatible API
+        'deepseek': ('OPENAI_API_KEY', 'api.services.openai_provider.OpenAIProvider'),
+        'claude': ('ANTHROPIC_API_KEY', 'api.services.anthropic_provider.AnthropicProvider'),
+        'groq': ('GROQ_API_KEY', 'api.services.groq_provider.GroqProvider'),
+    }
+
     def __init__(self):
         self._providers = {}
+        self._health = {}
+        self._schedulers = {}
+        self._catalog = None
+        self._catalog_etag = None
+        self._lock = threading.Lock()
         self._initialize_providers()
     
     def _initialize_providers(self):
-        """Initialize all available providers"""
-        try:
-            from .gemini_provider import GeminiProvider
-            from .openai_provider import OpenAIProvider
-            from .anthropic_provider import AnthropicProvider
-            from .groq_provider import GroqProvider
-            
-            # Initialize providers (API keys will be loaded from settings)
-            from django.conf import settings
-            
-            if hasattr(settings, 'GEMINI_API_KEY') and settings.GEMINI_API_KEY:
-                self._providers['gemini'] = GeminiProvider
-            
-            if hasattr(settings, 'OPENAI_API_KEY') and settings.OPENAI_API_KEY:
-                self._providers['gpt-4'] = OpenAIProvider
-                self._providers['deepseek'] = OpenAIProvider  # DeepSeek uses OpenAI-compatible API
-                
-            if hasattr(settings, 'ANTHROPIC_API_KEY') and settings.ANTHROPIC_API_KEY:
-                self._providers['claude'] = AnthropicProvider
-            
-            if hasattr(settings, 'GROQ_API_KEY') and settings.GROQ_API_KEY:
-                self._providers['groq'] = GroqProvider
-                
-        except ImportError as e:
-            logger.warning(f"Failed to import provider: {e}")
+        """Register the models whose API key is configured, without importing their providers"""
+        from django.conf import settings
+
+        for model_name, (api_key_setting, provider_path) in self.PROVIDER_REGISTRY.items():
+            if getattr(settings, api_key_setting, None):
+                self._providers[model_name] = provider_path
     
     def get_provider(self, model_name: str) -> AIProvider:
         """
@@ -98,28 +174,260 @@ class AIServiceManager:
             raise ValueError(f"Model '{model_name}' is not supported. Available models: {list(self._providers.keys())}")
         
         provider_class = self._providers[model_name]
+        if isinstance(provider_class, str):
+            provider_class = self._load_provider(model_name, provider_class)
         return provider_class.create_instance(model_name)
+
+    def _load_provider(self, model_name: str, provider_path: str):
+        """Import a model's provider class on first use and keep it registered"""
+        try:
+            provider_class = import_string(provider_path)
+        except ImportError as e:
+            logger.warning(f"Failed to import provider for {model_name}: {e}")
+            raise ValueError(f"Model '{model_name}' is not available: {e}")
+        with self._lock:
+            if self._providers.get(model_name) == provider_path:
+                self._providers[model_name] = provider_class
+        return provider_class
     
-    def list_available_models(self) -> List[Dict[str, str]]:
+    def reload(self):
+        """Re-read provider configuration from settings and drop the model catalog"""
+        with self._lock:
+            self._providers = {}
+            self._initialize_providers()
+            self._catalog = None
+
+    def resolve_model(self, model_name: str, messages: List[Dict[str, str]]) -> str:
+        """The model to call: model_name itself, or the routing decision for 'auto'"""
+        if model_name != routing.AUTO_MODEL:
+            return model_name
+        return self.route(messages)
+
+    def route(self, messages: List[Dict[str, str]]) -> str:
         """
-        List all available models with their providers
+        Pick the configured model best suited to a conversation
+
+        Models that are currently down are only considered if nothing else is
+        configured.
+
+        Raises:
+            ValueError: If no model is configured
+        """
+        with self._lock:
+            health = {name: self._health.get(name, ProviderHealth()) for name in self._providers}
+        candidates = [name for name, stats in health.items() if stats.status != 'down'] or list(health)
+        if not candidates:
+            raise ValueError("Model 'auto' is not supported: no AI providers are configured")
+
+        features = routing.extract_features(messages)
+        tier = routing.required_tier(features)
+        scores = {
+            name: routing.score_model(name, features, tier, health[name].latency, health[name].error_rate)
+            for name in candidates
+        }
+        choice = min(scores, key=scores.get)
+        logger.info(f"Routed auto request (tier {tier}, {features['prompt_chars']} chars) to {choice}")
+        return choice
+
+    def generate_response(self, model_name: str, messages: List[Dict[str, str]], *, user_id=None,
+                          priority: Priority = Priority.INTERACTIVE, **kwargs) -> Dict[str, Any]:
+        """
+        Generate a response with the model's provider and record its health
+
+        The call waits for a slot from the model's scheduler, which shares
+        slots fairly between users (``user_id``) within each ``priority``
+        class, and is retried with backoff if the provider is rate limited
+        or overloaded. Waiting, including retries, ends at the class's
+        queue deadline: a retry whose backoff would run past it is not
+        made, and the call answers 429 with the backoff as 'retry_after'.
+
+        Raises:
+            ValueError: If model is not supported
+        """
+        model_name = self.resolve_model(model_name, messages)
+        provider = self.get_provider(model_name)
+        scheduler = self.get_scheduler(model_name)
+        deadline = queue_deadline(priority)
+        attempt = 0
+        while True:
+            if not scheduler.acquire(user_id, priority, deadline=deadline):
+                return self._busy_response(model_name, scheduler)
+            start = time.monotonic()
+            response = None
+            try:
+                response = provider.generate_response(messages, **kwargs)
+            finally:
+                latency = time.monotonic() - start if response is not None else None
+                scheduler.release(latency, *self._failure(response))
+            self.record_result(model_name, 'error' not in response, latency)
+            delay = backoff_delay(attempt, response.get('retry_after')) if is_retryable(response) else None
+            if delay is None:
+                return response
+            if time.monotonic() + delay > deadline:
+                return self._retry_later_response(model_name, response, delay)
+            logger.warning(f"{model_name} answered {response['status_code']}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    def stream_response(self, model_name: str, messages: List[Dict[str, str]], *, user_id=None,
+                        priority: Priority = Priority.INTERACTIVE, **kwargs) -> Iterator[Dict[str, Any]]:
+        """
+        Stream a response with the model's provider and record its health
         
-        Returns:
-            List of dictionaries with 'name', 'provider', and 'display_name' keys
+        See AIProvider.stream_response for the events yielded. As with
+        generate_response, the call is scheduled and retried; a stream is
+        only retried if it failed before delivering any text.
+        
+        Raises:
+            ValueError: If model is not supported
         """
-        models = []
-        for model_name, provider_class in self._providers.items():
+        model_name = self.resolve_model(model_name, messages)
+        provider = self.get_provider(model_name)
+        events = self._scheduled_stream(model_name, provider, messages, user_id, priority, kwargs)
+        return self._record_stream(model_name, events)
+
+    def _scheduled_stream(self, model_name, provider, messages, user_id, priority, kwargs):
+        scheduler = self.get_scheduler(model_name)
+        deadline = queue_deadline(priority)
+        attempt = 0
+        while True:
+            if not scheduler.acquire(user_id, priority, deadline=deadline):
+                yield {'type': 'error', **self._busy_response(model_name, scheduler)}
+                return
+            start = time.monotonic()
+            latency = failure = delay = None
+            delivered = False
+            events = provider.stream_response(messages, **kwargs)
             try:
-                provider_instance = provider_class.create_instance(model_name)
-                models.append({
-                    'name': model_name,
-                    'provider': provider_instance.provider_name,
-                    'display_name': self._get_display_name(model_name),
-                })
-            except Exception as e:
-                logger.warning(f"Failed to initialize provider for {model_name}: {e}")
+                for event in events:
+                    if latency is None:
+                        # Time to the first event is what the provider's queueing shows up in
+                        latency = time.monotonic() - start
+                    if event['type'] == 'error':
+                        failure = event
+                        if not delivered and is_retryable(event):
+                            delay = backoff_delay(attempt, event.get('retry_after'))
+                            if delay is not None and time.monotonic() + delay > deadline:
+                                event, delay = self._retry_later_response(model_name, event, delay), None
+                            if delay is not None:
+                                break
+                    delivered = delivered or event['type'] == 'delta'
+                    yield event
+            finally:
+                events.close()
+                scheduler.release(latency, *self._failure(failure))
+            if delay is None:
+                return
+            self.record_result(model_name, False, latency)
+            logger.warning(f"{model_name} stream answered {failure['status_code']}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _failure(response: Optional[Dict[str, Any]]) -> Tuple[Optional[int], Optional[float]]:
+        """(status_code, retry_after) of a failed call for the limiter; (None, None) for a success"""
+        if not response or 'error' not in response:
+            return None, None
+        return response.get('status_code') or 0, response.get('retry_after')
+
+    def _busy_response(self, model_name: str, scheduler: ProviderScheduler) -> Dict[str, Any]:
+        logger.warning(f"No free slot for {model_name} before the deadline (limit {int(scheduler.limiter.limit)})")
+        return {
+            'content': "The AI service is busy. Please try again in a moment.",
+            'tokens_used': 0,
+            'model_used': model_name,
+            'error': 'Too many concurrent requests to the provider',
+            'status_code': 429,
+            'retry_after': scheduler.retry_after,
+        }
+
+    @staticmethod
+    def _retry_later_response(model_name: str, failure: Dict[str, Any], delay: float) -> Dict[str, Any]:
+        """A failure not retried because its backoff would pass the deadline, as a 429 to retry after it"""
+        logger.warning(f"{model_name} answered {failure['status_code']}, not retrying: "
+                       f"a {delay:.1f}s backoff would pass the deadline")
+        return {**failure, 'status_code': 429, 'retry_after': delay}
+
+    def get_scheduler(self, model_name: str) -> ProviderScheduler:
+        with self._lock:
+            scheduler = self._schedulers.get(model_name)
+            if scheduler is None:
+                scheduler = self._schedulers[model_name] = ProviderScheduler()
+            return scheduler
+
+    def scheduler_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Slot and queue-time statistics of every model called so far"""
+        with self._lock:
+            schedulers = dict(self._schedulers)
+        return {model_name: scheduler.stats() for model_name, scheduler in schedulers.items()}
+
+    def _record_stream(self, model_name, events):
+        # Streams abandoned by the caller say nothing about provider health
+        start = time.monotonic()
+        try:
+            for event in events:
+                if event['type'] in ('done', 'error'):
+                    self.record_result(model_name, event['type'] == 'done', time.monotonic() - start)
+                yield event
+        except Exception:
+            self.record_result(model_name, False, time.monotonic() - start)
+            raise
+        finally:
+            events.close()
+
+    def record_result(self, model_name: str, ok: bool, latency: float) -> None:
+        """Feed one call outcome into the model's health statistics"""
+        with self._lock:
+            health = self._health.setdefault(model_name, ProviderHealth())
+            previous_status = health.status
+            health.record(ok, latency)
+            if health.status != previous_status:
+                logger.info(f"Model {model_name} is now {health.status}")
+                self._catalog = None
+
+    def get_health(self, model_name: str) -> ProviderHealth:
+        with self._lock:
+            return self._health.setdefault(model_name, ProviderHealth())
+
+    def get_model_catalog(self) -> Tuple[List[Dict[str, Any]], str]:
+        """
+        Return the cached model catalog and its ETag
         
-        return models
+        The catalog is built from static metadata without instantiating any
+        provider, and rebuilt only when configuration or health status changes.
+        """
+        with self._lock:
+            if self._catalog is None:
+                catalog = []
+                for model_name in self._providers:
+                    status = self._health.get(model_name, ProviderHealth()).status
+                    catalog.append({
+                        'name': model_name,
+                        'provider': self.PROVIDER_LABELS.get(model_name, model_name.title()),
+                        'display_name': self._get_display_name(model_name),
+                        'is_available': status != 'down',
+                        'status': status,
+                    })
+                if catalog:
+                    catalog.insert(0, {
+                        'name': routing.AUTO_MODEL,
+                        'provider': 'Automatic',
+                        'display_name': self._get_display_name(routing.AUTO_MODEL),
+                        'is_available': any(entry['is_available'] for entry in catalog),
+                        'status': 'healthy' if any(entry['status'] == 'healthy' for entry in catalog) else 'unknown',
+                    })
+                digest = hashlib.sha1(json.dumps(catalog, sort_keys=True).encode()).hexdigest()
+                self._catalog, self._catalog_etag = catalog, f'"{digest}"'
+            return self._catalog, self._catalog_etag
+
+    def list_available_models(self) -> List[Dict[str, Any]]:
+        """
+        List all available models with their providers
+        
+        Returns:
+            List of dictionaries with 'name', 'provider', 'display_name', 'is_available' and 'status' keys
+        """
+        return self.get_model_catalog()[0]
     
     def _get_display_name(self, model_name: str) -> str:
         """Get human-readable display name for model"""
@@ -129,14 +437,25 @@ class AIServiceManager:
             'claude': 'Anthropic Claude',
             'deepseek': 'DeepSeek',
             'llama': 'Meta Llama',
-            'groq': 'Groq (Llama 3.3)'
+            'groq': 'Groq (Llama 3.3)',
+            'auto': 'Auto (best model per message)'
         }
         return display_names.get(model_name, model_name.title())
     
     def is_model_available(self, model_name: str) -> bool:
         """Check if a model is available"""
+        if model_name == routing.AUTO_MODEL:
+            return bool(self._providers)
         return model_name in self._providers
 
 
 # Global instance
-ai_service_manager = AIServiceManager()
\ No newline at end of file
+ai_service_manager = AIServiceManager()
+
+
+def _reload_on_api_key_change(setting, **kwargs):
+    if setting.endswith('_API_KEY'):
+        ai_service_manager.reload()
+
+
+setting_changed.connect(_reload_on_api_key_change)
\ No newline at end of file
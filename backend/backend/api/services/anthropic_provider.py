@@ -1,13 +1,14 @@
 """
 Anthropic Claude AI Provider
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
 from django.conf import settings
 import logging
 import requests
 import json
 
-from .ai_service import AIProvider
+from .ai_service import AIProvider, iter_sse_data
+from .provider_limits import retry_after_seconds
 
 logger = logging.getLogger(__name__)
 
@@ -95,7 +96,9 @@ class AnthropicProvider(AIProvider):
                     'tokens_used': 0,
                     'model_used': self.model_name,
                     'provider': self.provider_name,
-                    'error': f"HTTP {response.status_code}"
+                    'error': f"HTTP {response.status_code}",
+                    'status_code': response.status_code,
+                    'retry_after': retry_after_seconds(response.headers)
                 }
                 
         except Exception as e:
@@ -108,6 +111,70 @@ class AnthropicProvider(AIProvider):
                 'error': str(e)
             }
     
+    def stream_response(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[Dict[str, Any]]:
+        """Stream the reply using the Messages API server-sent events"""
+        payload = {
+            "model": self.model_name,
+            "max_tokens": kwargs.get("max_tokens", 1000),
+            "temperature": kwargs.get("temperature", 0.7),
+            "messages": self._format_messages_for_claude(messages),
+            "stream": True
+        }
+        input_tokens = output_tokens = 0
+        try:
+            with requests.post(
+                f"{self.base_url}/messages",
+                headers=self.headers,
+                json=payload,
+                timeout=30,
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    logger.error(f"Claude stream request failed: {response.status_code} - {response.text}")
+                    yield self._stream_error(
+                        f"HTTP {response.status_code}", response.status_code, retry_after_seconds(response.headers)
+                    )
+                    return
+                for data in iter_sse_data(response):
+                    event_type = data.get('type')
+                    if event_type == 'content_block_delta':
+                        text = data.get('delta', {}).get('text')
+                        if text:
+                            yield {'type': 'delta', 'content': text}
+                    elif event_type == 'message_start':
+                        input_tokens = data.get('message', {}).get('usage', {}).get('input_tokens', 0)
+                    elif event_type == 'message_delta':
+                        output_tokens = data.get('usage', {}).get('output_tokens', output_tokens)
+                    elif event_type == 'error':
+                        error = data.get('error', {})
+                        # Overload can also be reported mid-stream, with the status it has as an HTTP error
+                        status_code = 529 if error.get('type') == 'overloaded_error' else None
+                        yield self._stream_error(error.get('message', 'stream error'), status_code)
+                        return
+        except Exception as e:
+            logger.error(f"Claude streaming error: {e}")
+            yield self._stream_error(str(e))
+            return
+        yield {
+            'type': 'done',
+            'tokens_used': input_tokens + output_tokens,
+            'model_used': self.model_name,
+            'provider': self.provider_name
+        }
+
+    def _stream_error(self, error: str, status_code: Optional[int] = None,
+                      retry_after: Optional[float] = None) -> Dict[str, Any]:
+        return {
+            'type': 'error',
+            'content': "I'm having trouble connecting to the AI service. Please try again.",
+            'tokens_used': 0,
+            'model_used': self.model_name,
+            'provider': self.provider_name,
+            'error': error,
+            'status_code': status_code,
+            'retry_after': retry_after
+        }
+    
     def _format_messages_for_claude(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
         """Convert messages to Claude format (excludes system messages as separate parameter)"""
         claude_messages = []
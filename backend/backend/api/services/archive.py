@@ -0,0 +1,143 @@
+"""
+Tiered archival of inactive chats
+
+Messages of chats nobody touched for a while are moved out of the hot
+ChatMessage table into a single compressed ChatArchive row per chat. Opening
+or continuing an archived chat rehydrates it transparently, restoring the
+original message ids and timestamps.
+
+Archived messages leave the full-text index with the hot rows, so search does
+not cover archived chats; rehydration indexes the messages again. The search
+endpoint reports how many of the user's chats it left out this way.
+"""
+import json
+import logging
+import zlib
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.models import Chat, ChatArchive, ChatMessage
+from api.services import search
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_LEVEL = 9
+PREVIEW_LENGTH = 100
+
+
+def _pack(messages: List[ChatMessage]) -> bytes:
+    records = [
+        {
+            'id': message.id,
+            'role': message.role,
+            'content': message.content,
+            'model_used': message.model_used,
+            'tokens_used': message.tokens_used,
+            'created_at': message.created_at.isoformat(),
+        }
+        for message in messages
+    ]
+    return zlib.compress(json.dumps(records, ensure_ascii=False).encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def unpack(archive: ChatArchive) -> List[Dict]:
+    """Decode the archived message records, oldest first"""
+    return json.loads(zlib.decompress(bytes(archive.payload)))
+
+
+def archive_chat(chat: Chat, cutoff: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Move a chat's messages into its ChatArchive row
+
+    Args:
+        chat: The chat to archive
+        cutoff: Leave the chat alone if it has been updated since
+
+    Returns:
+        Dictionary with 'messages', 'raw_bytes' and 'compressed_bytes'; all
+        zero if the chat was skipped
+    """
+    with transaction.atomic():
+        # Lock the chat and check it again: it may have been used or archived since it was picked
+        locked = Chat.objects.select_for_update().filter(pk=chat.pk, archived_at__isnull=True)
+        if cutoff is not None:
+            locked = locked.filter(updated_at__lt=cutoff)
+        if not locked.exists():
+            return {'messages': 0, 'raw_bytes': 0, 'compressed_bytes': 0}
+        messages = list(chat.messages.order_by('created_at', 'id'))
+        if not messages:
+            return {'messages': 0, 'raw_bytes': 0, 'compressed_bytes': 0}
+        payload = _pack(messages)
+        raw_bytes = sum(len(message.content.encode('utf-8')) for message in messages)
+        last = messages[-1]
+        ChatArchive.objects.create(
+            chat=chat,
+            payload=payload,
+            message_count=len(messages),
+            raw_bytes=raw_bytes,
+            last_message={
+                'role': last.role,
+                'content': last.content[:PREVIEW_LENGTH + 3],
+                'created_at': last.created_at.isoformat(),
+            },
+        )
+        # Only what was packed: anything newer stays in the hot table. The
+        # post_delete handler drops the index rows, which rehydrate_chat restores.
+        ChatMessage.objects.filter(id__in=[message.id for message in messages]).delete()
+        # update() rather than save() so updated_at keeps reflecting real activity
+        chat.archived_at = timezone.now()
+        Chat.objects.filter(pk=chat.pk).update(archived_at=chat.archived_at)
+    return {'messages': len(messages), 'raw_bytes': raw_bytes, 'compressed_bytes': len(payload)}
+
+
+def rehydrate_chat(chat: Chat) -> bool:
+    """
+    Move an archived chat's messages back into the hot table
+
+    Returns:
+        True if messages were restored by this call
+    """
+    if not chat.archived_at:
+        return False
+    try:
+        with transaction.atomic():
+            archive = ChatArchive.objects.select_for_update().filter(chat=chat).first()
+            if archive is None:
+                # Another request already rehydrated it
+                chat.archived_at = None
+                return False
+            messages = [
+                ChatMessage(
+                    id=record['id'],
+                    chat=chat,
+                    role=record['role'],
+                    content=record['content'],
+                    model_used=record['model_used'],
+                    tokens_used=record['tokens_used'],
+                    created_at=parse_datetime(record['created_at']),
+                )
+                for record in unpack(archive)
+            ]
+            ChatMessage.objects.bulk_create(messages)
+            search.index_messages(messages)
+            archive.delete()
+            Chat.objects.filter(pk=chat.pk).update(archived_at=None)
+    except IntegrityError:
+        # Lost a race with a concurrent rehydration of the same chat
+        logger.info(f"Chat {chat.id} was rehydrated concurrently")
+        chat.archived_at = None
+        return False
+    chat.archived_at = None
+    logger.info(f"Rehydrated archived chat {chat.id}")
+    return True
+
+
+def iter_archived_messages(user) -> Iterator[Dict]:
+    """Yield archived message records of a user's chats with their chat_id"""
+    for archive in ChatArchive.objects.filter(chat__user=user).order_by('chat_id').iterator(chunk_size=20):
+        for record in unpack(archive):
+            yield {'chat_id': archive.chat_id, **record}
@@ -0,0 +1,53 @@
+"""
+Cooperative cancellation of in-flight generations
+
+A stop request sets a flag in the shared cache keyed by chat, so it reaches
+the generation whichever worker runs it. The generating loop polls the flag
+between streamed chunks and, once set, stops reading from the provider;
+closing the stream closes the upstream HTTP connection.
+
+The flag only crosses processes when CACHES is shared by all workers, as the
+default file-backed cache is. With a per-process cache such as LocMemCache
+a stop request only reaches generations running in the same worker, so such
+deployments must run a single worker.
+"""
+import time
+
+from django.core.cache import cache
+
+CANCEL_KEY = 'api:turn-cancel:{}'
+# Long enough to outlive any generation the flag could be aimed at
+CANCEL_TTL = 600
+
+
+def _key(chat_id) -> str:
+    return CANCEL_KEY.format(str(chat_id))
+
+
+def request_cancel(chat_id) -> None:
+    """Ask the generation running for a chat to stop"""
+    cache.set(_key(chat_id), True, CANCEL_TTL)
+
+
+def clear_cancel(chat_id) -> None:
+    cache.delete(_key(chat_id))
+
+
+class CancelToken:
+    """Polls a chat's cancel flag at most every POLL_INTERVAL seconds"""
+
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, chat_id):
+        self.key = _key(chat_id)
+        self._cancelled = False
+        self._next_check = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._cancelled:
+            now = time.monotonic()
+            if now >= self._next_check:
+                self._next_check = now + self.POLL_INTERVAL
+                self._cancelled = bool(cache.get(self.key))
+        return self._cancelled
@@ -0,0 +1,209 @@
+"""
+Streaming NDJSON export and batched import of a user's chat history
+
+The format is one JSON object per line: every chat ({"type": "chat", ...})
+comes first, followed by every message ({"type": "message", ...}) grouped by
+chat, so an importer never needs to hold more than one batch in memory.
+
+Imports run in short per-batch transactions, so they are not atomic. Every
+record is validated before it is buffered, and the first invalid one stops
+the import: everything above that line is imported, nothing from it on is.
+"""
+import json
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.models import Chat, ChatMessage, ChatTombstone
+from api.services import memory, search, usage
+from api.services.archive import iter_archived_messages
+
+EXPORT_CHUNK_SIZE = 500
+IMPORT_BATCH_SIZE = 500
+
+CHAT_FIELDS = ('id', 'title', 'model_type', 'language', 'created_at', 'updated_at')
+MESSAGE_FIELDS = ('chat_id', 'role', 'content', 'model_used', 'tokens_used', 'created_at')
+
+
+class ChatImportError(ValueError):
+    """An invalid import line; records before it have been imported"""
+
+    def __init__(self, line: int, reason: str, stats: Dict[str, int]):
+        super().__init__(f"Line {line}: {reason}")
+        self.line = line
+        self.reason = reason
+        self.stats = stats
+
+
+def _parse_timestamp(value) -> datetime:
+    timestamp = parse_datetime(value) if isinstance(value, str) else None
+    if timestamp is None:
+        raise ValueError(f"Invalid timestamp: {value}")
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp
+
+
+def _optional_string(record: Dict, field: str, max_length: int) -> Optional[str]:
+    value = record.get(field)
+    if value is not None and (not isinstance(value, str) or len(value) > max_length):
+        raise ValueError(f"Invalid {field}: {value!r}")
+    return value
+
+
+def _choice(record: Dict, field: str, choices, default: str) -> str:
+    value = record.get(field) or default
+    if value not in dict(choices):
+        raise ValueError(f"Invalid {field}: {value!r}")
+    return value
+
+
+def _encode(value):
+    # Full microsecond precision keeps message order stable across a round trip
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return DjangoJSONEncoder().default(value)
+
+
+def _line(record: Dict) -> bytes:
+    return (json.dumps(record, default=_encode, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def export_user_chats(user, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the user's chats and messages as NDJSON lines"""
+    chats = Chat.objects.filter(user=user).only(*CHAT_FIELDS).order_by('created_at', 'id')
+    for chat in chats.iterator(chunk_size=chunk_size):
+        yield _line({'type': 'chat', **{field: getattr(chat, field) for field in CHAT_FIELDS}})
+
+    messages = (
+        ChatMessage.objects.filter(chat__user=user)
+        .only('id', *MESSAGE_FIELDS)
+        .order_by('chat_id', 'created_at', 'id')
+    )
+    for message in messages.iterator(chunk_size=chunk_size):
+        yield _line({'type': 'message', **{field: getattr(message, field) for field in MESSAGE_FIELDS}})
+
+    for record in iter_archived_messages(user):
+        yield _line({'type': 'message', **{field: record[field] for field in MESSAGE_FIELDS}})
+
+
+class ChatImporter:
+    """
+    Import NDJSON lines produced by export_user_chats for a user
+
+    run() raises ChatImportError at the first invalid line, after importing
+    every record above it.
+    """
+
+    def __init__(self, user, batch_size: int = IMPORT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.chat_ids = {}  # exported chat id -> id in this deployment
+        self.pending_chats = []
+        self.pending_messages = []
+        self.stats = {'chats_imported': 0, 'messages_imported': 0}
+
+    def run(self, lines: Iterable[bytes]) -> Dict[str, int]:
+        for number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("Not a JSON object")
+                if record.get('type') == 'chat':
+                    self._add_chat(record)
+                elif record.get('type') == 'message':
+                    self._add_message(record)
+                else:
+                    raise ValueError(f"Unknown record type: {record.get('type')}")
+            except (ValueError, TypeError, KeyError) as e:
+                self._flush_chats()
+                self._flush_messages()
+                reason = f"Missing field {e}" if isinstance(e, KeyError) else str(e)
+                raise ChatImportError(number, reason, self.stats) from e
+        self._flush_chats()
+        self._flush_messages()
+        return self.stats
+
+    def _add_chat(self, record):
+        chat = Chat(
+            id=uuid.UUID(str(record['id'])),
+            user=self.user,
+            title=_optional_string(record, 'title', Chat._meta.get_field('title').max_length),
+            model_type=_choice(record, 'model_type', Chat.MODEL_CHOICES, 'gemini'),
+            language=_choice(record, 'language', Chat.LANGUAGE_CHOICES, 'en'),
+            created_at=_parse_timestamp(record['created_at']),
+        )
+        # bulk_create applies auto_now, so the original value is restored afterwards
+        chat._imported_updated_at = _parse_timestamp(record.get('updated_at') or record['created_at'])
+        self.pending_chats.append(chat)
+        if len(self.pending_chats) >= self.batch_size:
+            self._flush_chats()
+
+    def _add_message(self, record):
+        if record['role'] not in dict(ChatMessage.ROLES):
+            raise ValueError(f"Unknown role: {record['role']}")
+        if not isinstance(record['content'], str):
+            raise ValueError("Message content must be a string")
+        tokens_used = record.get('tokens_used')
+        if tokens_used is not None and (type(tokens_used) is not int or tokens_used < 0):
+            raise ValueError(f"Invalid tokens_used: {tokens_used!r}")
+        model_used = _optional_string(record, 'model_used', ChatMessage._meta.get_field('model_used').max_length)
+        created_at = _parse_timestamp(record['created_at'])
+        if self.pending_chats:
+            self._flush_chats()
+        chat_id = self.chat_ids.get(str(uuid.UUID(str(record['chat_id']))))
+        if chat_id is None:
+            raise ValueError("Message references a chat that was not imported")
+        self.pending_messages.append(ChatMessage(
+            chat_id=chat_id,
+            role=record['role'],
+            content=record['content'],
+            model_used=model_used,
+            tokens_used=tokens_used,
+            created_at=created_at,
+        ))
+        if len(self.pending_messages) >= self.batch_size:
+            self._flush_messages()
+
+    def _flush_chats(self):
+        chats, self.pending_chats = self.pending_chats, []
+        if not chats:
+            return
+        # Keep exported ids unless they are already taken in this deployment
+        taken = set(Chat.objects.filter(id__in=[chat.id for chat in chats]).values_list('id', flat=True))
+        for chat in chats:
+            original_id = str(chat.id)
+            if chat.id in taken:
+                chat.id = uuid.uuid4()
+            self.chat_ids[original_id] = chat.id
+        with transaction.atomic():
+            Chat.objects.bulk_create(chats)
+            for chat in chats:
+                chat.updated_at = chat._imported_updated_at
+            Chat.objects.bulk_update(chats, ['updated_at'])
+            # bulk_create skips post_save, so clear tombstones of re-imported chats here
+            ChatTombstone.objects.filter(chat_id__in=[chat.id for chat in chats]).delete()
+        self.stats['chats_imported'] += len(chats)
+
+    def _flush_messages(self):
+        messages, self.pending_messages = self.pending_messages, []
+        if not messages:
+            return
+        with transaction.atomic():
+            ChatMessage.objects.bulk_create(messages)
+            # bulk_create skips post_save, so index the batch directly
+            search.index_rows([
+                (message.id, self.user.id, message.chat_id.hex, search.normalize_text(message.content))
+                for message in messages
+            ])
+            memory.remember_on_commit(self.user.id, messages)
+            usage.record(self.user.id, messages)
+        self.stats['messages_imported'] += len(messages)
@@ -0,0 +1,256 @@
+"""
+The database side of one prompt/reply exchange
+
+Both the HTTP prompt endpoint and the WebSocket transport run a turn as the
+same pipeline:
+
+1. prepare_turn: one short transaction creates or loads the chat, stores the
+   user's message and reads the provider context.
+2. generate_reply: the provider call, streamed and cancellable, with no
+   transaction open and no lock held.
+3. complete_turn: the title (if the chat needs one) is generated, then one
+   short transaction stores the assistant message and the title.
+
+On SQLite that is two commits, and so two fsyncs, per turn.
+"""
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from api.models import Chat, ChatMessage
+from api.services.ai_service import ai_service_manager
+from api.services.archive import rehydrate_chat
+from api.services.cancellation import CancelToken, clear_cancel
+from api.services.documents import document_context
+from api.services.memory import memory_context
+from api.services.scheduler import Priority
+from api.services.titles import local_title
+
+logger = logging.getLogger(__name__)
+
+
+class TurnError(Exception):
+    """A turn could not be prepared; carries the HTTP status to answer with"""
+
+    def __init__(self, message: str, status: int = 500):
+        super().__init__(message)
+        self.status = status
+
+
+class ChatTurn:
+    """A prepared turn: the chat, the stored user message and the provider context"""
+
+    def __init__(self, chat: Chat, user_message: ChatMessage, history: List[Dict[str, str]],
+                 model_type: str, language: str, needs_title: bool = False):
+        self.chat = chat
+        self.user_message = user_message
+        self.history = history
+        self.model_type = model_type
+        self.language = language
+        self.needs_title = needs_title
+        self.title_changed = False
+
+
+def create_chat_title(user_message, model_name='gemini', user_id=None):
+    """Generate a chat title using AI or, with CHAT_TITLE_STRATEGY = 'local', by keyword extraction"""
+    if getattr(settings, 'CHAT_TITLE_STRATEGY', 'llm') == 'local':
+        return local_title(user_message)
+    try:
+        messages = [{
+            'role': 'user',
+            'content': f"Give a short, descriptive title for this conversation in not more than 5 words.\n\nUser: {user_message}"
+        }]
+        # Queued behind interactive replies when the provider is saturated
+        response = ai_service_manager.generate_response(model_name, messages, user_id=user_id, priority=Priority.TITLE)
+        title = response.get('content', '').strip()
+        if not title:
+            title = user_message[:50]
+    except Exception as e:
+        logger.warning(f"Failed to generate title: {e}")
+        title = user_message[:50]
+    return title
+
+
+def prepare_turn(user, chat_id, content: str, model_type: str = 'gemini', language: str = 'en') -> ChatTurn:
+    """
+    Get or create the chat, store the user message and load the conversation
+
+    Runs in a single transaction.
+
+    Raises:
+        TurnError: The chat belongs to someone else or a database step failed
+    """
+    # A stop request left over from an earlier turn must not end this one
+    clear_cancel(chat_id)
+    with transaction.atomic():
+        try:
+            chat = Chat.objects.filter(id=chat_id).first()
+            created = chat is None
+            if created:
+                chat = Chat(id=chat_id, user=user, model_type=model_type, language=language)
+                try:
+                    with transaction.atomic():
+                        chat.save(force_insert=True)
+                except IntegrityError:
+                    # Another request created the chat first
+                    chat, created = Chat.objects.get(id=chat_id), False
+            logger.info(f"Chat {'created' if created else 'retrieved'}: {chat.id}")
+        except Exception as e:
+            logger.error(f"Error creating/retrieving chat: {e}")
+            raise TurnError(f'Chat creation error: {str(e)}')
+
+        # Ensure the chat belongs to the current user
+        if chat.user_id != user.pk:
+            raise TurnError('Access denied to this chat.', status=403)
+
+        # Resuming an archived chat brings its history back into the hot table
+        rehydrate_chat(chat)
+
+        try:
+            user_message = ChatMessage.objects.create(role="user", chat=chat, content=content)
+            logger.info(f"User message created: {user_message.id}")
+        except Exception as e:
+            logger.error(f"Error creating user message: {e}")
+            raise TurnError(f'Message creation error: {str(e)}')
+
+        if created:
+            # Nothing to read back for a chat that did not exist a moment ago
+            history = [{"role": "user", "content": content}]
+        else:
+            try:
+                rows = chat.messages.order_by("created_at", "id").values_list("role", "content")
+                history = [{"role": role, "content": text} for role, text in rows]
+            except Exception as e:
+                logger.error(f"Error retrieving chat messages: {e}")
+                raise TurnError(f'Message retrieval error: {str(e)}')
+        logger.info(f"Retrieved {len(history)} messages for context")
+
+    return ChatTurn(chat, user_message, history, model_type, language, needs_title=created or not chat.title)
+
+
+def provider_messages(turn: ChatTurn) -> List[Dict[str, str]]:
+    """
+    The history to send to the provider, with retrieved context added to the last user message
+
+    Passages from the user's documents and snippets from their other chats
+    go to the provider for this turn only; the stored message and the
+    history itself are not modified.
+    """
+    messages = turn.history
+    if not messages or messages[-1]['role'] != 'user':
+        return messages
+    query = messages[-1]['content']
+    sections = [
+        section for section in (
+            document_context(turn.chat.user_id, query),
+            memory_context(turn.chat.user_id, turn.chat.id, query),
+        ) if section
+    ]
+    if not sections:
+        return messages
+    content = '\n\n'.join(sections + [f"Question: {query}"])
+    return messages[:-1] + [{'role': 'user', 'content': content}]
+
+
+def generate_reply(turn: ChatTurn, model_type: str,
+                   on_delta: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    Stream the reply for a prepared turn, stopping early if the turn is cancelled
+
+    Args:
+        turn: Prepared turn
+        model_type: Model to generate with, or 'auto' to route by the conversation
+        on_delta: Called with every piece of text as it arrives
+
+    Returns:
+        Dictionary with 'content', 'model_used', 'tokens_used' and 'is_truncated',
+        plus 'error', 'status_code' and 'retry_after' if the provider failed
+
+    Raises:
+        ValueError: If model is not supported
+    """
+    # 'auto' is routed here so the stored message names the model that answered
+    model_type = ai_service_manager.resolve_model(model_type, turn.history)
+    token = CancelToken(turn.chat.id)
+    if token.cancelled:
+        # Stopped while the turn was being prepared; the provider is never called
+        clear_cancel(turn.chat.id)
+        return {'content': '', 'model_used': model_type, 'tokens_used': 0, 'is_truncated': True}
+    chunks, result = [], None
+    messages = provider_messages(turn)
+    stream = ai_service_manager.stream_response(model_type, messages, user_id=turn.chat.user_id)
+    try:
+        for event in stream:
+            if event['type'] == 'delta':
+                chunks.append(event['content'])
+                if on_delta:
+                    on_delta(event['content'])
+            else:
+                result = event
+            if token.cancelled:
+                logger.info(f"Generation for chat {turn.chat.id} cancelled after {len(chunks)} chunks")
+                break
+    finally:
+        # Closing the stream closes the upstream connection when we stopped early
+        stream.close()
+        clear_cancel(turn.chat.id)
+
+    truncated = result is None
+    if result is not None and result['type'] == 'error':
+        return {'content': '', 'model_used': model_type, 'tokens_used': 0, 'is_truncated': False,
+                'error': result.get('error'), 'status_code': result.get('status_code'),
+                'retry_after': result.get('retry_after')}
+    result = result or {}
+    return {
+        'content': ''.join(chunks),
+        'model_used': result.get('model_used', model_type),
+        # Providers report usage at the end, so a stopped stream has none
+        'tokens_used': result.get('tokens_used', 0),
+        'is_truncated': truncated,
+    }
+
+
+def complete_turn(turn: ChatTurn, reply: Dict[str, Any]) -> Optional[ChatMessage]:
+    """
+    Store the assistant's reply and, for chats without one, a title
+
+    The title is generated first, outside the transaction. A reply without
+    content (failed, or stopped before any text) stores no message.
+
+    Args:
+        turn: Prepared turn
+        reply: Result of generate_reply
+
+    Returns:
+        The stored assistant message, if any
+    """
+    title = None
+    if turn.needs_title:
+        if 'error' in reply:
+            # The provider is failing; don't spend another call on the title
+            title = turn.user_message.content[:50]
+        else:
+            title = create_chat_title(turn.user_message.content, turn.model_type, turn.chat.user_id)
+
+    assistant_message = None
+    with transaction.atomic():
+        if title:
+            Chat.objects.filter(pk=turn.chat.pk).update(
+                title=title, model_type=turn.model_type, language=turn.language, updated_at=timezone.now(),
+            )
+            turn.chat.title = title
+            turn.title_changed = True
+        if reply.get('content') and 'error' not in reply:
+            assistant_message = ChatMessage.objects.create(
+                role="assistant",
+                content=reply['content'],
+                chat=turn.chat,
+                model_used=reply['model_used'],
+                tokens_used=reply['tokens_used'],
+                is_truncated=reply['is_truncated']
+            )
+            logger.info(f"Assistant message created: {assistant_message.id}")
+    return assistant_message
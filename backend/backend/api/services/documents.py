@@ -0,0 +1,237 @@
+"""
+Per-user document store for retrieval-augmented replies
+
+Uploaded documents are split into overlapping chunks stored in
+DocumentChunk. Each chunk's lexical vector (api.services.lexical_vectors) is
+appended to its owner's vector index: two flat files under RAG_INDEX_DIR, float32
+vectors and the matching int64 chunk ids, row for row. Queries memory-map
+the vectors, so an index is paged in by the OS rather than loaded per
+request, and score every row with one matrix-vector product.
+
+Deleting a document only deletes its chunks; their rows stay in the index and
+are skipped at query time until dead rows make up a quarter of the file, when
+the index is compacted.
+
+At query time the best chunks for the user's latest message are prepended
+to that message for the provider call only (see
+api.services.chat_turn.provider_messages); neither the stored message nor
+the history sent on later turns contains them.
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from api.models import Document, DocumentChunk
+from api.services import lexical_vectors
+from api.services.lexical_vectors import VECTOR_DIM
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Compact once this share of an index's rows belongs to deleted chunks
+COMPACT_DEAD_FRACTION = 0.25
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+class DocumentError(Exception):
+    """An upload could not be turned into a document; carries the ErrorMessages key"""
+
+    def __init__(self, key: str):
+        super().__init__(key)
+        self.key = key
+
+
+def available() -> bool:
+    """Document upload and retrieval need NumPy"""
+    return lexical_vectors.available()
+
+
+def chunk_text(text: str, size: Optional[int] = None, overlap: Optional[int] = None) -> List[str]:
+    """Split text into chunks of ``size`` words, each sharing ``overlap`` words with the previous one"""
+    size = size or getattr(settings, 'RAG_CHUNK_WORDS', 200)
+    overlap = min(overlap if overlap is not None else getattr(settings, 'RAG_CHUNK_OVERLAP', 40), size - 1)
+    words = text.split()
+    if not words:
+        return []
+    step = size - overlap
+    return [' '.join(words[start:start + size]) for start in range(0, max(len(words) - overlap, 1), step)]
+
+
+class VectorIndex:
+    """Append-only float32 vector file plus its chunk ids"""
+
+    def __init__(self, path: Path):
+        self.vectors_path = path.with_suffix('.f32')
+        self.ids_path = path.with_suffix('.ids')
+        self.lock_path = path.with_suffix('.lock')
+
+    @classmethod
+    def for_user(cls, user_id) -> 'VectorIndex':
+        directory = Path(getattr(settings, 'RAG_INDEX_DIR', settings.BASE_DIR / 'rag_index'))
+        return cls(directory / f"user_{user_id}")
+
+    @contextmanager
+    def _locked(self):
+        key = str(self.vectors_path)
+        with _locks_lock:
+            lock = _locks.setdefault(key, threading.Lock())
+        with lock:
+            self.vectors_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_path, 'a') as lock_file:
+                # Other processes appending to the same index
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def __len__(self) -> int:
+        # Vectors are written before ids, so the id count never runs ahead
+        try:
+            return os.path.getsize(self.ids_path) // 8
+        except FileNotFoundError:
+            return 0
+
+    def append(self, ids: Iterable[int], vectors) -> None:
+        ids = np.asarray(list(ids), dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._locked():
+            with open(self.vectors_path, 'a+b') as f:
+                # Drop vectors left behind by an append that failed before writing its ids
+                f.truncate(len(self) * VECTOR_DIM * 4)
+                f.write(vectors.tobytes())
+            with open(self.ids_path, 'ab') as f:
+                f.write(ids.tobytes())
+
+    def search(self, query, k: int) -> List[Tuple[int, float]]:
+        """The ``k`` best (chunk id, cosine similarity) pairs, best first"""
+        rows = len(self)
+        if rows == 0:
+            return []
+        vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, VECTOR_DIM))
+        ids = np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(rows,))
+        scores = vectors @ query
+        if rows > k:
+            top = np.argpartition(scores, rows - k)[rows - k:]
+        else:
+            top = np.arange(rows)
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(ids[row]), float(scores[row])) for row in top]
+
+    def compact(self, live_ids: Iterable[int]) -> int:
+        """Rewrite the index keeping only ``live_ids``; returns the rows dropped"""
+        with self._locked():
+            rows = len(self)
+            if rows == 0:
+                return 0
+            ids = np.fromfile(self.ids_path, dtype=np.int64, count=rows)
+            keep = np.isin(ids, np.fromiter(live_ids, dtype=np.int64))
+            dropped = int(rows - keep.sum())
+            if dropped == 0:
+                return 0
+            vectors = np.fromfile(self.vectors_path, dtype=np.float32, count=rows * VECTOR_DIM)
+            vectors = vectors.reshape(rows, VECTOR_DIM)[keep]
+            for path, data in ((self.vectors_path, vectors), (self.ids_path, ids[keep])):
+                temporary = path.with_suffix(path.suffix + '.tmp')
+                data.tofile(temporary)
+                os.replace(temporary, path)
+            return dropped
+
+    def delete(self) -> None:
+        with self._locked():
+            for path in (self.vectors_path, self.ids_path):
+                path.unlink(missing_ok=True)
+
+
+def add_document(user, name: str, text: str) -> Document:
+    """
+    Chunk, store and index a document
+
+    Raises:
+        DocumentError: The document has no text
+    """
+    chunks = chunk_text(text)
+    if not chunks:
+        raise DocumentError('document_empty')
+    vectors = lexical_vectors.vectorize_texts(chunks)
+    with transaction.atomic():
+        document = Document.objects.create(
+            user=user, name=name[:255], size_bytes=len(text.encode('utf-8')), chunk_count=len(chunks),
+        )
+        rows = DocumentChunk.objects.bulk_create(
+            DocumentChunk(document=document, position=position, content=content)
+            for position, content in enumerate(chunks)
+        )
+    try:
+        VectorIndex.for_user(user.pk).append((row.pk for row in rows), vectors)
+    except Exception:
+        document.delete()
+        raise
+    logger.info(f"Indexed document {document.pk} for user {user.pk}: {len(chunks)} chunks")
+    return document
+
+
+def delete_document(document: Document) -> None:
+    """Delete a document and compact its owner's index once enough of it is dead"""
+    user_id = document.user_id
+    document.delete()
+    index = VectorIndex.for_user(user_id)
+    live = DocumentChunk.objects.filter(document__user_id=user_id).values_list('id', flat=True)
+    if len(index) and live.count() < len(index) * (1 - COMPACT_DEAD_FRACTION):
+        dropped = index.compact(live.iterator())
+        logger.info(f"Compacted document index of user {user_id}: {dropped} rows dropped")
+
+
+def retrieve(user_id, query: str, k: Optional[int] = None) -> List[Tuple[DocumentChunk, float]]:
+    """The user's chunks most similar to ``query``, with their scores, best first"""
+    if not available():
+        return []
+    index = VectorIndex.for_user(user_id)
+    if not len(index):
+        return []
+    k = k or getattr(settings, 'RAG_TOP_K', 4)
+    min_score = getattr(settings, 'RAG_MIN_SCORE', 0.2)
+    query_vector = lexical_vectors.vectorize(query)
+    if not query_vector.any():
+        return []
+    # Over-fetch so rows of deleted documents still leave k live chunks
+    hits = [(chunk_id, score) for chunk_id, score in index.search(query_vector, k * 2) if score >= min_score]
+    chunks = DocumentChunk.objects.select_related('document').in_bulk(
+        [chunk_id for chunk_id, _ in hits]
+    )
+    results = [
+        (chunks[chunk_id], score) for chunk_id, score in hits
+        if chunk_id in chunks and chunks[chunk_id].document.user_id == user_id
+    ]
+    return results[:k]
+
+
+def document_context(user_id, query: str) -> Optional[str]:
+    """Context block of the user's document passages relevant to ``query``, or None"""
+    try:
+        results = retrieve(user_id, query)
+    except Exception as e:
+        logger.warning(f"Document retrieval failed for user {user_id}: {e}")
+        return None
+    if not results:
+        return None
+    excerpts = '\n\n'.join(
+        f"[{number}] {chunk.document.name}:\n{chunk.content}"
+        for number, (chunk, _score) in enumerate(results, start=1)
+    )
+    return f"Excerpts from the user's documents that may help answer the question:\n\n{excerpts}"
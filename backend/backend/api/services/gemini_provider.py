@@ -2,7 +2,7 @@
 Google Gemini AI Provider
 """
 import google.generativeai as genai
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
 from django.conf import settings
 import logging
 
@@ -75,9 +75,43 @@ class GeminiProvider(AIProvider):
                 'tokens_used': 0,
                 'model_used': self.model_name,
                 'provider': self.provider_name,
-                'error': str(e)
+                'error': str(e),
+                'status_code': self._status_code(e)
             }
     
+    def stream_response(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[Dict[str, Any]]:
+        """Stream the reply with generate_content(stream=True)"""
+        context = self._format_messages_for_gemini(messages)
+        received = []
+        try:
+            for chunk in self.model.generate_content(context, stream=True):
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts, e.g. the final one carrying the finish reason
+                    continue
+                if text:
+                    received.append(text)
+                    yield {'type': 'delta', 'content': text}
+        except Exception as e:
+            logger.error(f"Gemini streaming error: {e}")
+            yield {
+                'type': 'error',
+                'content': "I'm having trouble connecting to the AI service. Please try again.",
+                'tokens_used': 0,
+                'model_used': self.model_name,
+                'provider': self.provider_name,
+                'error': str(e),
+                'status_code': self._status_code(e)
+            }
+            return
+        yield {
+            'type': 'done',
+            'tokens_used': self._estimate_tokens(context + ''.join(received)),
+            'model_used': self.model_name,
+            'provider': self.provider_name
+        }
+    
     def _format_messages_for_gemini(self, messages: List[Dict[str, str]]) -> str:
         """Convert message format to Gemini-compatible format"""
         formatted_messages = []
@@ -94,6 +128,12 @@ class GeminiProvider(AIProvider):
         
         return "\n".join(formatted_messages)
     
+    @staticmethod
+    def _status_code(error: Exception):
+        """HTTP status of a google.api_core error (e.g. 429 for ResourceExhausted), if it has one"""
+        code = getattr(error, 'code', None)
+        return code if isinstance(code, int) else None
+
     def _estimate_tokens(self, text: str) -> int:
         """Rough estimation of tokens (4 characters per token on average)"""
         return len(text) // 4
@@ -0,0 +1,256 @@
+"""
+Background generations with a resumable output buffer
+
+A streamed turn runs in a worker thread, decoupled from the request that
+started it, and appends its output to a per-generation buffer in the shared
+cache. Readers tail the buffer as server-sent events whose ids are character
+offsets into the reply, so a client that lost its connection reconnects with
+Last-Event-ID and gets exactly the part it missed, whether the generation is
+still running or already finished. Buffers expire GENERATION_BUFFER_TTL
+seconds after the generation ends.
+
+The buffer is a metadata entry plus text segments. Deltas are coalesced into
+segments of at least FLUSH_CHARS characters (or FLUSH_INTERVAL seconds of
+output), so a reply is stored as a handful of cache entries, not one per token.
+
+A client can reconnect to any worker only when CACHES is shared by all of
+them, as the default file-backed cache is. With a per-process cache such as
+LocMemCache the buffer lives in the worker running the generation, so such
+deployments must run a single worker.
+"""
+import bisect
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from api.renderers import ORJSONRenderer
+from api.serializers import ChatMessageSerializer
+from api.services.cancellation import request_cancel
+from api.services.chat_turn import ChatTurn, complete_turn, generate_reply
+
+logger = logging.getLogger(__name__)
+
+META_KEY = 'api:generation:{}'
+SEGMENT_KEY = 'api:generation:{}:{}'
+READER_KEY = 'api:generation:{}:reader'
+
+FLUSH_CHARS = 256
+FLUSH_INTERVAL = 0.05
+# Buffers of running generations outlive any plausible generation
+RUNNING_TTL = 3600
+
+_renderer = ORJSONRenderer()
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'GENERATION_MAX_WORKERS', 32), thread_name_prefix='generation',
+)
+
+# Same-process readers wait on these instead of sleeping between polls
+_wakeups: Dict[str, threading.Condition] = {}
+_wakeups_lock = threading.Lock()
+
+
+class GenerationBuffer:
+    """Cache-backed output of one generation"""
+
+    def __init__(self, generation_id: str):
+        self.generation_id = generation_id
+        self.meta_key = META_KEY.format(generation_id)
+        self._meta = None
+        self._pending = []
+        self._pending_chars = 0
+        self._last_flush = 0.0
+        self._next_reader_check = 0.0
+
+    @classmethod
+    def create(cls, user_id, chat_id) -> 'GenerationBuffer':
+        buffer = cls(uuid.uuid4().hex)
+        buffer._meta = {
+            'user_id': user_id,
+            'chat_id': str(chat_id),
+            'status': 'running',
+            'length': 0,
+            'segments': [],
+            'final': None,
+        }
+        cache.set(buffer.meta_key, buffer._meta, RUNNING_TTL)
+        buffer.mark_reader()
+        with _wakeups_lock:
+            _wakeups[buffer.generation_id] = threading.Condition()
+        return buffer
+
+    def get_meta(self) -> Optional[Dict[str, Any]]:
+        """Current metadata, or None if the buffer expired or never existed"""
+        return cache.get(self.meta_key)
+
+    # Writer side
+
+    def append(self, text: str) -> None:
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        now = time.monotonic()
+        if self._pending_chars >= FLUSH_CHARS or now - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+        if now >= self._next_reader_check:
+            self._next_reader_check = now + 1
+            self._cancel_if_abandoned()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        text = ''.join(self._pending)
+        self._pending, self._pending_chars = [], 0
+        index = len(self._meta['segments'])
+        cache.set(SEGMENT_KEY.format(self.generation_id, index), text, RUNNING_TTL)
+        self._meta['segments'].append(self._meta['length'])
+        self._meta['length'] += len(text)
+        cache.set(self.meta_key, self._meta, RUNNING_TTL)
+        self._last_flush = time.monotonic()
+        self._notify()
+
+    def finish(self, status: str, **final) -> None:
+        """Record the outcome ('done', 'cancelled' or 'error') and start the expiry clock"""
+        self.flush()
+        ttl = getattr(settings, 'GENERATION_BUFFER_TTL', 300)
+        self._meta['status'] = status
+        self._meta['final'] = final
+        cache.set(self.meta_key, self._meta, ttl)
+        for index in range(len(self._meta['segments'])):
+            cache.touch(SEGMENT_KEY.format(self.generation_id, index), ttl)
+        self._notify()
+        with _wakeups_lock:
+            _wakeups.pop(self.generation_id, None)
+
+    def _notify(self) -> None:
+        condition = _wakeups.get(self.generation_id)
+        if condition is not None:
+            with condition:
+                condition.notify_all()
+
+    def _cancel_if_abandoned(self) -> None:
+        grace = getattr(settings, 'GENERATION_DISCONNECT_GRACE', 30)
+        last_seen = cache.get(READER_KEY.format(self.generation_id))
+        if last_seen is None or time.time() - last_seen > grace:
+            logger.info(f"Generation {self.generation_id} has had no reader for {grace}s, cancelling")
+            request_cancel(self._meta['chat_id'])
+
+    # Reader side
+
+    def mark_reader(self) -> None:
+        """Tell the writer a client is still listening"""
+        cache.set(READER_KEY.format(self.generation_id), time.time(), RUNNING_TTL)
+
+    def read(self, offset: int) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Text after ``offset`` and the metadata it was read against
+
+        Returns:
+            (text, meta), or None if the buffer expired
+        """
+        meta = self.get_meta()
+        if meta is None:
+            return None
+        if offset >= meta['length']:
+            return '', meta
+        starts = meta['segments']
+        first = max(bisect.bisect_right(starts, offset) - 1, 0)
+        keys = [SEGMENT_KEY.format(self.generation_id, index) for index in range(first, len(starts))]
+        segments = cache.get_many(keys)
+        if len(segments) != len(keys):
+            return None
+        text = ''.join(segments[key] for key in keys)
+        return text[offset - starts[first]:], meta
+
+    def wait(self, timeout: float) -> None:
+        """Block until the writer flushes (same process) or the timeout passes"""
+        condition = _wakeups.get(self.generation_id)
+        if condition is None:
+            # Written by another process (or already finished): poll
+            time.sleep(timeout)
+            return
+        with condition:
+            condition.wait(timeout)
+
+
+def start_generation(turn: ChatTurn, model_type: str) -> GenerationBuffer:
+    """Run the reply for a prepared turn in the background and return its buffer"""
+    buffer = GenerationBuffer.create(turn.chat.user_id, turn.chat.id)
+    _executor.submit(_run_generation, buffer, turn, model_type)
+    return buffer
+
+
+def _run_generation(buffer: GenerationBuffer, turn: ChatTurn, model_type: str) -> None:
+    close_old_connections()
+    try:
+        reply = generate_reply(turn, model_type, on_delta=buffer.append)
+        message = complete_turn(turn, reply)
+        if 'error' in reply:
+            buffer.finish('error', error=f"AI service error: {reply['error']}", title=turn.chat.title)
+        elif message is None:
+            buffer.finish('cancelled', title=turn.chat.title)
+        else:
+            buffer.finish('done', message=ChatMessageSerializer(message).data, title=turn.chat.title)
+    except ValueError as e:
+        buffer.finish('error', error=f'Model not supported: {str(e)}')
+    except Exception as e:
+        logger.exception(f"Generation {buffer.generation_id} failed: {e}")
+        buffer.finish('error', error=f'Chat processing error: {str(e)}')
+    finally:
+        close_old_connections()
+
+
+def _event(event_type: str, data, event_id: Optional[int] = None) -> str:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event_type}", f"data: {_renderer.render(data).decode()}"]
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream_events(buffer: GenerationBuffer, offset: int = 0, start: Optional[Dict] = None) -> Iterator[str]:
+    """
+    Server-sent events for a generation from ``offset`` on
+
+    Every delta carries the offset reached as its id, which is what the
+    client sends back as Last-Event-ID to resume. The stream ends with a
+    done, cancelled or error event.
+    """
+    poll_interval = getattr(settings, 'GENERATION_POLL_INTERVAL', 0.1)
+    keepalive_interval = 15
+    yield 'retry: 2000\n\n'
+    if start is not None:
+        yield _event('start', start, offset)
+    last_mark = last_sent = time.monotonic()
+    while True:
+        state = buffer.read(offset)
+        if state is None:
+            yield _event('error', {'error': 'This reply is no longer available.', 'error_code': 'generation_not_found'})
+            return
+        text, meta = state
+        if text:
+            offset += len(text)
+            last_sent = time.monotonic()
+            yield _event('delta', {'content': text}, offset)
+        if meta['status'] != 'running':
+            yield _event(meta['status'], meta['final'] or {}, offset)
+            return
+        now = time.monotonic()
+        if now - last_mark >= 1:
+            buffer.mark_reader()
+            last_mark = now
+        if now - last_sent >= keepalive_interval:
+            last_sent = now
+            yield ': keepalive\n\n'
+        buffer.wait(poll_interval)
+
+
+def parse_offset(value) -> int:
+    """Offset from a Last-Event-ID header or query parameter; raises ValueError"""
+    offset = int(value) if value not in (None, '') else 0
+    if offset < 0:
+        raise ValueError(f"Invalid offset: {value}")
+    return offset
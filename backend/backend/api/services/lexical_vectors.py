@@ -0,0 +1,79 @@
+"""
+Lexical retrieval vectors by feature hashing
+
+These are not semantic embeddings: no model is downloaded and no provider
+is called. Each keyword (see api.services.titles.keywords, so English and
+Arabic stopwords are dropped and Arabic spelling is normalized) and each
+pair of adjacent keywords is hashed to one of VECTOR_DIM signed buckets.
+Counts are damped logarithmically and the vector is L2-normalized, so the
+dot product of two vectors is the cosine similarity of their hashed term
+counts. Retrieval with them is keyword matching, much like a bag-of-words
+search: a passage is found when it shares words (after normalization) with
+the query, and paraphrases or synonyms are not. Matching on shared words is
+what finding the relevant passage of a user's own document mostly needs.
+
+A semantic model could replace this module by providing the same three
+functions and VECTOR_DIM; the document and memory indexes would then have
+to be rebuilt.
+
+Requires NumPy; callers check ``available()`` first.
+"""
+import zlib
+from typing import Dict, List
+
+from api.services.titles import keywords
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+VECTOR_DIM = 256
+# Adjacent keyword pairs count half as much as single keywords
+PAIR_WEIGHT = 0.5
+# Golden-ratio multiplier for combining the hashes of a keyword pair
+_PAIR_MULTIPLIER = 0x9E3779B1
+
+_hash_cache: Dict[str, int] = {}
+_HASH_CACHE_SIZE = 500_000
+
+
+def available() -> bool:
+    return np is not None
+
+
+def _term_hash(term: str) -> int:
+    value = _hash_cache.get(term)
+    if value is None:
+        if len(_hash_cache) >= _HASH_CACHE_SIZE:
+            _hash_cache.clear()
+        value = _hash_cache[term] = zlib.crc32(term.encode('utf-8'))
+    return value
+
+
+def vectorize(text: str):
+    """Unit-length float32 vector of a text (all zeros if it has no keywords)"""
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    hashes = np.fromiter((_term_hash(term) for term in keywords(text)), dtype=np.uint64)
+    if hashes.size == 0:
+        return vector
+    pairs = ((hashes[:-1] * _PAIR_MULTIPLIER) ^ hashes[1:]) & 0xFFFFFFFF
+    features = np.concatenate([hashes, pairs])
+    weights = np.ones(features.size)
+    weights[hashes.size:] = PAIR_WEIGHT
+    # Bit 16 picks the sign, so colliding features tend to cancel rather than pile up
+    weights[(features >> 16) & 1 == 1] *= -1
+    counts = np.bincount((features % VECTOR_DIM).astype(np.intp), weights=weights, minlength=VECTOR_DIM)
+    counts = np.sign(counts) * np.log1p(np.abs(counts))
+    norm = np.linalg.norm(counts)
+    if norm > 0:
+        vector[:] = counts / norm
+    return vector
+
+
+def vectorize_texts(texts: List[str]):
+    """(len(texts), VECTOR_DIM) float32 matrix of the texts' vectors"""
+    matrix = np.empty((len(texts), VECTOR_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        matrix[row] = vectorize(text)
+    return matrix
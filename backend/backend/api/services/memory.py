@@ -0,0 +1,291 @@
+"""
+Cross-chat long-term memory
+
+Every stored chat message is turned into a lexical vector
+(api.services.lexical_vectors) right after its transaction commits and
+appended to its owner's memory index. When the user sends a prompt, the few
+messages from their other chats sharing the most keywords with it are added to the provider call as context, so a new chat can pick up what
+earlier ones established without resending old conversations.
+
+The index is a directory of shards under MEMORY_INDEX_DIR/user_<id>/, each
+holding up to MEMORY_SHARD_ROWS messages in four row-aligned files:
+
+    .sig    a 64-bit SimHash of the vector (signs of 64 fixed +-1 projections)
+    .i8     the vector quantized to int8, 256 bytes per message
+    .ids    message ids (int64)
+    .chats  a 64-bit key of each message's chat (int64)
+
+A query XORs its SimHash with every row's and counts the differing bits,
+which approximates the angle between the two vectors while reading only
+8 bytes per message. The rows within a Hamming threshold (picked from a
+sample so that about CANDIDATES rows pass) are reranked by the exact int8
+dot product, read through a memory map. Rows of deleted messages are
+skipped when their text is looked up; build_memory_index rewrites an index
+without them. Messages of archived chats come back when the chat is
+rehydrated, which restores their ids.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from api.models import ChatMessage
+from api.services import lexical_vectors
+from api.services.lexical_vectors import VECTOR_DIM
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_BITS = 64
+# Rows per shard passed from the SimHash pass to the int8 rerank
+CANDIDATES = 4096
+SNIPPET_CHARS = 300
+
+_SHARD_RE = re.compile(r'^shard_(\d+)\.ids$')
+_locks: Dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+_projections = None
+
+
+def chat_key(chat_id) -> int:
+    """Signed 64-bit key of a chat id, as stored in the .chats files"""
+    value = uuid.UUID(str(chat_id)).int >> 64
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _signatures(vectors):
+    """64-bit SimHash of each row of a (rows, VECTOR_DIM) matrix"""
+    global _projections
+    if _projections is None:
+        # +-1 projections from a hash rather than a seeded RNG, so they never change between NumPy versions
+        signs = [(hashlib.blake2b(f"{dim}:{bit}".encode(), digest_size=1).digest()[0] & 1) * 2 - 1
+                 for dim in range(VECTOR_DIM) for bit in range(SIGNATURE_BITS)]
+        _projections = np.array(signs, dtype=np.float32).reshape(VECTOR_DIM, SIGNATURE_BITS)
+    bits = np.packbits(np.atleast_2d(vectors) @ _projections > 0, axis=1)
+    return bits.view(np.uint64).reshape(-1)
+
+
+def _hamming(signatures, query_signature):
+    """Differing bits between each signature and the query's"""
+    differences = signatures ^ query_signature
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(differences)
+    # NumPy < 2.0: count bytes through a lookup table
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    return table[differences.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+class MemoryShard:
+    """Up to MEMORY_SHARD_ROWS messages in row-aligned files"""
+
+    def __init__(self, path: Path):
+        self.sig_path = path.with_suffix('.sig')
+        self.i8_path = path.with_suffix('.i8')
+        self.ids_path = path.with_suffix('.ids')
+        self.chats_path = path.with_suffix('.chats')
+
+    def __len__(self) -> int:
+        # The ids file is written last, so it never counts a partly written row
+        try:
+            return os.path.getsize(self.ids_path) // 8
+        except FileNotFoundError:
+            return 0
+
+    def append(self, signatures, quantized, ids, chats) -> None:
+        rows = len(self)
+        for path, data, row_bytes in ((self.sig_path, signatures, 8),
+                                      (self.i8_path, quantized, VECTOR_DIM),
+                                      (self.chats_path, chats, 8),
+                                      (self.ids_path, ids, 8)):
+            with open(path, 'a+b') as f:
+                # Drop rows left behind by an append that failed before writing its ids
+                f.truncate(rows * row_bytes)
+                f.write(np.ascontiguousarray(data).tobytes())
+
+    def search(self, query_signature, query_vector, k: int, exclude_chat: Optional[int]) -> List[Tuple[int, float]]:
+        rows = len(self)
+        if rows == 0:
+            return []
+        signatures = np.memmap(self.sig_path, dtype=np.uint64, mode='r', shape=(rows,))
+        distances = _hamming(signatures, query_signature)
+        if rows > CANDIDATES:
+            # Threshold from a histogram of a sample, rather than a partition of every row
+            stride = max(1, rows // 65536)
+            counts = np.bincount(distances[::stride], minlength=SIGNATURE_BITS + 1).cumsum() * stride
+            threshold = int(np.searchsorted(counts, CANDIDATES))
+            # A whole distance can hold many rows; stop below it if that is nearer the target
+            if threshold > 0 and CANDIDATES - counts[threshold - 1] < counts[threshold] - CANDIDATES:
+                threshold -= 1
+            candidates = np.flatnonzero(distances <= threshold)
+        else:
+            candidates = np.arange(rows)
+        if exclude_chat is not None:
+            chats = np.memmap(self.chats_path, dtype=np.int64, mode='r', shape=(rows,))
+            candidates = candidates[chats[candidates] != exclude_chat]
+        if candidates.size == 0:
+            return []
+        quantized = np.memmap(self.i8_path, dtype=np.int8, mode='r', shape=(rows, VECTOR_DIM))
+        scores = (quantized[candidates].astype(np.float32) @ query_vector) / 127
+        if candidates.size > k:
+            best = np.argpartition(scores, candidates.size - k)[candidates.size - k:]
+        else:
+            best = np.arange(candidates.size)
+        ids = np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(rows,))
+        return [(int(ids[candidates[i]]), float(scores[i])) for i in best]
+
+
+class MemoryIndex:
+    """A user's memory shards"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.shard_rows = getattr(settings, 'MEMORY_SHARD_ROWS', 1_000_000)
+
+    @classmethod
+    def for_user(cls, user_id) -> 'MemoryIndex':
+        root = Path(getattr(settings, 'MEMORY_INDEX_DIR', settings.BASE_DIR / 'memory_index'))
+        return cls(root / f"user_{user_id}")
+
+    def shards(self) -> List[MemoryShard]:
+        try:
+            numbers = sorted(
+                int(match.group(1)) for match in map(_SHARD_RE.match, os.listdir(self.directory)) if match
+            )
+        except FileNotFoundError:
+            return []
+        return [MemoryShard(self.directory / f"shard_{number}") for number in numbers]
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards())
+
+    @contextmanager
+    def _locked(self):
+        key = str(self.directory)
+        with _locks_lock:
+            lock = _locks.setdefault(key, threading.Lock())
+        with lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self.directory / 'lock', 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def append(self, message_ids: Iterable[int], chat_keys: Iterable[int], vectors) -> None:
+        """Add vectorized messages; rows whose vector is all zeros are skipped"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        keep = vectors.any(axis=1)
+        if not keep.any():
+            return
+        vectors = vectors[keep]
+        ids = np.asarray(list(message_ids), dtype=np.int64)[keep]
+        chats = np.asarray(list(chat_keys), dtype=np.int64)[keep]
+        signatures = _signatures(vectors)
+        quantized = np.clip(np.rint(vectors * 127), -127, 127).astype(np.int8)
+        with self._locked():
+            shards = self.shards()
+            shard = shards[-1] if shards else MemoryShard(self.directory / 'shard_0')
+            start = 0
+            while start < len(ids):
+                free = self.shard_rows - len(shard)
+                if free <= 0:
+                    number = int(shard.ids_path.stem.split('_')[1]) + 1
+                    shard = MemoryShard(self.directory / f"shard_{number}")
+                    continue
+                end = start + free
+                shard.append(signatures[start:end], quantized[start:end], ids[start:end], chats[start:end])
+                start = end
+
+    def search(self, query_vector, k: int, exclude_chat: Optional[int] = None) -> List[Tuple[int, float]]:
+        """The ``k`` best (message id, similarity) pairs over all shards, best first"""
+        query_signature = _signatures(query_vector)[0]
+        hits = []
+        for shard in self.shards():
+            hits.extend(shard.search(query_signature, query_vector, k, exclude_chat))
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:k]
+
+    def delete(self) -> None:
+        with self._locked():
+            for shard in self.shards():
+                for path in (shard.sig_path, shard.i8_path, shard.ids_path, shard.chats_path):
+                    path.unlink(missing_ok=True)
+
+
+def remember(user_id, messages: List[ChatMessage]) -> None:
+    """Vectorize messages and add them to their owner's memory index"""
+    if not lexical_vectors.available() or not messages:
+        return
+    vectors = lexical_vectors.vectorize_texts([message.content for message in messages])
+    MemoryIndex.for_user(user_id).append(
+        (message.id for message in messages), (chat_key(message.chat_id) for message in messages), vectors,
+    )
+
+
+def remember_on_commit(user_id, messages: List[ChatMessage]) -> None:
+    """Remember messages once the current transaction commits; failures are logged, not raised"""
+    def run():
+        try:
+            remember(user_id, messages)
+        except Exception as e:
+            logger.warning(f"Could not add {len(messages)} messages of user {user_id} to memory: {e}")
+
+    transaction.on_commit(run)
+
+
+def recall(user_id, chat_id, query: str, k: Optional[int] = None) -> List[Tuple[ChatMessage, float]]:
+    """The user's messages from other chats lexically closest to ``query``, with their scores, best first"""
+    if not lexical_vectors.available():
+        return []
+    index = MemoryIndex.for_user(user_id)
+    k = k or getattr(settings, 'MEMORY_TOP_K', 3)
+    min_score = getattr(settings, 'MEMORY_MIN_SCORE', 0.3)
+    query_vector = lexical_vectors.vectorize(query)
+    if not query_vector.any():
+        return []
+    # Over-fetch so rows of deleted messages still leave k live ones
+    hits = [hit for hit in index.search(query_vector, k * 2, exclude_chat=chat_key(chat_id)) if hit[1] >= min_score]
+    if not hits:
+        return []
+    messages = ChatMessage.objects.select_related('chat').in_bulk([message_id for message_id, _ in hits])
+    results, seen = [], set()
+    for message_id, score in hits:
+        message = messages.get(message_id)
+        # A message indexed twice (e.g. during a rebuild) is recalled once
+        if message is None or message.chat.user_id != user_id or message_id in seen:
+            continue
+        seen.add(message_id)
+        results.append((message, score))
+    return results[:k]
+
+
+def memory_context(user_id, chat_id, query: str) -> Optional[str]:
+    """Context block of relevant snippets from the user's earlier chats, or None"""
+    try:
+        results = recall(user_id, chat_id, query)
+    except Exception as e:
+        logger.warning(f"Memory recall failed for user {user_id}: {e}")
+        return None
+    if not results:
+        return None
+    snippets = '\n'.join(
+        f"- ({message.created_at:%Y-%m-%d}, {message.role}) {message.content[:SNIPPET_CHARS]}"
+        for message, _score in results
+    )
+    return f"Related snippets from the user's earlier conversations:\n{snippets}"
@@ -1,13 +1,14 @@
 """
 OpenAI and OpenAI-compatible (DeepSeek) AI Provider
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
 from django.conf import settings
 import logging
 import requests
 import json
 
-from .ai_service import AIProvider
+from .ai_service import AIProvider, iter_sse_data
+from .provider_limits import retry_after_seconds
 
 logger = logging.getLogger(__name__)
 
@@ -91,7 +92,9 @@ class OpenAIProvider(AIProvider):
                     'tokens_used': 0,
                     'model_used': self.model_name,
                     'provider': self.provider_name,
-                    'error': f"HTTP {response.status_code}"
+                    'error': f"HTTP {response.status_code}",
+                    'status_code': response.status_code,
+                    'retry_after': retry_after_seconds(response.headers)
                 }
                 
         except Exception as e:
@@ -104,6 +107,62 @@ class OpenAIProvider(AIProvider):
                 'error': str(e)
             }
     
+    def stream_response(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[Dict[str, Any]]:
+        """Stream the reply using the chat completions server-sent events API"""
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "temperature": kwargs.get("temperature", 0.7),
+            "max_tokens": kwargs.get("max_tokens", 1000),
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+        tokens_used = 0
+        try:
+            with requests.post(
+                f"{self.base_url}/chat/completions",
+                headers=self.headers,
+                json=payload,
+                timeout=30,
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    logger.error(f"OpenAI stream request failed: {response.status_code} - {response.text}")
+                    yield self._stream_error(
+                        f"HTTP {response.status_code}", response.status_code, retry_after_seconds(response.headers)
+                    )
+                    return
+                for data in iter_sse_data(response):
+                    for choice in data.get('choices') or []:
+                        text = (choice.get('delta') or {}).get('content')
+                        if text:
+                            yield {'type': 'delta', 'content': text}
+                    if data.get('usage'):
+                        tokens_used = data['usage'].get('total_tokens', 0)
+        except Exception as e:
+            logger.error(f"OpenAI streaming error: {e}")
+            yield self._stream_error(str(e))
+            return
+        yield {
+            'type': 'done',
+            'tokens_used': tokens_used,
+            'model_used': self.model_name,
+            'provider': self.provider_name
+        }
+
+    def _stream_error(self, error: str, status_code: Optional[int] = None,
+                      retry_after: Optional[float] = None) -> Dict[str, Any]:
+        return {
+            'type': 'error',
+            'content': "I'm having trouble connecting to the AI service. Please try again.",
+            'tokens_used': 0,
+            'model_used': self.model_name,
+            'provider': self.provider_name,
+            'error': error,
+            'status_code': status_code,
+            'retry_after': retry_after
+        }
+    
     def validate_api_key(self) -> bool:
         """Validate API key by making a test request"""
         try:
@@ -0,0 +1,125 @@
+"""
+Per-provider adaptive concurrency limits and retry backoff
+
+Every model has one AdaptiveLimiter per process, which sets how many calls
+its scheduler (api.services.scheduler) lets run at once. Each finished call
+reports its outcome, which moves the limit the way TCP moves its congestion
+window (AIMD):
+
+- a call answered within LATENCY_TOLERANCE times the model's baseline
+  latency adds 1/limit, so the limit grows by about one per limit's worth of
+  successful calls;
+- a 429 halves the limit, and a Retry-After pauses new calls to the model
+  until it has passed;
+- a call slower than that tolerance trims the limit by a tenth, since the
+  provider is queueing our requests rather than serving them.
+
+Decreases are applied at most once per baseline latency, so a burst of
+429s from calls that were already in flight counts as one signal.
+
+Failed calls that are worth repeating (429, 5xx and overloaded responses)
+are retried after a jittered exponential backoff, or after the provider's
+Retry-After if that is longer.
+"""
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Mapping, Optional
+
+from django.conf import settings
+
+# Statuses that say "not now" rather than "never": rate limits and overload
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504, 529}
+LATENCY_TOLERANCE = 2.0
+# Share of a slower observation the baseline latency moves up by
+BASELINE_DRIFT = 0.01
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), if any"""
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+    """
+    Seconds to wait before retry number ``attempt`` (0-based), or None to give up
+
+    Full jitter: a uniform draw up to PROVIDER_RETRY_BASE_DELAY * 2**attempt,
+    capped at PROVIDER_RETRY_MAX_DELAY, and never shorter than Retry-After.
+    A Retry-After longer than the cap is not waited for.
+    """
+    if attempt >= getattr(settings, 'PROVIDER_MAX_RETRIES', 3):
+        return None
+    cap = getattr(settings, 'PROVIDER_RETRY_MAX_DELAY', 10.0)
+    if retry_after is not None and retry_after > cap:
+        return None
+    delay = random.uniform(0, min(cap, getattr(settings, 'PROVIDER_RETRY_BASE_DELAY', 0.5) * 2 ** attempt))
+    return max(delay, retry_after or 0.0)
+
+
+def is_retryable(response: Dict[str, Any]) -> bool:
+    return response.get('status_code') in RETRYABLE_STATUSES
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for one model; the caller serializes access"""
+
+    def __init__(self, initial: Optional[int] = None, minimum: int = 1, maximum: Optional[int] = None):
+        self.limit = float(initial or getattr(settings, 'PROVIDER_CONCURRENCY_INITIAL', 4))
+        self.minimum = minimum
+        self.maximum = maximum or getattr(settings, 'PROVIDER_CONCURRENCY_MAX', 32)
+        self.baseline = None
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+
+    def allows(self, in_flight: int, now: float) -> bool:
+        """Whether another call may start with ``in_flight`` calls running"""
+        return in_flight < int(self.limit) and now >= self.paused_until
+
+    def record(self, latency: Optional[float], status_code: Optional[int] = None,
+               retry_after: Optional[float] = None) -> None:
+        """
+        Adjust the limit to a finished call's outcome
+
+        ``latency`` is None for calls that say nothing about the provider's
+        load, such as ones that raised before it answered.
+        """
+        now = time.monotonic()
+        if status_code == 429:
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            self._decrease(now, 0.5)
+        elif latency is not None and status_code is None:
+            if self.baseline is None or latency < self.baseline:
+                self.baseline = latency
+            else:
+                self.baseline += BASELINE_DRIFT * (latency - self.baseline)
+            if latency > self.baseline * LATENCY_TOLERANCE:
+                self._decrease(now, 0.9)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def _decrease(self, now: float, factor: float) -> None:
+        if now - self._last_decrease < (self.baseline or 1.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * factor)
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until the model takes new calls again, at least 1"""
+        return max(1.0, self.paused_until - time.monotonic())
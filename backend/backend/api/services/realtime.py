@@ -0,0 +1,87 @@
+"""
+In-process fan-out of chat events to a user's open WebSocket connections
+
+Every connection subscribes under its user id and gets a bounded asyncio
+queue. publish() is thread-safe, so turns running in worker threads (and
+HTTP views served by the same ASGI process) can push events to every tab the
+user has open. Delivery is per process: clients connected to another worker
+only see the changes on their next sync.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Any, Dict
+
+from django.conf import settings
+
+
+class Subscription:
+    """One connection's event queue"""
+
+    def __init__(self, user_id, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def _offer(self, event: Dict[str, Any]) -> None:
+        # Runs on the connection's event loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client is not reading; replace the backlog with a close marker
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    def deliver(self, event: Dict[str, Any]) -> None:
+        """Queue an event for this connection from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self._offer, event)
+        except RuntimeError:
+            # The connection's loop has shut down
+            pass
+
+
+class Broadcaster:
+    """Registry of live subscriptions keyed by user id"""
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id) -> Subscription:
+        """Register a connection; must be called from its event loop"""
+        subscription = Subscription(
+            user_id, asyncio.get_running_loop(), getattr(settings, 'WEBSOCKET_SEND_QUEUE_SIZE', 256),
+        )
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id, event: Dict[str, Any]) -> int:
+        """Send an event to every connection of a user; returns how many were reached"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.deliver(event)
+        return len(subscriptions)
+
+    def connection_count(self) -> int:
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+# Global instance
+broadcaster = Broadcaster()
@@ -0,0 +1,86 @@
+"""
+Routing for the ``auto`` model type
+
+Each request is described by cheap local features of the conversation
+(prompt length, script, code, depth), which give the quality tier it needs.
+Every configured model is then scored by how well its tier fits, plus its
+live latency and error rate (from ProviderHealth) and its token price, and
+the cheapest score wins. Short chit-chat ends up on a fast, cheap model; long
+reasoning or code on a stronger one.
+"""
+import re
+from typing import Dict, List, Optional
+
+AUTO_MODEL = 'auto'
+
+# Static model traits. Cost is USD per million tokens (input and output
+# blended); latency is the prior used until real calls have been measured.
+MODEL_PROFILES = {
+    'groq': {'tier': 1, 'cost': 0.7, 'latency': 0.8, 'multilingual': False, 'code': False},
+    'gemini': {'tier': 2, 'cost': 0.4, 'latency': 2.0, 'multilingual': True, 'code': False},
+    'deepseek': {'tier': 2, 'cost': 0.7, 'latency': 4.0, 'multilingual': False, 'code': True},
+    'gpt-4': {'tier': 3, 'cost': 10.0, 'latency': 5.0, 'multilingual': True, 'code': True},
+    'claude': {'tier': 3, 'cost': 6.0, 'latency': 5.0, 'multilingual': True, 'code': True},
+}
+DEFAULT_PROFILE = {'tier': 2, 'cost': 5.0, 'latency': 4.0, 'multilingual': False, 'code': False}
+
+# Score weights: one tier short costs more than several seconds of latency
+UNDER_TIER_PENALTY = 10.0
+OVER_TIER_PENALTY = 1.5
+LATENCY_WEIGHT = 0.5
+ERROR_WEIGHT = 20.0
+COST_WEIGHT = 0.5
+
+CODE_PATTERN = re.compile(
+    r"```|^\s*(def|class|import|from|function|const|let|var|public|#include)\b|[;{}]\s*$|=>",
+    re.MULTILINE,
+)
+REASONING_PATTERN = re.compile(
+    r"\b(why|explain|analy[sz]e|compare|prove|step by step|design|architecture|trade-?offs?|optimi[sz]e)\b",
+    re.IGNORECASE,
+)
+# Anything beyond Latin Extended-B (Arabic, CJK, Cyrillic, ...)
+NON_LATIN_PATTERN = re.compile("[^\x00-\u024f]")
+
+
+def extract_features(messages: List[Dict[str, str]]) -> Dict[str, float]:
+    """Cheap features of the conversation, mostly of its last user message"""
+    prompt = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+    letters = sum(1 for char in prompt if char.isalpha()) or 1
+    return {
+        'prompt_chars': len(prompt),
+        'context_chars': sum(len(m['content']) for m in messages),
+        'depth': len(messages),
+        'has_code': bool(CODE_PATTERN.search(prompt)),
+        'reasoning': bool(REASONING_PATTERN.search(prompt)),
+        'non_latin': len(NON_LATIN_PATTERN.findall(prompt)) / letters > 0.3,
+    }
+
+
+def required_tier(features: Dict[str, float]) -> int:
+    """1 for chit-chat, 2 for ordinary requests, 3 for long reasoning or code"""
+    if features['has_code'] or features['prompt_chars'] > 2000:
+        return 3
+    if features['reasoning'] and (features['prompt_chars'] > 300 or features['depth'] > 10):
+        return 3
+    if features['prompt_chars'] < 120 and not features['reasoning'] and features['depth'] <= 6:
+        return 1
+    return 2
+
+
+def score_model(model_name: str, features: Dict[str, float], tier: int,
+                latency: Optional[float], error_rate: float) -> float:
+    """Lower is better"""
+    profile = MODEL_PROFILES.get(model_name, DEFAULT_PROFILE)
+    gap = tier - profile['tier']
+    score = UNDER_TIER_PENALTY * gap if gap > 0 else OVER_TIER_PENALTY * -gap
+    if features['non_latin'] and not profile['multilingual']:
+        score += UNDER_TIER_PENALTY / 2
+    if features['has_code'] and profile['code']:
+        score -= OVER_TIER_PENALTY
+    score += LATENCY_WEIGHT * (latency if latency is not None else profile['latency'])
+    score += ERROR_WEIGHT * error_rate
+    # Rough token count of the request: about four characters per token
+    tokens = features['context_chars'] / 4 + 500
+    score += COST_WEIGHT * profile['cost'] * tokens / 1000
+    return score
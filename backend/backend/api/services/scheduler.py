@@ -0,0 +1,187 @@
+"""
+Fair scheduling of outbound provider calls
+
+Each model has one ProviderScheduler per process. It runs as many calls at
+once as the model's AdaptiveLimiter allows (api.services.provider_limits);
+when all those slots are busy, callers queue and freed slots are handed out
+in this order:
+
+1. Priority class: interactive replies before chat titles before batch jobs.
+2. Within a class, start-time fair queuing across users. A user's next
+   request is tagged to start at the later of the class's virtual time and
+   the finish tag of that user's previous request (start + 1 / weight). The
+   lowest start tag is served next, and the virtual time advances to it. A
+   user with many queued requests thus gets one slot per turn of the users
+   waiting behind them, instead of all the slots that come free while their
+   requests are at the head of the line.
+
+A queued request gives up once the deadline of its priority class
+(PROVIDER_QUEUE_DEADLINES) has passed. Time spent waiting is recorded per
+class and reported by ``stats()``.
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Dict, Hashable, Optional
+
+from django.conf import settings
+
+from api.services.provider_limits import AdaptiveLimiter
+
+# Finish tags kept per class before tags already behind the virtual time are pruned
+MAX_TRACKED_USERS = 10_000
+# Recent waits kept per class for the percentiles in stats()
+WAIT_SAMPLES = 1000
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    TITLE = 1
+    BATCH = 2
+
+
+DEFAULT_DEADLINES = {'interactive': 10, 'title': 5, 'batch': 120}
+
+
+def queue_deadline(priority: Priority) -> float:
+    """time.monotonic() at which a request of this class, made now, stops waiting for a slot"""
+    name = priority.name.lower()
+    deadlines = getattr(settings, 'PROVIDER_QUEUE_DEADLINES', DEFAULT_DEADLINES)
+    return time.monotonic() + deadlines.get(name, DEFAULT_DEADLINES[name])
+
+
+class _Waiter:
+    __slots__ = ('event', 'granted', 'abandoned')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.abandoned = False
+
+
+class _ClassStats:
+    def __init__(self):
+        self.granted = 0
+        self.queued = 0
+        self.timed_out = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+    def as_dict(self) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+        pick = lambda q: round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1e3, 1) if waits else 0.0  # noqa: E731
+        return {
+            'granted': self.granted,
+            'queued': self.queued,
+            'timed_out': self.timed_out,
+            'wait_p50_ms': pick(0.50),
+            'wait_p95_ms': pick(0.95),
+            'wait_max_ms': round(waits[-1] * 1e3, 1) if waits else 0.0,
+        }
+
+
+class ProviderScheduler:
+    """Concurrency slots of one model, handed out by priority and fair share"""
+
+    def __init__(self, limiter: Optional[AdaptiveLimiter] = None):
+        self.limiter = limiter or AdaptiveLimiter()
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._virtual_time = {priority: 0.0 for priority in Priority}
+        self._finish_tags = {priority: {} for priority in Priority}
+        self._stats = {priority: _ClassStats() for priority in Priority}
+
+    def acquire(self, user: Hashable = None, priority: Priority = Priority.INTERACTIVE,
+                weight: float = 1.0, deadline: Optional[float] = None) -> bool:
+        """
+        Wait for a slot; False if the request's deadline passed first
+
+        Args:
+            user: Fairness key, normally the user id
+            priority: Class of the request
+            weight: The user's share relative to others in the class
+            deadline: time.monotonic() to give up at; defaults to now plus the class's deadline
+        """
+        start = time.monotonic()
+        if deadline is None:
+            deadline = queue_deadline(priority)
+        stats = self._stats[priority]
+        with self._lock:
+            if not self._queue and self.limiter.allows(self.in_flight, start):
+                self.in_flight += 1
+                self._virtual_time[priority] = self._tag(user, priority, weight)
+                stats.granted += 1
+                stats.waits.append(0.0)
+                return True
+            waiter = _Waiter()
+            heapq.heappush(self._queue, (priority, self._tag(user, priority, weight), next(self._sequence), waiter))
+            stats.queued += 1
+            # Entries ahead of it may all have been abandoned
+            self._dispatch()
+        while True:
+            now = time.monotonic()
+            # Released slots set the event; a Retry-After pause ends without one, so wake for that too
+            paused_until = self.limiter.paused_until
+            wake = min(deadline, paused_until) if paused_until > now else deadline
+            waiter.event.wait(max(0.0, wake - now))
+            with self._lock:
+                if not waiter.granted:
+                    self._dispatch()
+                if waiter.granted:
+                    stats.granted += 1
+                    stats.waits.append(time.monotonic() - start)
+                    return True
+                if time.monotonic() >= deadline:
+                    waiter.abandoned = True
+                    stats.timed_out += 1
+                    return False
+
+    def release(self, latency: Optional[float], status_code: Optional[int] = None,
+                retry_after: Optional[float] = None) -> None:
+        """Give a slot back with the call's outcome (see AdaptiveLimiter.record)"""
+        with self._lock:
+            self.in_flight -= 1
+            self.limiter.record(latency, status_code, retry_after)
+            self._dispatch()
+
+    def _tag(self, user: Hashable, priority: Priority, weight: float) -> float:
+        """Start tag of a new request, advancing the user's finish tag"""
+        tags = self._finish_tags[priority]
+        virtual_time = self._virtual_time[priority]
+        start = max(virtual_time, tags.get(user, 0.0))
+        tags[user] = start + 1.0 / weight
+        if len(tags) > MAX_TRACKED_USERS:
+            # A tag at or behind the virtual time gives no advantage over not having one
+            for key in [key for key, tag in tags.items() if tag <= virtual_time]:
+                del tags[key]
+        return start
+
+    def _dispatch(self) -> None:
+        """Hand free slots to the head of the queue; called with the lock held"""
+        now = time.monotonic()
+        while self._queue and self.limiter.allows(self.in_flight, now):
+            priority, start_tag, _, waiter = heapq.heappop(self._queue)
+            if waiter.abandoned:
+                continue
+            self._virtual_time[priority] = max(self._virtual_time[priority], start_tag)
+            self.in_flight += 1
+            waiter.granted = True
+            waiter.event.set()
+
+    @property
+    def retry_after(self) -> float:
+        return self.limiter.retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        """Current limit, load and queue-time statistics per priority class"""
+        with self._lock:
+            return {
+                'limit': int(self.limiter.limit),
+                'in_flight': self.in_flight,
+                'waiting': sum(1 for entry in self._queue if not entry[3].abandoned),
+                'classes': {priority.name.lower(): self._stats[priority].as_dict() for priority in Priority},
+            }
@@ -0,0 +1,200 @@
+"""
+Full-text search over chat messages
+
+SQLite uses an FTS5 virtual table and PostgreSQL a side table with a GIN
+indexed tsvector. Both are keyed by message id and carry the owning user and
+chat so searches never touch the hot message table. Rows are written from
+Python (see api.signals) so the index always sees the decoded message text.
+Only messages in the hot table are indexed: archived chats are left out of
+search until they are rehydrated (see api.services.archive).
+"""
+import base64
+import html
+import json
+import re
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.db import connections
+
+FTS_TABLE = 'api_chatmessage_fts'
+PG_TABLE = 'api_chatmessage_search'
+
+# Snippet markers; the snippet is HTML-escaped before they become <mark> tags.
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+# Arabic short vowels, tanween, shadda, sukun, superscript alef and tatweel
+_ARABIC_DIACRITICS = re.compile('[\u064B-\u065F\u0670\u0640]')
+_ARABIC_LETTER_VARIANTS = str.maketrans({
+    '\u0623': '\u0627',  # alef with hamza above -> alef
+    '\u0625': '\u0627',  # alef with hamza below -> alef
+    '\u0622': '\u0627',  # alef with madda -> alef
+    '\u0671': '\u0627',  # alef wasla -> alef
+    '\u0649': '\u064A',  # alef maksura -> yeh
+})
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """Fold Arabic spelling variants so indexed text and queries match"""
+    return _ARABIC_DIACRITICS.sub('', text or '').translate(_ARABIC_LETTER_VARIANTS)
+
+
+def _query_terms(query: str) -> List[str]:
+    return _TERM_RE.findall(normalize_text(query))[:16]
+
+
+def encode_cursor(score: float, message_id: int) -> str:
+    raw = json.dumps([score, message_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """Return (score, message_id) or raise ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        score, message_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(score), int(message_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _render_snippet(snippet: str) -> str:
+    return html.escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def index_messages(messages: Iterable, using: str = 'default') -> None:
+    """
+    Add or refresh index rows for messages
+
+    Args:
+        messages: ChatMessage instances; ``chat`` must be loaded or cheap to load
+        using: Database alias the messages live in
+    """
+    rows = [
+        (message.id, message.chat.user_id, uuid.UUID(str(message.chat_id)).hex, normalize_text(message.content))
+        for message in messages
+    ]
+    if rows:
+        index_rows(rows, using)
+
+
+def index_rows(rows: List[tuple], using: str = 'default') -> None:
+    """Index raw (message_id, user_id, chat_id_hex, normalized_content) tuples"""
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.executemany(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows]
+            )
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, user_id, chat_id, content) VALUES (%s, %s, %s, %s)",
+                rows,
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.executemany(
+                f"INSERT INTO {PG_TABLE} (message_id, user_id, chat_id, content, document) "
+                f"VALUES (%s, %s, %s::uuid, %s, to_tsvector('simple', %s)) "
+                f"ON CONFLICT (message_id) DO UPDATE SET content = EXCLUDED.content, "
+                f"document = EXCLUDED.document",
+                [(*row, row[3]) for row in rows],
+            )
+
+
+def unindex_messages(message_ids: List[int], using: str = 'default') -> None:
+    """Remove index rows for deleted messages"""
+    if not message_ids:
+        return
+    connection = connections[using]
+    table = {'sqlite': FTS_TABLE, 'postgresql': PG_TABLE}.get(connection.vendor)
+    if not table:
+        return
+    key = 'rowid' if connection.vendor == 'sqlite' else 'message_id'
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {table} WHERE {key} = %s", [(pk,) for pk in message_ids])
+
+
+def search_messages(user, query: str, cursor: Optional[str] = None, limit: int = 20,
+                    using: str = 'default') -> Dict[str, Any]:
+    """
+    Ranked search over a user's messages
+
+    Args:
+        user: Owner of the messages to search
+        query: Free text; every term must match, the last one as a prefix
+        cursor: Opaque cursor from a previous page
+        limit: Page size
+
+    Returns:
+        Dictionary with 'results' (message_id, chat_id, score, snippet) and 'next_cursor'
+    """
+    terms = _query_terms(query)
+    if not terms:
+        return {'results': [], 'next_cursor': None}
+
+    after = decode_cursor(cursor) if cursor else None
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        rows = _search_sqlite(connection, user.id, terms, after, limit + 1)
+    elif connection.vendor == 'postgresql':
+        rows = _search_postgres(connection, user.id, terms, after, limit + 1)
+    else:
+        raise NotImplementedError(f"Full-text search is not available on {connection.vendor}")
+
+    next_cursor = encode_cursor(rows[limit - 1][2], rows[limit - 1][0]) if len(rows) > limit else None
+    results = [
+        {
+            'message_id': message_id,
+            'chat_id': str(uuid.UUID(str(chat_id))),
+            'score': score,
+            'snippet': _render_snippet(snippet),
+        }
+        for message_id, chat_id, score, snippet in rows[:limit]
+    ]
+    return {'results': results, 'next_cursor': next_cursor}
+
+
+def _search_sqlite(connection, user_id, terms, after, limit):
+    # Quote every term so user input cannot inject FTS5 operators
+    match = ' '.join('"%s"' % term.replace('"', '""') for term in terms) + '*'
+    keyset = "WHERE score > %s OR (score = %s AND message_id > %s)" if after else ""
+    sql = f"""
+        SELECT message_id, chat_id, score, snippet FROM (
+            SELECT rowid AS message_id, chat_id, bm25({FTS_TABLE}) AS score,
+                   snippet({FTS_TABLE}, 2, %s, %s, '…', 16) AS snippet
+            FROM {FTS_TABLE}
+            WHERE {FTS_TABLE} MATCH %s AND user_id = %s
+        ) {keyset}
+        ORDER BY score, message_id
+        LIMIT %s
+    """
+    params = [_MARK_START, _MARK_END, match, user_id]
+    if after:
+        params += [after[0], after[0], after[1]]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit])
+        return cursor.fetchall()
+
+
+def _search_postgres(connection, user_id, terms, after, limit):
+    tsquery = ' & '.join("'%s'" % term.replace("'", "''") for term in terms) + ':*'
+    keyset = "WHERE score > %s OR (score = %s AND message_id > %s)" if after else ""
+    # Scores are negated so that, as on SQLite, lower sorts first
+    sql = f"""
+        SELECT message_id, chat_id, score, snippet FROM (
+            SELECT s.message_id, s.chat_id, -ts_rank_cd(s.document, q)::float8 AS score,
+                   ts_headline('simple', s.content, q,
+                               'StartSel=' || %s || ', StopSel=' || %s || ', MaxWords=24, MinWords=8') AS snippet
+            FROM {PG_TABLE} s, to_tsquery('simple', %s) q
+            WHERE s.user_id = %s AND s.document @@ q
+        ) ranked {keyset}
+        ORDER BY score, message_id
+        LIMIT %s
+    """
+    params = [_MARK_START, _MARK_END, tsquery, user_id]
+    if after:
+        params += [after[0], after[0], after[1]]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit])
+        return cursor.fetchall()
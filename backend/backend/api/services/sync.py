@@ -0,0 +1,173 @@
+"""
+Incremental sync of chats and messages
+
+Clients keep a cursor per chat (the last message they hold) and one for the
+chat list (the last change they saw) and fetch only what came after it. Both
+reads are keyset scans over composite indexes, so their cost grows with the
+number of new rows rather than with the size of the chat or the account.
+Imported chats keep their original timestamps, so a client that imports
+history should start over with a full sync.
+
+Timestamps are taken before the rows commit, so a row can become visible
+after others stamped later than it. Cursors therefore never move past rows
+stamped within SYNC_SAFETY_LAG seconds of now: those rows are sent again on
+the next sync, and clients must apply what they receive by id.
+
+Deletions are reported from tombstones, which are kept for
+SYNC_TOMBSTONE_RETENTION_DAYS (see the prune_tombstones command). A client
+whose position in the chat feed is older than that may have missed some,
+so it gets ResyncRequired and must start over with a full sync.
+"""
+import base64
+import json
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.models import Chat, ChatMessage, ChatTombstone
+
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 1000
+
+
+class ResyncRequired(Exception):
+    """The client's sync position predates the tombstones still kept"""
+
+
+def tombstone_horizon() -> datetime:
+    """Tombstones of chats deleted before this time may have been pruned"""
+    return timezone.now() - timedelta(days=getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 30))
+
+
+def settled_before() -> datetime:
+    """Rows stamped before this time are assumed to be committed"""
+    return timezone.now() - timedelta(seconds=getattr(settings, 'SYNC_SAFETY_LAG', 5))
+
+
+def parse_limit(value: Optional[str]) -> int:
+    """Clamp a client supplied page size; raises ValueError when it is not a number"""
+    if value in (None, ''):
+        return DEFAULT_LIMIT
+    return min(max(int(value), 1), MAX_LIMIT)
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp, assuming the current timezone when none is given"""
+    parsed = parse_datetime(value.replace(' ', '+')) if value else None
+    if parsed is None:
+        raise ValueError(f"Invalid timestamp: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def encode_cursor(updated_at: datetime, chat_id) -> str:
+    raw = json.dumps([updated_at.isoformat(), str(chat_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """Return (updated_at, chat_id) or raise ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        updated_at, chat_id = json.loads(base64.urlsafe_b64decode(padded))
+        return parse_timestamp(updated_at), uuid.UUID(chat_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def messages_after(chat: Chat, after_id: Optional[int] = None, since: Optional[datetime] = None,
+                   limit: int = DEFAULT_LIMIT) -> Dict[str, Any]:
+    """
+    Messages of a chat that come after the client's last one
+
+    Args:
+        chat: Chat to read; must not be archived
+        after_id: Id of the newest message the client holds
+        since: Alternatively, only messages created after this time
+        limit: Page size
+
+    Returns:
+        Dictionary with 'messages' (ChatMessage list, oldest first),
+        'has_more' and 'last_id', the newest of them that the client can
+        sync after next time (None if none has settled yet)
+
+    Raises:
+        ChatMessage.DoesNotExist: after_id is not a message of this chat
+    """
+    messages = chat.messages.order_by('created_at', 'id')
+    if after_id is not None:
+        anchor = chat.messages.values_list('created_at', flat=True).get(id=after_id)
+        messages = messages.filter(Q(created_at__gt=anchor) | Q(created_at=anchor, id__gt=after_id))
+    elif since is not None:
+        messages = messages.filter(created_at__gt=since)
+    page = list(messages[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    # A full page moves on regardless, or a burst of new messages would be fetched forever
+    horizon = settled_before()
+    settled = page if has_more else [message for message in page if message.created_at < horizon]
+    return {'messages': page, 'has_more': has_more, 'last_id': settled[-1].id if settled else None}
+
+
+def chats_changed(user, cursor: Optional[str] = None, since: Optional[datetime] = None,
+                  limit: int = DEFAULT_LIMIT) -> Dict[str, Any]:
+    """
+    Chats of a user created, updated or deleted after a point in time
+
+    Args:
+        user: Owner of the chats
+        cursor: Opaque cursor returned by a previous call; takes precedence over since
+        since: Start of the feed for a client without a cursor
+        limit: Page size for changed chats
+
+    Returns:
+        Dictionary with 'chats' (oldest change first), 'deleted' (chat ids),
+        'has_more' and 'cursor' to pass on the next call
+
+    Raises:
+        ValueError: The cursor is invalid
+        ResyncRequired: The cursor or since is older than the tombstones kept
+    """
+    chats = (
+        Chat.objects.filter(user=user)
+        .select_related('archive').defer('archive__payload')
+        .order_by('updated_at', 'id')
+    )
+    tombstones = ChatTombstone.objects.filter(user=user)
+    if cursor:
+        after_time, after_id = decode_cursor(cursor)
+        chats = chats.filter(Q(updated_at__gt=after_time) | Q(updated_at=after_time, id__gt=after_id))
+        tombstones = tombstones.filter(deleted_at__gte=after_time)
+    elif since is not None:
+        after_time = since
+        chats = chats.filter(updated_at__gt=since)
+        tombstones = tombstones.filter(deleted_at__gt=since)
+    else:
+        # A client without any state has nothing to delete
+        after_time = None
+        tombstones = tombstones.none()
+    if after_time is not None and after_time < tombstone_horizon():
+        raise ResyncRequired()
+
+    page = list(chats[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    if has_more:
+        next_cursor = encode_cursor(page[-1].updated_at, page[-1].id)
+    else:
+        # Everything settled has been sent, so the cursor moves up to the
+        # horizon even when nothing changed and never outlives the tombstones
+        horizon = settled_before()
+        if after_time is not None and after_time >= horizon:
+            next_cursor = cursor or encode_cursor(after_time, uuid.UUID(int=0))
+        else:
+            next_cursor = encode_cursor(horizon, uuid.UUID(int=0))
+    # Deletions are few, so they are sent in full with every page
+    deleted = [str(chat_id) for chat_id in tombstones.values_list('chat_id', flat=True)]
+    return {'chats': page, 'deleted': deleted, 'has_more': has_more, 'cursor': next_cursor}
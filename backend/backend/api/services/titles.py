@@ -0,0 +1,162 @@
+"""
+Local extractive chat titles, without a provider call
+
+The title is the (at most five) most informative words of the user's first
+message, kept in their original order. A word's weight is its inverse
+document frequency over past user messages (see the build_title_idf command),
+summed over its occurrences and decayed slightly with position; English and
+Arabic stopwords never make it in. Words the table has not seen count as
+rare, so without a table every non-stopword is weighted the same and the
+earliest ones win.
+"""
+import json
+import logging
+import math
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+from api.services.search import normalize_text
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+logger = logging.getLogger(__name__)
+
+MAX_TITLE_WORDS = 5
+MAX_TITLE_CHARS = 50
+# Only the start of a long message is read
+MAX_PROMPT_CHARS = 600
+POSITION_DECAY = 0.05
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+ENGLISH_STOPWORDS = {
+    'a', 'about', 'above', 'after', 'again', 'against', 'all', 'also', 'am', 'an', 'and', 'any', 'are',
+    'as', 'at', 'be', 'because', 'been', 'before', 'being', 'below', 'between', 'both', 'but', 'by',
+    'can', 'could', 'describe', 'did', 'do', 'does', 'doing', 'done', 'down', 'during', 'each', 'explain', 'few', 'for', 'from',
+    'further', 'get', 'give', 'had', 'has', 'have', 'having', 'he', 'hello', 'help', 'her', 'here',
+    'hers', 'hey', 'hi', 'him', 'his', 'how', 'i', 'if', 'in', 'into', 'is', 'it', 'its', 'itself',
+    'just', 'know', 'let', 'like', 'make', 'me', 'more', 'most', 'my', 'need', 'no', 'nor', 'not',
+    'now', 'of', 'off', 'on', 'once', 'one', 'only', 'or', 'other', 'our', 'out', 'over', 'own', 'please',
+    'same', 'she', 'should', 'show', 'so', 'some', 'such', 'summarize', 'tell', 'than', 'thank', 'thanks', 'that',
+    'the', 'their', 'them', 'then', 'there', 'these', 'they', 'this', 'those', 'through', 'to', 'too',
+    'under', 'until', 'up', 'us', 'use', 'very', 'want', 'was', 'way', 'we', 'were', 'what', 'when',
+    'where', 'which', 'while', 'who', 'whom', 'why', 'will', 'with', 'would', 'write', 'you', 'your',
+    'yours', 'll', 're', 've', 'don', 'doesn', 'isn', 'ok', 'okay', 'yes',
+}
+
+ARABIC_STOPWORDS = {normalize_text(word) for word in (
+    'من', 'إلى', 'الى', 'عن', 'على', 'في', 'ما', 'ماذا', 'هل', 'هذا', 'هذه', 'ذلك', 'تلك', 'التي',
+    'الذي', 'الذين', 'كان', 'كانت', 'يكون', 'و', 'أو', 'ثم', 'لا', 'لم', 'لن', 'أن', 'إن', 'كيف',
+    'متى', 'أين', 'لماذا', 'أنا', 'أنت', 'هو', 'هي', 'نحن', 'هم', 'مع', 'كل', 'بعض', 'أي', 'عند',
+    'بين', 'قد', 'لقد', 'حتى', 'إذا', 'لكن', 'بل', 'أيضا', 'فقط', 'جدا', 'يمكن', 'يمكنك', 'ممكن',
+    'أريد', 'أرجو', 'فضلك', 'لو', 'سمحت', 'شكرا', 'مرحبا', 'السلام', 'عليكم', 'لي', 'له', 'لها',
+    'لك', 'به', 'بها', 'فيه', 'فيها', 'منه', 'عليه', 'اشرح', 'ساعدني', 'اكتب', 'أعطني',
+)}
+
+STOPWORDS = ENGLISH_STOPWORDS | ARABIC_STOPWORDS
+
+_table_lock = threading.Lock()
+_idf_table: Optional[Dict[str, float]] = None
+_unseen_idf = 1.0
+
+
+def _load_table() -> Dict[str, float]:
+    """Read the IDF table once per process"""
+    global _idf_table, _unseen_idf
+    if _idf_table is None:
+        with _table_lock:
+            if _idf_table is None:
+                path = Path(getattr(settings, 'CHAT_TITLE_IDF_PATH', settings.BASE_DIR / 'title_idf.json'))
+                try:
+                    data = json.loads(path.read_text(encoding='utf-8'))
+                    _unseen_idf = idf_value(data['documents'], 0)
+                    _idf_table = data['idf']
+                except FileNotFoundError:
+                    _idf_table = {}
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"Ignoring unreadable title IDF table {path}: {e}")
+                    _idf_table = {}
+    return _idf_table
+
+
+def idf_value(documents: int, document_frequency: int) -> float:
+    """Smoothed inverse document frequency"""
+    return math.log((documents + 1) / (document_frequency + 1)) + 1
+
+
+def keywords(text: str) -> Iterable[str]:
+    """Normalized, lower-cased non-stopword terms of a text, for building the table"""
+    for term in _WORD_RE.findall(normalize_text(text).lower()):
+        if term not in STOPWORDS and len(term) > 1 and not term.isdigit():
+            yield term
+
+
+def _normalized_words(text: str) -> Iterator[Tuple[str, str]]:
+    """
+    (term, surface) pairs of a text, tokenized after normalize_text
+
+    Diacritics are not word characters, so tokenizing the raw text would split
+    vocalized Arabic words apart. The surface is the original span of the word,
+    diacritics included.
+    """
+    normalized: List[str] = []
+    origins: List[int] = []
+    # normalize_text drops or replaces single characters, so it can run per character
+    for index, char in enumerate(text):
+        folded = normalize_text(char)
+        if folded:
+            normalized.append(folded)
+            origins.append(index)
+    normalized_text = ''.join(normalized)
+    origins.append(len(text))
+    for match in _WORD_RE.finditer(normalized_text):
+        yield match.group().lower(), text[origins[match.start()]:origins[match.end()]]
+
+
+def local_title(text: str) -> str:
+    """
+    Extract a title of up to MAX_TITLE_WORDS words from a message
+
+    Returns:
+        The title, or the start of the message if it has no usable words
+    """
+    table = _load_table()
+    surfaces: List[str] = []
+    term_ids: List[int] = []
+    weights: List[float] = []
+    ids: Dict[str, int] = {}
+    for position, (term, surface) in enumerate(_normalized_words(text[:MAX_PROMPT_CHARS])):
+        if term in STOPWORDS or len(term) < 2 or term.isdigit():
+            continue
+        term_id = ids.get(term)
+        if term_id is None:
+            term_id = ids[term] = len(surfaces)
+            surfaces.append(surface)
+        term_ids.append(term_id)
+        weights.append(table.get(term, _unseen_idf) / (1 + POSITION_DECAY * position))
+    if not surfaces:
+        return text.strip()[:MAX_TITLE_CHARS]
+
+    if np is not None:
+        scores = np.bincount(term_ids, weights=weights, minlength=len(surfaces))
+        # Stable sort keeps earlier words ahead on ties
+        chosen = sorted(np.argsort(-scores, kind='stable')[:MAX_TITLE_WORDS].tolist())
+    else:
+        scores = [0.0] * len(surfaces)
+        for term_id, weight in zip(term_ids, weights):
+            scores[term_id] += weight
+        ranked = sorted(range(len(surfaces)), key=lambda i: -scores[i])
+        chosen = sorted(ranked[:MAX_TITLE_WORDS])
+
+    words = [surfaces[i][:1].upper() + surfaces[i][1:] if surfaces[i].islower() else surfaces[i] for i in chosen]
+    title = ' '.join(words)
+    if len(title) > MAX_TITLE_CHARS:
+        title = title[:MAX_TITLE_CHARS].rsplit(' ', 1)[0]
+    return title
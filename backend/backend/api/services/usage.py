@@ -0,0 +1,134 @@
+"""
+Token usage rolled up per user, model and day
+
+Summing ChatMessage.tokens_used answers "how many tokens did each user spend
+on each model last month", but reads every assistant message in the range.
+Instead, saving an assistant reply also adds it to the UsageRollup row of its
+user, model and day, in the same transaction as the message. Usage queries
+then read at most one row per day and model, however many messages there are.
+
+Rollups record usage as it happened: archiving or deleting chats leaves them
+alone. ``rebuild`` recomputes a user's rollups from the messages still stored,
+hot and archived, which backfills history from before rollups existed (see
+the build_usage_rollups command).
+"""
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.models import ChatMessage, UsageRollup
+from api.services.archive import iter_archived_messages
+
+# Ways usage can be grouped, and the rollup field each one reads
+GROUP_FIELDS = {'day': 'day', 'model': 'model', 'user': 'user_id'}
+
+
+def _tally(rows: Iterable[Tuple[date, Optional[str], Optional[int]]]) -> Dict[Tuple[date, str], List[int]]:
+    """Message count and token sum per (day, model) of (day, model_used, tokens_used) rows"""
+    totals = defaultdict(lambda: [0, 0])
+    for day, model, tokens in rows:
+        entry = totals[(day, model or '')]
+        entry[0] += 1
+        entry[1] += tokens or 0
+    return totals
+
+
+def record(user_id, messages: Sequence[ChatMessage], using: str = 'default') -> None:
+    """Add newly saved assistant messages of a user to their rollups"""
+    totals = _tally(
+        (timezone.localdate(message.created_at), message.model_used, message.tokens_used)
+        for message in messages if message.role == 'assistant'
+    )
+    for (day, model), (count, tokens) in totals.items():
+        rollup = UsageRollup.objects.using(using).filter(user_id=user_id, day=day, model=model)
+        increment = {'messages': F('messages') + count, 'tokens': F('tokens') + tokens}
+        if rollup.update(**increment):
+            continue
+        try:
+            with transaction.atomic(using=using):
+                UsageRollup.objects.using(using).create(
+                    user_id=user_id, day=day, model=model, messages=count, tokens=tokens,
+                )
+        except IntegrityError:
+            # Another reply of the same day and model created the row first
+            rollup.update(**increment)
+
+
+def rebuild(user) -> int:
+    """Replace a user's rollups with totals over their stored messages; returns the number of rows"""
+    hot = (
+        ChatMessage.objects.filter(chat__user=user, role='assistant')
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'model_used')
+        .annotate(count=Count('id'), tokens=Coalesce(Sum('tokens_used'), 0))
+        .order_by()
+    )
+    totals = _tally(
+        (timezone.localdate(parse_datetime(archived['created_at'])), archived['model_used'], archived['tokens_used'])
+        for archived in iter_archived_messages(user) if archived['role'] == 'assistant'
+    )
+    for row in hot:
+        entry = totals[(row['day'], row['model_used'] or '')]
+        entry[0] += row['count']
+        entry[1] += row['tokens']
+    with transaction.atomic():
+        UsageRollup.objects.filter(user=user).delete()
+        UsageRollup.objects.bulk_create([
+            UsageRollup(user=user, day=day, model=model, messages=count, tokens=tokens)
+            for (day, model), (count, tokens) in totals.items()
+        ], batch_size=1000)
+    return len(totals)
+
+
+def summarize(user_id, start: date, end: date, group_by: Sequence[str] = ('day', 'model')) -> Dict[str, Any]:
+    """
+    Usage between two days (inclusive), totalled and grouped
+
+    Args:
+        user_id: Whose usage to report; None for every user
+        start: First day of the range
+        end: Last day of the range
+        group_by: Names from GROUP_FIELDS to break the totals down by
+
+    Returns:
+        Dictionary with 'totals' and a 'usage' row per group, each with
+        'messages' and 'tokens'
+
+    Raises:
+        ValueError: If a group_by name is unknown
+    """
+    unknown = set(group_by) - set(GROUP_FIELDS)
+    if unknown:
+        raise ValueError(f"Cannot group usage by {', '.join(sorted(unknown))}")
+    rollups = UsageRollup.objects.filter(day__range=(start, end))
+    if user_id is not None:
+        rollups = rollups.filter(user_id=user_id)
+    # The totals are annotated under other names, since they would clash with the model's fields
+    totals = rollups.aggregate(total_messages=Coalesce(Sum('messages'), 0), total_tokens=Coalesce(Sum('tokens'), 0))
+    usage = []
+    fields = [GROUP_FIELDS[name] for name in group_by]
+    if fields:
+        grouped = (
+            rollups.values(*fields)
+            .annotate(total_messages=Sum('messages'), total_tokens=Sum('tokens'))
+            .order_by(*fields)
+        )
+        for row in grouped:
+            usage.append({
+                **{field: row[field] for field in fields},
+                'messages': row['total_messages'],
+                'tokens': row['total_tokens'],
+            })
+    return {
+        'start': start,
+        'end': end,
+        'group_by': list(group_by),
+        'totals': {'messages': totals['total_messages'], 'tokens': totals['total_tokens']},
+        'usage': usage,
+    }
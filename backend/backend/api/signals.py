@@ -0,0 +1,103 @@
+"""
+Model signal handlers for the api app
+"""
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest, Now
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from api.authentication import user_cache
+from api.models import Chat, ChatMessage, ChatTombstone, CustomUser
+from api.services import documents, memory, search, usage
+from api.token_blacklist import blacklist_filter
+
+
+@receiver(post_save, sender=ChatMessage)
+def touch_chat(sender, instance, created, using='default', **kwargs):
+    """Bump the chat's updated_at so list ordering and validators see new messages"""
+    if created:
+        # Replies can commit out of order, so never move updated_at backwards
+        Chat.objects.using(using).filter(pk=instance.chat_id).update(updated_at=Greatest(F('updated_at'), Now()))
+
+
+@receiver(post_save, sender=ChatMessage)
+def index_chat_message(sender, instance, created, update_fields=None, using='default', **kwargs):
+    """Keep the full-text index in step with new and edited messages"""
+    if update_fields is not None and 'content' not in update_fields:
+        return
+    search.index_messages([instance], using=using)
+
+
+@receiver(post_save, sender=ChatMessage)
+def remember_chat_message(sender, instance, created, **kwargs):
+    """Add new messages to their owner's cross-chat memory once they are committed"""
+    if created:
+        memory.remember_on_commit(instance.chat.user_id, [instance])
+
+
+@receiver(post_save, sender=ChatMessage)
+def record_usage(sender, instance, created, using='default', **kwargs):
+    """Add new assistant replies to their owner's usage rollups"""
+    if created and instance.role == 'assistant':
+        usage.record(instance.chat.user_id, [instance], using=using)
+
+
+@receiver(post_delete, sender=ChatMessage)
+def unindex_chat_message(sender, instance, using='default', **kwargs):
+    """Drop deleted messages from the full-text index"""
+    search.unindex_messages([instance.id], using=using)
+
+
+@receiver(post_delete, sender=Chat)
+def record_chat_tombstone(sender, instance, using='default', **kwargs):
+    """Leave a tombstone for the sync feed to report the deletion"""
+    ChatTombstone.objects.using(using).update_or_create(
+        chat_id=instance.pk, defaults={'user_id': instance.user_id, 'deleted_at': timezone.now()},
+    )
+
+
+@receiver(post_save, sender=Chat)
+def clear_chat_tombstone(sender, instance, created, using='default', **kwargs):
+    """A chat imported under the id of a deleted one is no longer deleted"""
+    if created:
+        ChatTombstone.objects.using(using).filter(chat_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=CustomUser)
+def drop_chat_tombstones(sender, instance, using='default', **kwargs):
+    """Remove the tombstones left by the user's own cascading chat deletion"""
+    ChatTombstone.objects.using(using).filter(user_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=CustomUser)
+def drop_document_index(sender, instance, **kwargs):
+    """Delete the user's document vectors along with their chunks"""
+    pk = instance.pk
+    transaction.on_commit(lambda: documents.VectorIndex.for_user(pk).delete())
+
+
+@receiver(post_delete, sender=CustomUser)
+def drop_memory_index(sender, instance, **kwargs):
+    """Delete the user's cross-chat memory along with their messages"""
+    pk = instance.pk
+    transaction.on_commit(lambda: memory.MemoryIndex.for_user(pk).delete())
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Make every worker reload the user (e.g. after deactivation) on its next request"""
+    # A deletion clears instance.pk before an outer transaction commits
+    pk = instance.pk
+    transaction.on_commit(lambda: user_cache.invalidate(pk))
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def add_to_blacklist_filter(sender, instance, created, **kwargs):
+    """Record newly blacklisted JTIs in the in-memory filter"""
+    if created:
+        blacklist_filter.add(instance.token.jti)
@@ -1,3 +1,1183 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from api.authentication import user_cache
+from api.cache import SQLiteCache, increment
+from api.fields import COMPRESSED_PREFIX
+from api.middleware import BackpressureMiddleware
+from api.models import Chat, ChatMessage, ChatTombstone, CustomUser, UsageRollup
+from api.renderers import ORJSONRenderer
+from api.services import (
+    archive, documents, generation, lexical_vectors, memory, routing, sync, titles, usage,
+)
+from api.services.ai_service import AIProvider, ai_service_manager
+from api.services.cancellation import CancelToken, request_cancel
+from api.services.chat_turn import (
+    TurnError, complete_turn, create_chat_title, generate_reply, prepare_turn, provider_messages,
+)
+from api.services.provider_limits import AdaptiveLimiter
+from api.services.scheduler import Priority, ProviderScheduler
+from api.token_blacklist import BlacklistFilter
+from api.websocket import ChatSocket, turn_limits
+
+
+def other_worker() -> BlacklistFilter:
+    """A second process's filter, which only catches up through the shared generation"""
+    worker = BlacklistFilter(capacity=1000, error_rate=0.001, max_staleness=3600, rebuild_interval=3600,
+                             sync_margin=60)
+    worker.rebuild()
+    return worker
+
+
+class ScriptedProvider(AIProvider):
+    """A provider answering with the given responses in turn"""
+
+    def __init__(self, *responses):
+        super().__init__('test-key', 'scripted')
+        self.responses = list(responses)
+        self.calls = 0
+
+    def generate_response(self, messages, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+    def validate_api_key(self):
+        return True
+
+    @property
+    def provider_name(self):
+        return 'Scripted'
+
+    @property
+    def supported_models(self):
+        return ['scripted']
+
+
+def fake_stream(*texts, tokens_used=0):
+    """A provider replying with ``texts``, to patch ai_service_manager.stream_response with"""
+    def stream_response(model_name, messages, **kwargs):
+        for text in texts:
+            yield {'type': 'delta', 'content': text}
+        yield {'type': 'done', 'model_used': model_name, 'tokens_used': tokens_used}
+    return stream_response
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BlacklistFilterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='worker', email='worker@example.com', password='pw')
+
+    def test_refresh_on_other_worker_after_logout(self):
+        refresh = RefreshToken.for_user(self.user)
+        worker = other_worker()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/auth/logout/', {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        with mock.patch('api.token_blacklist.blacklist_filter', worker):
+            response = APIClient().post('/api/auth/token/refresh/', {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_generation_bumped_only_after_commit(self):
+        refresh = RefreshToken.for_user(self.user)
+        worker = other_worker()
+        generation = cache.get(BlacklistFilter.GENERATION_KEY)
+        with self.captureOnCommitCallbacks() as callbacks:
+            refresh.blacklist()
+        self.assertEqual(cache.get(BlacklistFilter.GENERATION_KEY), generation)
+
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(cache.get(BlacklistFilter.GENERATION_KEY), generation)
+        self.assertTrue(worker.might_contain(refresh['jti']))
+
+    def test_rows_committed_out_of_id_order(self):
+        first, late = RefreshToken.for_user(self.user), RefreshToken.for_user(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            BlacklistedToken.objects.create(id=1000, token=OutstandingToken.objects.get(jti=first['jti']))
+        worker = other_worker()
+        self.assertFalse(worker.might_contain(late['jti']))
+
+        # A lower id that commits after the worker has seen id 1000
+        with self.captureOnCommitCallbacks(execute=True):
+            BlacklistedToken.objects.create(id=1, token=OutstandingToken.objects.get(jti=late['jti']))
+        self.assertTrue(worker.might_contain(late['jti']))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BlacklistFilterStartupTests(TransactionTestCase):
+    def test_warm_up_builds_the_filter(self):
+        user = CustomUser.objects.create_user(username='early', email='early@example.com', password='pw')
+        refresh = RefreshToken.for_user(user)
+        refresh.blacklist()
+        worker = BlacklistFilter(capacity=1000, error_rate=0.001, max_staleness=3600, rebuild_interval=3600,
+                                 sync_margin=60)
+        worker.warm_up().join(10)
+        self.assertIsNotNone(worker._bloom)
+        self.assertIn(refresh['jti'], worker._bloom)
+
+    def test_blacklisted_at_index_migrates_both_ways(self):
+        def indexed():
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(cursor, 'token_blacklist_blacklistedtoken')
+            return 'api_blacklisted_at_idx' in constraints
+
+        executor = MigrationExecutor(connection)
+        leaves = executor.loader.graph.leaf_nodes()
+        self.assertTrue(indexed())
+        executor.migrate([('api', '0012_usage_rollups')])
+        self.assertFalse(indexed())
+        executor = MigrationExecutor(connection)
+        executor.migrate(leaves)
+        self.assertTrue(indexed())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class UserCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='cached', email='cached@example.com', password='pw')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+
+    def test_user_deleted_in_outer_transaction_is_dropped(self):
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 200)
+        self.assertIsNotNone(user_cache.get(self.user.pk))
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            CustomUser.objects.get(pk=self.user.pk).delete()
+        self.assertIsNone(user_cache.get(self.user.pk))
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 401)
+
+    def test_change_while_loading_is_not_cached(self):
+        version = user_cache.version(self.user.pk)
+        stale = CustomUser.objects.get(pk=self.user.pk)
+        user_cache.invalidate(self.user.pk)
+        user_cache.set(self.user.pk, version, stale)
+        self.assertIsNone(user_cache.get(self.user.pk))
+
+    def test_cached_user_leaves_password_out(self):
+        self.client.get('/api/auth/profile/')
+        record = cache.get(f'api:jwt-user:{self.user.pk}:{user_cache.version(self.user.pk)}')
+        self.assertNotIn('password', record['fields'])
+        user, _ = user_cache.get(self.user.pk)
+        user.first_name = 'Renamed'
+        user.save()
+        self.assertTrue(CustomUser.objects.get(pk=self.user.pk).check_password('pw'))
+
+
+class ArchiveChatTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(username='archiver', email='archiver@example.com', password='pw')
+        self.chat = Chat.objects.create(user=user, title='Old chat')
+        ChatMessage.objects.create(chat=self.chat, role='user', content='hello')
+        self.cutoff = timezone.now() + timedelta(seconds=1)
+
+    def test_message_posted_while_archiving_is_kept(self):
+        pack = archive._pack
+
+        def pack_then_post(messages):
+            payload = pack(messages)
+            ChatMessage.objects.create(chat=self.chat, role='user', content='posted meanwhile')
+            return payload
+
+        with mock.patch('api.services.archive._pack', pack_then_post):
+            result = archive.archive_chat(self.chat, self.cutoff)
+        self.assertEqual(result['messages'], 1)
+        self.assertEqual(list(self.chat.messages.values_list('content', flat=True)), ['posted meanwhile'])
+
+    def test_archived_chats_are_left_out_of_search(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.chat.user).access_token}')
+        archive.archive_chat(self.chat, self.cutoff)
+        response = client.get('/api/chats/search/', {'q': 'hello'})
+        self.assertEqual(response.json()['results'], [])
+        self.assertEqual(response.json()['archived_chats'], 1)
+
+        archive.rehydrate_chat(Chat.objects.get(pk=self.chat.pk))
+        response = client.get('/api/chats/search/', {'q': 'hello'})
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertEqual(response.json()['archived_chats'], 0)
+
+    def test_chat_updated_after_cutoff_is_skipped(self):
+        result = archive.archive_chat(self.chat, timezone.now() - timedelta(days=1))
+        self.assertEqual(result['messages'], 0)
+        self.assertEqual(self.chat.messages.count(), 1)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ChatSocketTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='socket', email='socket@example.com', password='pw')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    async def _open(self, query_string=b''):
+        self.incoming, self.outgoing = asyncio.Queue(), asyncio.Queue()
+        scope = {'type': 'websocket', 'path': '/ws/chat/', 'query_string': query_string}
+        self.socket_task = asyncio.ensure_future(ChatSocket(scope, self.incoming.get, self.outgoing.put).run())
+        await self.incoming.put({'type': 'websocket.connect'})
+        self.assertEqual((await self.outgoing.get())['type'], 'websocket.accept')
+
+    async def _connect(self, token=None):
+        await self._open()
+        await self._send({'type': 'auth', 'token': token or self.token})
+        self.assertEqual((await self._event())['type'], 'ready')
+
+    async def _closed_with(self):
+        message = await asyncio.wait_for(self.outgoing.get(), 5)
+        self.assertEqual(message['type'], 'websocket.close')
+        await asyncio.wait_for(self.socket_task, 5)
+        return message['code']
+
+    async def _send(self, data):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def _event(self):
+        message = await asyncio.wait_for(self.outgoing.get(), 5)
+        return json.loads(message['text'])
+
+    async def _disconnect(self):
+        self.release.set()
+        await self.incoming.put({'type': 'websocket.disconnect'})
+        await self.socket_task
+
+    async def test_token_in_query_string_is_ignored(self):
+        await self._open(f'token={self.token}'.encode())
+        await self._send({'type': 'ping'})
+        self.assertEqual(await self._closed_with(), 4401)
+
+    async def test_socket_closes_when_its_token_expires(self):
+        token = AccessToken.for_user(self.user)
+        token.set_exp(lifetime=timedelta(seconds=1))
+        await self._connect(str(token))
+        self.assertEqual(await self._closed_with(), 4401)
+
+    async def test_newer_token_keeps_the_socket_open(self):
+        token = AccessToken.for_user(self.user)
+        token.set_exp(lifetime=timedelta(seconds=1))
+        await self._connect(str(token))
+        await self._send({'type': 'auth', 'token': self.token})
+        self.assertEqual((await self._event())['type'], 'ready')
+        await asyncio.sleep(1.5)
+        await self._send({'type': 'ping'})
+        self.assertEqual((await self._event())['type'], 'pong')
+        await self._disconnect()
+
+    @override_settings(WEBSOCKET_AUTH_RECHECK_INTERVAL=0.1)
+    async def test_socket_closes_when_the_user_is_deleted(self):
+        await self._connect()
+
+        def delete_user():
+            with self.captureOnCommitCallbacks(execute=True):
+                CustomUser.objects.filter(pk=self.user.pk).delete()
+
+        await sync_to_async(delete_user)()
+        self.assertEqual(await self._closed_with(), 4401)
+
+    async def test_chat_id_must_be_a_uuid(self):
+        await self._connect()
+        await self._send({'type': 'prompt', 'chat_id': ['not', 'hashable'], 'content': 'hi'})
+        self.assertEqual((await self._event())['status'], 400)
+        await self._send({'type': 'ping'})
+        self.assertEqual((await self._event())['type'], 'pong')
+        await self._disconnect()
+
+    @override_settings(WEBSOCKET_MAX_TURNS_PER_CONNECTION=2)
+    async def test_concurrent_turns_are_capped(self):
+        with mock.patch('api.websocket.run_turn', lambda user, payload: self.release.wait(5)):
+            await self._connect()
+            chat_id = uuid.uuid4()
+            await self._send({'type': 'prompt', 'chat_id': str(chat_id), 'content': 'hi'})
+            # The same chat under another spelling of its id
+            await self._send({'type': 'prompt', 'chat_id': str(chat_id).upper(), 'content': 'hi'})
+            self.assertEqual((await self._event())['status'], 409)
+            await self._send({'type': 'prompt', 'chat_id': str(uuid.uuid4()), 'content': 'hi'})
+            await self._send({'type': 'prompt', 'chat_id': str(uuid.uuid4()), 'content': 'hi'})
+            self.assertEqual((await self._event())['status'], 429)
+            await self._disconnect()
+        # The turns' threads finish after the socket closes
+        for _ in range(100):
+            if not turn_limits.running:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(turn_limits.running, 0)
+
+
+class SyncTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='syncer', email='syncer@example.com', password='pw')
+        self.chat = Chat.objects.create(user=self.user, title='Synced chat')
+
+    def test_recent_rows_are_sent_again(self):
+        message = ChatMessage.objects.create(chat=self.chat, role='user', content='hello')
+        page = sync.chats_changed(self.user)
+        self.assertEqual([chat.id for chat in page['chats']], [self.chat.id])
+        # A row stamped earlier may still be committing, so the cursor must not pass it
+        self.assertEqual([chat.id for chat in sync.chats_changed(self.user, page['cursor'])['chats']], [self.chat.id])
+        self.assertIsNone(sync.messages_after(self.chat)['last_id'])
+
+        with override_settings(SYNC_SAFETY_LAG=-1):
+            page = sync.chats_changed(self.user)
+            self.assertEqual(sync.chats_changed(self.user, page['cursor'])['chats'], [])
+            self.assertEqual(sync.messages_after(self.chat)['last_id'], message.id)
+
+    def test_late_message_never_moves_updated_at_backwards(self):
+        ChatMessage.objects.create(chat=self.chat, role='user', content='hello')
+        updated_at = Chat.objects.get(pk=self.chat.pk).updated_at
+        ChatMessage.objects.create(chat=self.chat, role='assistant', content='late',
+                                   created_at=updated_at - timedelta(minutes=1))
+        self.assertGreaterEqual(Chat.objects.get(pk=self.chat.pk).updated_at, updated_at)
+
+
+class LocalTitleTests(TestCase):
+    def test_vocalized_arabic_keeps_whole_words(self):
+        self.assertEqual(titles.local_title('مَا هِيَ عَاصِمَةُ فَرَنْسَا؟'), 'عَاصِمَةُ فَرَنْسَا')
+
+
+class SearchMessagesViewTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(username='searcher', email='searcher@example.com', password='pw')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+
+    def test_database_without_full_text_search(self):
+        with mock.patch('api.services.search.search_messages', side_effect=NotImplementedError):
+            response = self.client.get('/api/chats/search/', {'q': 'hello'}, HTTP_ACCEPT_LANGUAGE='ar')
+        self.assertEqual(response.status_code, 501)
+        self.assertEqual(response.json()['error_code'], 'search_unavailable')
+        self.assertEqual(response.json()['language'], 'ar')
+
+
+class ChatTransferTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='mover', email='mover@example.com', password='pw')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+
+    def _import(self, records):
+        body = '\n'.join(json.dumps(record) for record in records)
+        return self.client.post('/api/chats/import/', body, content_type='application/x-ndjson')
+
+    def test_export_then_import_round_trip(self):
+        chat = Chat.objects.create(user=self.user, title='Exported')
+        ChatMessage.objects.create(chat=chat, role='user', content='hello')
+        ChatMessage.objects.create(chat=chat, role='assistant', content='hi there', tokens_used=3)
+        response = self.client.get('/api/chats/export/')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['type'] for line in lines], ['chat', 'message', 'message'])
+
+        chat.delete()
+        response = self._import([json.loads(line) for line in lines])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'chats_imported': 1, 'messages_imported': 2})
+        imported = Chat.objects.get(user=self.user)
+        self.assertEqual(imported.title, 'Exported')
+        self.assertEqual(list(imported.messages.values_list('content', flat=True)), ['hello', 'hi there'])
+
+    def test_invalid_line_stops_the_import(self):
+        chat_id = str(uuid.uuid4())
+        created_at = timezone.now().isoformat()
+        response = self._import([
+            {'type': 'chat', 'id': chat_id, 'title': 'Imported', 'created_at': created_at},
+            {'type': 'message', 'chat_id': chat_id, 'role': 'user', 'content': 'kept', 'created_at': created_at},
+            {'type': 'message', 'chat_id': chat_id, 'role': 'user', 'content': 'bad', 'created_at': created_at,
+             'tokens_used': 'many'},
+            {'type': 'message', 'chat_id': chat_id, 'role': 'user', 'content': 'after', 'created_at': created_at},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error_code'], 'invalid_import_line')
+        self.assertEqual(response.json()['line'], 3)
+        self.assertEqual(response.json()['messages_imported'], 1)
+        self.assertEqual(list(ChatMessage.objects.values_list('content', flat=True)), ['kept'])
+
+    def test_unknown_choices_are_rejected(self):
+        response = self._import([
+            {'type': 'chat', 'id': str(uuid.uuid4()), 'model_type': 'gpt-99', 'created_at': timezone.now().isoformat()},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['line'], 1)
+        self.assertFalse(Chat.objects.filter(user=self.user).exists())
+
+
+class CompressedTextFieldTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(username='squeezed', email='squeezed@example.com', password='pw')
+        self.chat = Chat.objects.create(user=user)
+
+    def test_large_content_is_stored_compressed_and_read_as_str(self):
+        content = 'مرحبا بالعالم ' * 200
+        message = ChatMessage.objects.create(chat=self.chat, role='assistant', content=content)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT content FROM api_chatmessage WHERE id = %s", [message.id])
+            stored = cursor.fetchone()[0]
+        self.assertTrue(stored.startswith(COMPRESSED_PREFIX))
+        self.assertLess(len(stored), len(content))
+
+        self.assertEqual(ChatMessage.objects.get(pk=message.pk).content, content)
+        for value in (ChatMessage.objects.values_list('content', flat=True).get(pk=message.pk),
+                      ChatMessage.objects.values('content').get(pk=message.pk)['content']):
+            self.assertIs(type(value), str)
+            self.assertEqual(json.loads(json.dumps(value)), content)
+
+    def test_small_content_is_stored_as_is(self):
+        message = ChatMessage.objects.create(chat=self.chat, role='user', content='short')
+        self.assertEqual(ChatMessage.objects.filter(content='short').get().pk, message.pk)
+
+
+@override_settings(GEMINI_API_KEY='test-key', GROQ_API_KEY='test-key')
+class ModelCatalogTests(TestCase):
+    def test_catalog_is_revalidated_with_etag(self):
+        response = self.client.get('/api/models/available/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=60', response['Cache-Control'])
+        self.assertEqual([model['name'] for model in response.json()][:1], ['auto'])
+        self.assertIn('gemini', [model['name'] for model in response.json()])
+
+        response = self.client.get('/api/models/available/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_model_going_down_changes_the_catalog(self):
+        etag = self.client.get('/api/models/available/')['ETag']
+        for _ in range(10):
+            ai_service_manager.record_result('gemini', False, 1.0)
+        self.addCleanup(ai_service_manager._health.pop, 'gemini', None)
+        response = self.client.get('/api/models/available/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        gemini = next(model for model in response.json() if model['name'] == 'gemini')
+        self.assertEqual((gemini['status'], gemini['is_available']), ('down', False))
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='revalidator', email='rv@example.com', password='pw')
+        self.chat = Chat.objects.create(user=self.user, title='Before')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+
+    def test_chat_list_changes_within_a_second_are_seen(self):
+        response = self.client.get('/api/chats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/chats/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Same count, same second: only the precise updated_at in the ETag tells them apart
+        self.chat.title = 'After'
+        self.chat.save()
+        response = self.client.get('/api/chats/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['chats'][0]['title'], 'After')
+
+    def test_if_modified_since_alone_never_answers_304(self):
+        response = self.client.get('/api/chats/', HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_message_changes_the_message_etag(self):
+        url = f'/api/chats/{self.chat.id}/messages/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        ChatMessage.objects.create(chat=self.chat, role='user', content='hello')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class RenderingTests(TestCase):
+    def test_orjson_output_matches_the_stock_renderer(self):
+        data = {
+            'id': uuid.uuid4(), 'at': timezone.now(), 'amount': Decimal('1.50'), 'text': 'مرحبا ',
+            'nested': [{'n': 1, 'none': None}],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_large_api_responses_are_gzipped(self):
+        user = CustomUser.objects.create_user(username='gzipped', email='gzipped@example.com', password='pw')
+        chat = Chat.objects.create(user=user)
+        ChatMessage.objects.create(chat=chat, role='assistant', content='compressible text ' * 500)
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+        url = f'/api/chats/{chat.id}/messages/'
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/'))
+        body = json.loads(gzip.decompress(response.content))
+        self.assertEqual(body, self.client.get(url).json())
+
+        self.assertFalse(self.client.get(url).has_header('Content-Encoding'))
+        self.assertFalse(self.client.get('/api/chats/', HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'))
+
+
+class TombstoneRetentionTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='pruner', email='pruner@example.com', password='pw')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+
+    def test_deleted_chat_is_reported_then_pruned(self):
+        chat = Chat.objects.create(user=self.user)
+        cursor = self.client.get('/api/chats/sync/').json()['cursor']
+        chat_id = str(chat.id)
+        chat.delete()
+        response = self.client.get('/api/chats/sync/', {'cursor': cursor})
+        self.assertEqual(response.json()['deleted'], [chat_id])
+
+        ChatTombstone.objects.update(deleted_at=timezone.now() - timedelta(days=31))
+        call_command('prune_tombstones', stdout=io.StringIO())
+        self.assertFalse(ChatTombstone.objects.exists())
+
+    def test_cursor_older_than_retention_requires_resync(self):
+        stale = sync.encode_cursor(timezone.now() - timedelta(days=31), uuid.UUID(int=0))
+        response = self.client.get('/api/chats/sync/', {'cursor': stale})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.json()['error_code'], 'sync_resync_required')
+
+    def test_quiet_account_keeps_a_fresh_cursor(self):
+        Chat.objects.create(user=self.user)
+        Chat.objects.update(updated_at=timezone.now() - timedelta(days=40))
+        cursor = self.client.get('/api/chats/sync/').json()['cursor']
+        response = self.client.get('/api/chats/sync/', {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['chats'], [])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CancellationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='stopper', email='stopper@example.com', password='pw')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        self.chat = Chat.objects.create(user=self.user, title='Stopped')
+
+    def test_cancel_only_reaches_own_chats(self):
+        other = CustomUser.objects.create_user(username='bystander', email='bystander@example.com', password='pw')
+        foreign = Chat.objects.create(user=other)
+        self.assertEqual(self.client.post(f'/api/chats/{foreign.id}/cancel/').status_code, 404)
+        self.assertFalse(CancelToken(foreign.id).cancelled)
+
+        response = self.client.post(f'/api/chats/{self.chat.id}/cancel/')
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(CancelToken(self.chat.id).cancelled)
+
+    @mock.patch.object(CancelToken, 'POLL_INTERVAL', 0)
+    def test_cancel_stops_the_stream_and_keeps_the_partial_reply(self):
+        closed = []
+
+        def stream_response(model_name, messages, **kwargs):
+            try:
+                yield {'type': 'delta', 'content': 'Partial'}
+                request_cancel(self.chat.id)
+                yield {'type': 'delta', 'content': ' reply'}
+                yield {'type': 'delta', 'content': ' never read'}
+                yield {'type': 'done', 'model_used': model_name, 'tokens_used': 9}
+            finally:
+                closed.append(True)
+
+        with mock.patch.object(ai_service_manager, 'stream_response', side_effect=stream_response):
+            response = self.client.post('/api/prompt/', {'chat_id': str(self.chat.id), 'content': 'Go on'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['reply'], 'Partial reply')
+        self.assertTrue(response.json()['is_truncated'])
+        self.assertEqual(closed, [True])
+        message = self.chat.messages.get(role='assistant')
+        self.assertEqual((message.content, message.is_truncated, message.tokens_used), ('Partial reply', True, 0))
+        # The flag is cleared, so the next turn runs to the end
+        self.assertFalse(CancelToken(self.chat.id).cancelled)
+
+
+def sse_events(response):
+    """(id, event, data) of every event in a server-sent event response"""
+    events = []
+    for block in b''.join(response.streaming_content).decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line)
+        if 'event' in fields:
+            events.append((fields.get('id'), fields['event'], json.loads(fields['data'])))
+    return events
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class GenerationBufferTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='resumer', email='resumer@example.com', password='pw')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        self.chat = Chat.objects.create(user=self.user, title='Resumed')
+
+    def test_generation_buffers_the_reply_and_its_outcome(self):
+        turn = prepare_turn(self.user, self.chat.id, 'Say hello')
+        buffer = generation.GenerationBuffer.create(self.user.pk, self.chat.id)
+        with mock.patch.object(ai_service_manager, 'stream_response', side_effect=fake_stream('Hello ', 'world')):
+            generation._run_generation(buffer, turn, 'gemini')
+
+        text, meta = buffer.read(0)
+        self.assertEqual(text, 'Hello world')
+        self.assertEqual(meta['status'], 'done')
+        self.assertEqual(meta['final']['message']['content'], 'Hello world')
+        self.assertEqual(buffer.read(3)[0], 'lo world')
+
+    def test_resume_sends_only_the_missed_text(self):
+        buffer = generation.GenerationBuffer.create(self.user.pk, self.chat.id)
+        buffer.append('Hello ')
+        buffer.flush()
+        buffer.append('world')
+        buffer.finish('done', title='Resumed')
+
+        response = self.client.get(f'/api/generations/{buffer.generation_id}/', HTTP_LAST_EVENT_ID='6')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sse_events(response), [
+            ('11', 'delta', {'content': 'world'}),
+            ('11', 'done', {'title': 'Resumed'}),
+        ])
+
+    def test_other_users_and_expired_buffers_are_not_found(self):
+        other = CustomUser.objects.create_user(username='eavesdropper', email='eaves@example.com', password='pw')
+        buffer = generation.GenerationBuffer.create(other.pk, Chat.objects.create(user=other).id)
+        response = self.client.get(f'/api/generations/{buffer.generation_id}/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['error_code'], 'generation_not_found')
+        self.assertEqual(self.client.get(f'/api/generations/{uuid.uuid4().hex}/').status_code, 404)
+
+    def test_generation_without_a_reader_is_cancelled(self):
+        buffer = generation.GenerationBuffer.create(self.user.pk, self.chat.id)
+        cache.set(generation.READER_KEY.format(buffer.generation_id), timezone.now().timestamp() - 60)
+        buffer.append('Nobody is listening')
+        self.assertTrue(CancelToken(self.chat.id).cancelled)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   CHAT_TITLE_STRATEGY='local')
+class ChatTurnTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='turner', email='turner@example.com', password='pw')
+        self.chat_id = uuid.uuid4()
+
+    def test_reply_is_saved_with_the_chat_title(self):
+        turn = prepare_turn(self.user, self.chat_id, 'How do I bake sourdough bread at home?')
+        self.assertTrue(turn.needs_title)
+        with mock.patch.object(ai_service_manager, 'stream_response',
+                               side_effect=fake_stream('Start ', 'with a starter.', tokens_used=12)):
+            reply = generate_reply(turn, 'gemini')
+            message = complete_turn(turn, reply)
+
+        chat = Chat.objects.get(id=self.chat_id)
+        self.assertTrue(chat.title)
+        self.assertTrue(turn.title_changed)
+        self.assertEqual(list(chat.messages.values_list('role', flat=True)), ['user', 'assistant'])
+        self.assertEqual((message.content, message.model_used, message.tokens_used, message.is_truncated),
+                         ('Start with a starter.', 'gemini', 12, False))
+
+    def test_provider_error_saves_no_assistant_message(self):
+        def failing(model_name, messages, **kwargs):
+            yield {'type': 'error', 'error': 'Rate limited', 'status_code': 429, 'retry_after': 3}
+
+        turn = prepare_turn(self.user, self.chat_id, 'Hello there')
+        with mock.patch.object(ai_service_manager, 'stream_response', side_effect=failing):
+            reply = generate_reply(turn, 'gemini')
+        self.assertEqual((reply['error'], reply['status_code'], reply['retry_after']), ('Rate limited', 429, 3))
+
+        with mock.patch.object(ai_service_manager, 'generate_response') as title_call:
+            self.assertIsNone(complete_turn(turn, reply))
+        title_call.assert_not_called()
+        chat = Chat.objects.get(id=self.chat_id)
+        self.assertEqual(chat.title, 'Hello there')
+        self.assertEqual(list(chat.messages.values_list('role', flat=True)), ['user'])
+
+    def test_cancel_before_the_provider_call(self):
+        turn = prepare_turn(self.user, self.chat_id, 'Never mind')
+        request_cancel(self.chat_id)
+        with mock.patch.object(ai_service_manager, 'stream_response') as stream_response:
+            reply = generate_reply(turn, 'gemini')
+        stream_response.assert_not_called()
+        self.assertEqual((reply['content'], reply['is_truncated']), ('', True))
+        self.assertIsNone(complete_turn(turn, reply))
+        self.assertFalse(ChatMessage.objects.filter(role='assistant').exists())
+        self.assertFalse(CancelToken(self.chat_id).cancelled)
+
+    def test_stale_cancel_does_not_stop_the_next_turn(self):
+        request_cancel(self.chat_id)
+        turn = prepare_turn(self.user, self.chat_id, 'Start over')
+        with mock.patch.object(ai_service_manager, 'stream_response', side_effect=fake_stream('Done.')):
+            self.assertEqual(generate_reply(turn, 'gemini')['content'], 'Done.')
+
+    @override_settings(CHAT_TITLE_STRATEGY='llm')
+    def test_title_comes_from_the_model_unless_local_titles_are_enabled(self):
+        with mock.patch.object(ai_service_manager, 'generate_response',
+                               return_value={'content': ' Sourdough at home '}) as title_call:
+            self.assertEqual(create_chat_title('How do I bake sourdough bread at home?'), 'Sourdough at home')
+        title_call.assert_called_once()
+
+        with override_settings(CHAT_TITLE_STRATEGY='local'), \
+                mock.patch.object(ai_service_manager, 'generate_response') as title_call:
+            self.assertTrue(create_chat_title('How do I bake sourdough bread at home?'))
+        title_call.assert_not_called()
+
+    def test_other_users_chat_is_refused(self):
+        Chat.objects.create(id=self.chat_id, user=CustomUser.objects.create_user(
+            username='owner', email='owner@example.com', password='pw'))
+        with self.assertRaises(TurnError) as raised:
+            prepare_turn(self.user, self.chat_id, 'Let me in')
+        self.assertEqual(raised.exception.status, 403)
+        self.assertFalse(ChatMessage.objects.exists())
+
+
+@override_settings(GEMINI_API_KEY='test-key', GROQ_API_KEY='test-key', OPENAI_API_KEY=None, ANTHROPIC_API_KEY=None)
+class RoutingTests(TestCase):
+    def setUp(self):
+        self.addCleanup(ai_service_manager._health.clear)
+
+    def route(self, prompt):
+        return ai_service_manager.resolve_model('auto', [{'role': 'user', 'content': prompt}])
+
+    def test_prompts_need_the_tier_they_look_like(self):
+        def tier(prompt):
+            return routing.required_tier(routing.extract_features([{'role': 'user', 'content': prompt}]))
+
+        self.assertEqual(tier('Hi, how are you?'), 1)
+        self.assertEqual(tier('Explain why the sky is blue.'), 2)
+        self.assertEqual(tier('def add(a, b):\n    return a + b'), 3)
+        self.assertEqual(tier('word ' * 500), 3)
+
+    def test_auto_picks_a_model_by_the_conversation(self):
+        self.assertEqual(self.route('Hi, how are you?'), 'groq')
+        self.assertEqual(self.route('```python\nprint(1)\n```\nWhat is wrong here?'), 'gemini')
+        # Only gemini is multilingual
+        self.assertEqual(self.route('مرحبا، كيف حالك؟'), 'gemini')
+
+    def test_models_that_are_down_are_avoided(self):
+        for _ in range(10):
+            ai_service_manager.record_result('gemini', False, 1.0)
+        self.assertEqual(self.route('```python\nprint(1)\n```\nWhat is wrong here?'), 'groq')
+        for _ in range(10):
+            ai_service_manager.record_result('groq', False, 1.0)
+        # With everything down, routing still answers rather than failing
+        self.assertIn(self.route('Hi'), ('gemini', 'groq'))
+
+    def test_named_models_are_not_routed(self):
+        self.assertEqual(ai_service_manager.resolve_model('groq', [{'role': 'user', 'content': 'x' * 5000}]), 'groq')
+
+    @override_settings(GEMINI_API_KEY=None, GROQ_API_KEY=None)
+    def test_auto_without_providers_is_unsupported(self):
+        with self.assertRaises(ValueError):
+            self.route('Hi')
+
+
+class DocumentRetrievalTests(TestCase):
+    def setUp(self):
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir, ignore_errors=True)
+        settings_override = override_settings(RAG_INDEX_DIR=index_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = CustomUser.objects.create_user(username='reader', email='reader@example.com', password='pw')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+
+    def upload(self, name, content):
+        return self.client.post('/api/documents/', {'name': name, 'content': content}, content_type='application/json')
+
+    def test_vectors_match_shared_keywords_not_meaning(self):
+        vector = lexical_vectors.vectorize('The invoice is due on Friday')
+        self.assertAlmostEqual(float(vector @ lexical_vectors.vectorize('the invoice is due on friday!')), 1.0, places=5)
+        self.assertAlmostEqual(float(vector @ lexical_vectors.vectorize('Payment deadline: end of week')), 0.0, places=5)
+        self.assertFalse(lexical_vectors.vectorize('the of and').any())
+
+    def test_uploaded_document_is_retrieved_by_its_keywords(self):
+        response = self.upload('Garden notes', 'Tomatoes need full sun and deep watering twice a week.')
+        self.assertEqual(response.status_code, 201)
+        self.upload('Car notes', 'The engine oil should be changed every ten thousand kilometres.')
+
+        results = documents.retrieve(self.user.pk, 'How often should I change the engine oil?')
+        self.assertEqual([chunk.document.name for chunk, _score in results], ['Car notes'])
+        context = documents.document_context(self.user.pk, 'watering tomatoes')
+        self.assertIn('Tomatoes need full sun', context)
+        self.assertIsNone(documents.document_context(self.user.pk, 'quarterly revenue forecast'))
+
+    def test_documents_stay_private_and_deleted_ones_are_not_retrieved(self):
+        document_id = self.upload('Secret', 'The vault combination is hidden under the blue lamp.').json()['id']
+        other = CustomUser.objects.create_user(username='snoop', email='snoop@example.com', password='pw')
+        self.assertEqual(documents.retrieve(other.pk, 'vault combination blue lamp'), [])
+
+        self.assertEqual(self.client.delete(f'/api/documents/{document_id}/').status_code, 204)
+        self.assertEqual(documents.retrieve(self.user.pk, 'vault combination blue lamp'), [])
+        self.assertEqual(self.client.get('/api/documents/').json(), [])
+
+    def test_empty_documents_are_refused(self):
+        response = self.upload('Blank', '   ')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error_code'], 'document_required')
+
+
+class MemoryRecallTests(TestCase):
+    def setUp(self):
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir, ignore_errors=True)
+        settings_override = override_settings(MEMORY_INDEX_DIR=index_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = CustomUser.objects.create_user(username='rememberer', email='rem@example.com', password='pw')
+        self.earlier = Chat.objects.create(user=self.user, title='Trip planning')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fact = ChatMessage.objects.create(
+                chat=self.earlier, role='user', content='My daughter Lina is allergic to peanuts and sesame.',
+            )
+            ChatMessage.objects.create(chat=self.earlier, role='user', content='We fly to Lisbon in early June.')
+
+    def test_messages_are_recalled_in_other_chats_only(self):
+        current = Chat.objects.create(user=self.user, title='Recipes')
+        recalled = memory.recall(self.user.pk, current.id, 'Suggest a snack for Lina without peanuts')
+        self.assertEqual([message.id for message, _score in recalled], [self.fact.id])
+        self.assertEqual(memory.recall(self.user.pk, self.earlier.id, 'Suggest a snack for Lina without peanuts'), [])
+
+    def test_other_users_memories_are_not_recalled(self):
+        other = CustomUser.objects.create_user(username='stranger', email='stranger@example.com', password='pw')
+        chat = Chat.objects.create(user=other)
+        self.assertEqual(memory.recall(other.pk, chat.id, 'Lina allergic peanuts sesame'), [])
+
+    def test_snippets_reach_the_provider_but_not_the_stored_message(self):
+        turn = prepare_turn(self.user, uuid.uuid4(), 'Which sweets are safe for Lina with her peanuts allergy?')
+        content = provider_messages(turn)[-1]['content']
+        self.assertIn('allergic to peanuts', content)
+        self.assertTrue(content.endswith('Question: Which sweets are safe for Lina with her peanuts allergy?'))
+        self.assertEqual(turn.history[-1]['content'], 'Which sweets are safe for Lina with her peanuts allergy?')
+        self.assertEqual(turn.user_message.content, 'Which sweets are safe for Lina with her peanuts allergy?')
+
+    def test_deleted_messages_are_skipped_and_dropped_on_rebuild(self):
+        self.fact.delete()
+        current = Chat.objects.create(user=self.user)
+        self.assertEqual(memory.recall(self.user.pk, current.id, 'Lina allergic peanuts sesame'), [])
+        self.assertEqual(len(memory.MemoryIndex.for_user(self.user.pk)), 2)
+
+        call_command('build_memory_index', user=self.user.pk, stdout=io.StringIO())
+        self.assertEqual(len(memory.MemoryIndex.for_user(self.user.pk)), 1)
+        recalled = memory.recall(self.user.pk, current.id, 'When do we fly to Lisbon?')
+        self.assertEqual([message.content for message, _score in recalled], ['We fly to Lisbon in early June.'])
+
+
+OVERLOADED = {'content': '', 'tokens_used': 0, 'error': 'Overloaded', 'status_code': 503, 'retry_after': 5}
+REPLY = {'content': 'Hello', 'tokens_used': 3, 'model_used': 'gemini'}
+
+
+@override_settings(PROVIDER_QUEUE_DEADLINES={'interactive': 1, 'title': 1, 'batch': 1}, PROVIDER_RETRY_MAX_DELAY=10)
+class RetryDeadlineTests(TestCase):
+    def setUp(self):
+        # Fresh schedulers, so the Retry-After pauses below don't hold up other tests
+        patcher = mock.patch.object(ai_service_manager, '_schedulers', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(ai_service_manager._health.clear)
+        sleep = mock.patch('api.services.ai_service.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def use(self, provider):
+        patcher = mock.patch.object(ai_service_manager, 'get_provider', return_value=provider)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return provider
+
+    def test_backoff_past_the_deadline_answers_429_without_sleeping(self):
+        provider = self.use(ScriptedProvider(OVERLOADED))
+        response = ai_service_manager.generate_response('gemini', [{'role': 'user', 'content': 'Hi'}])
+        self.assertEqual((response['status_code'], response['retry_after']), (429, 5))
+        self.assertEqual(provider.calls, 1)
+        self.sleep.assert_not_called()
+
+    def test_backoff_within_the_deadline_is_retried(self):
+        provider = self.use(ScriptedProvider({**OVERLOADED, 'retry_after': 0.01}, REPLY))
+        response = ai_service_manager.generate_response('gemini', [{'role': 'user', 'content': 'Hi'}])
+        self.assertEqual(response['content'], 'Hello')
+        self.assertEqual(provider.calls, 2)
+        self.sleep.assert_called_once()
+
+    def test_stream_past_the_deadline_reaches_the_client_as_retry_after(self):
+        provider = self.use(ScriptedProvider(OVERLOADED))
+        user = CustomUser.objects.create_user(username='impatient', email='impatient@example.com', password='pw')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+        response = self.client.post('/api/prompt/', {'chat_id': str(uuid.uuid4()), 'content': 'Hi'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertEqual(provider.calls, 1)
+        self.sleep.assert_not_called()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class FairSchedulerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.scheduler = ProviderScheduler(AdaptiveLimiter(initial=1, maximum=1))
+        self.assertTrue(self.scheduler.acquire('holder'))
+        self.served = []
+        self.threads = []
+
+    def queue(self, name, user, priority=Priority.INTERACTIVE):
+        """Queue a request that notes its name and frees its slot once served"""
+        def run():
+            if self.scheduler.acquire(user, priority):
+                self.served.append(name)
+                self.scheduler.release(None)
+
+        waiting = self.scheduler.stats()['waiting']
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+        while self.scheduler.stats()['waiting'] == waiting:
+            thread.join(0.001)
+
+    def finish(self):
+        self.scheduler.release(None)
+        for thread in self.threads:
+            thread.join(5)
+
+    def test_slots_go_by_priority_then_in_turn_across_users(self):
+        self.queue('title', 'carol', Priority.TITLE)
+        for number in range(3):
+            self.queue(f'alice-{number}', 'alice')
+        self.queue('bob-0', 'bob')
+        self.finish()
+        self.assertEqual(self.served, ['alice-0', 'bob-0', 'alice-1', 'alice-2', 'title'])
+        classes = self.scheduler.stats()['classes']
+        self.assertEqual((classes['interactive']['queued'], classes['title']['queued']), (4, 1))
+
+    def test_request_gives_up_at_its_deadline(self):
+        self.assertFalse(self.scheduler.acquire('late', deadline=time.monotonic() + 0.05))
+        self.queue('after', 'patient')
+        self.finish()
+        self.assertEqual(self.served, ['after'])
+        stats = self.scheduler.stats()
+        self.assertEqual((stats['in_flight'], stats['waiting']), (0, 0))
+        self.assertEqual(stats['classes']['interactive']['timed_out'], 1)
+
+    def test_queue_statistics_are_for_staff_only(self):
+        user = CustomUser.objects.create_user(username='curious', email='curious@example.com', password='pw')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+        self.assertEqual(self.client.get('/api/models/queues/').status_code, 403)
+        CustomUser.objects.filter(pk=user.pk).update(is_staff=True)
+        user_cache.invalidate(user.pk)
+        self.assertEqual(self.client.get('/api/models/queues/').status_code, 200)
+
+
+@override_settings(BACKPRESSURE_MAX_IN_FLIGHT=1, BACKPRESSURE_MAX_QUEUE=1, BACKPRESSURE_QUEUE_TIMEOUT=5)
+class BackpressureTests(TestCase):
+    def setUp(self):
+        self.prompt = RequestFactory().post('/api/prompt/')
+
+    def streaming_view(self, request):
+        return StreamingHttpResponse(iter(['partial ', 'reply']))
+
+    def test_streamed_reply_holds_its_slot_until_closed(self):
+        middleware = BackpressureMiddleware(self.streaming_view)
+        stream = middleware(self.prompt)
+        self.assertEqual(middleware.in_flight, 1)
+        # Closed without being read, as when the client goes away at once
+        stream.close()
+        stream.close()
+        self.assertEqual(middleware.in_flight, 0)
+        self.assertEqual(middleware(RequestFactory().get('/api/prompt/')).status_code, 200)
+        self.assertEqual(middleware.in_flight, 0)
+
+    @override_settings(BACKPRESSURE_MAX_QUEUE=0)
+    def test_requests_beyond_the_queue_are_shed(self):
+        middleware = BackpressureMiddleware(self.streaming_view)
+        stream = middleware(self.prompt)
+        shed = middleware(self.prompt)
+        self.assertEqual(shed.status_code, 503)
+        self.assertEqual(json.loads(shed.content)['error_code'], 'server_overloaded')
+        self.assertGreaterEqual(int(shed['Retry-After']), 1)
+        # Other endpoints are not limited
+        self.assertEqual(middleware(RequestFactory().post('/api/chats/create/')).status_code, 200)
+        stream.close()
+        self.assertEqual(middleware(self.prompt).status_code, 200)
+
+    def test_queued_request_is_served_when_a_slot_frees(self):
+        middleware = BackpressureMiddleware(self.streaming_view)
+        stream = middleware(self.prompt)
+        responses = []
+        waiter = threading.Thread(target=lambda: responses.append(middleware(self.prompt)))
+        waiter.start()
+        while not middleware.waiting:
+            waiter.join(0.001)
+        stream.close()
+        waiter.join(5)
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(middleware.in_flight, 1)
+        responses[0].close()
+        self.assertEqual(middleware.in_flight, 0)
+
+    async def test_asgi_requests_queue_without_blocking_the_loop(self):
+        gate = threading.Event()
+
+        async def view(request):
+            await asyncio.get_running_loop().run_in_executor(None, gate.wait, 5)
+            return HttpResponse('done')
+
+        middleware = BackpressureMiddleware(view)
+        first = asyncio.ensure_future(middleware(self.prompt))
+        while not middleware.in_flight:
+            await asyncio.sleep(0.001)
+        second = asyncio.ensure_future(middleware(self.prompt))
+        while not middleware.waiting:
+            # The loop keeps running while the second request waits
+            await asyncio.sleep(0.001)
+        gate.set()
+        self.assertEqual((await first).status_code, 200)
+        self.assertEqual((await second).status_code, 200)
+        self.assertEqual(middleware.in_flight, 0)
+
+
+class SQLiteCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.location = f'{directory}/cache.sqlite3'
+        self.cache = self.worker()
+
+    def worker(self, **options):
+        """A cache on the shared file, as another process would open it"""
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def test_values_expire_and_are_shared_between_workers(self):
+        self.cache.set_many({'number': 7, 'text': 'مرحبا', 'data': {'ids': [1, 2]}, 'big': 2 ** 70})
+        self.assertEqual(self.worker().get_many(['number', 'text', 'data', 'big', 'missing']),
+                         {'number': 7, 'text': 'مرحبا', 'data': {'ids': [1, 2]}, 'big': 2 ** 70})
+        self.cache.set('gone', 1, timeout=0)
+        self.assertIsNone(self.cache.get('gone'))
+        self.assertFalse(self.cache.touch('gone'))
+
+    def test_add_only_fills_missing_or_expired_keys(self):
+        self.assertTrue(self.cache.add('lock', 'first'))
+        self.assertFalse(self.worker().add('lock', 'second'))
+        self.cache.set('lock', 'stale', timeout=0)
+        self.assertTrue(self.cache.add('lock', 'third'))
+        self.assertEqual(self.cache.get('lock'), 'third')
+
+    def test_increments_from_several_workers_are_not_lost(self):
+        def count(worker):
+            for _ in range(100):
+                increment('hits', cache=worker)
+
+        threads = [threading.Thread(target=count, args=(self.worker(),)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('hits'), 400)
+        self.assertEqual(self.cache.incr('hits', 10), 410)
+        with self.assertRaises(ValueError):
+            self.cache.incr('never-set')
+
+    def test_counter_window_restarts_once_expired(self):
+        self.assertEqual(self.cache.count('window', timeout=0), 1)
+        self.assertEqual(self.cache.count('window', timeout=60), 1)
+        self.assertEqual(self.cache.count('window', 2, timeout=60), 3)
+        self.cache.set('window', 'not a number')
+        self.assertEqual(self.cache.count('window'), 1)
+
+    def test_least_recently_read_entries_are_culled(self):
+        small = self.worker(MAX_ENTRIES=10, CULL_FREQUENCY=2)
+        for number in range(30):
+            small.set(f'key-{number}', number)
+        remaining = small.get_many([f'key-{number}' for number in range(30)])
+        self.assertLessEqual(len(remaining), 11)
+        self.assertIn('key-29', remaining)
+
+    def test_increment_falls_back_to_add_and_incr(self):
+        other = LocMemCache('increment-test', {})
+        self.assertEqual(increment('hits', cache=other), 1)
+        self.assertEqual(increment('hits', 4, cache=other), 5)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class UsageRollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='spender', email='spender@example.com', password='pw')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        self.chat = Chat.objects.create(user=self.user, title='Costs')
+        self.today = timezone.localdate()
+
+    def reply(self, model, tokens, chat=None):
+        return ChatMessage.objects.create(chat=chat or self.chat, role='assistant', content='Answer',
+                                          model_used=model, tokens_used=tokens)
+
+    def rollups(self):
+        return list(UsageRollup.objects.filter(user=self.user).values_list('model', 'messages', 'tokens'))
+
+    def test_replies_are_rolled_up_as_they_are_saved(self):
+        ChatMessage.objects.create(chat=self.chat, role='user', content='Question')
+        self.reply('gemini', 10)
+        self.reply('gemini', 5)
+        self.reply('groq', 7)
+        self.assertEqual(self.rollups(), [('gemini', 2, 15), ('groq', 1, 7)])
+
+    def test_usage_endpoint_reports_totals_and_groups(self):
+        self.reply('gemini', 10)
+        self.reply('groq', 7)
+        response = self.client.get('/api/usage/', {'group_by': 'model'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['totals'], {'messages': 2, 'tokens': 17})
+        self.assertEqual(response.json()['usage'], [
+            {'model': 'gemini', 'messages': 1, 'tokens': 10},
+            {'model': 'groq', 'messages': 1, 'tokens': 7},
+        ])
+        yesterday = self.today - timedelta(days=1)
+        response = self.client.get('/api/usage/', {'start': yesterday, 'end': yesterday})
+        self.assertEqual(response.json()['totals'], {'messages': 0, 'tokens': 0})
+
+    def test_invalid_requests_are_refused(self):
+        self.assertEqual(self.client.get('/api/usage/', {'group_by': 'chat'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/usage/', {'start': self.today, 'end': self.today - timedelta(days=1)})
+                         .status_code, 400)
+        self.assertEqual(self.client.get('/api/usage/', {'start': 'yesterday'}).status_code, 400)
+        response = self.client.get('/api/usage/', {'user': 'all'})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['error_code'], 'usage_access_denied')
+
+    def test_staff_see_everyones_usage(self):
+        other = CustomUser.objects.create_user(username='other-spender', email='os@example.com', password='pw')
+        self.reply('gemini', 10)
+        self.reply('gemini', 4, chat=Chat.objects.create(user=other))
+        CustomUser.objects.filter(pk=self.user.pk).update(is_staff=True)
+        user_cache.invalidate(self.user.pk)
+        response = self.client.get('/api/usage/', {'user': 'all', 'group_by': 'user'})
+        self.assertEqual(response.json()['usage'], [
+            {'user_id': self.user.pk, 'messages': 1, 'tokens': 10},
+            {'user_id': other.pk, 'messages': 1, 'tokens': 4},
+        ])
+
+    def test_rebuild_counts_hot_and_archived_replies(self):
+        old_chat = Chat.objects.create(user=self.user, title='Old')
+        self.reply('gemini', 10, chat=old_chat)
+        self.reply('gemini', 3)
+        archive.archive_chat(old_chat, timezone.now() + timedelta(seconds=1))
+        UsageRollup.objects.all().delete()
+
+        out = io.StringIO()
+        call_command('build_usage_rollups', user=self.user.pk, stdout=out)
+        self.assertIn('Rebuilt 1 rollups', out.getvalue())
+        self.assertEqual(self.rollups(), [('gemini', 2, 13)])
+        self.assertEqual(usage.summarize(self.user.pk, self.today, self.today, ())['totals'],
+                         {'messages': 2, 'tokens': 13})
@@ -0,0 +1,158 @@
+"""
+Bloom filter over blacklisted refresh token JTIs
+
+Rotation with BLACKLIST_AFTER_ROTATION checks the token_blacklist tables on
+every refresh. The filter answers "definitely not blacklisted" from memory;
+only probable hits fall through to the database query.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.cache import increment
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over a blake2b digest"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class BlacklistFilter:
+    """
+    Process-wide Bloom filter of blacklisted JTIs, kept in sync with the database
+
+    Blacklisting in this process adds to the filter directly and, once the
+    row has committed, bumps a generation counter in the shared cache; other
+    processes see the new generation and pull the rows blacklisted since
+    their last sync. Filters are rebuilt from scratch periodically and when
+    they outgrow their capacity.
+    """
+    GENERATION_KEY = 'api:jwt-blacklist-generation'
+
+    def __init__(self, capacity: int, error_rate: float, max_staleness: float, rebuild_interval: float,
+                 sync_margin: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.max_staleness = max_staleness
+        self.rebuild_interval = rebuild_interval
+        # blacklisted_at is stamped before the row commits, so each sync re-reads
+        # rows from this far before the previous one started
+        self.sync_margin = timedelta(seconds=sync_margin)
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._since = None
+        self._generation = None
+        self._synced_at = 0.0
+        self._built_at = 0.0
+
+    def might_contain(self, jti: str) -> bool:
+        """False means the token is certainly not blacklisted"""
+        self._sync()
+        return jti in self._bloom
+
+    def add(self, jti: str) -> None:
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+        # Bumped earlier, another process could sync before the row is visible
+        # to it and then skip the database until the generation changes again
+        transaction.on_commit(lambda: increment(self.GENERATION_KEY, timeout=None))
+
+    def rebuild(self) -> None:
+        """Load every unexpired blacklisted JTI into a fresh filter"""
+        # Read before the rows, so a bump during the load triggers another sync
+        generation = cache.get(self.GENERATION_KEY)
+        since = timezone.now()
+        rows = BlacklistedToken.objects.filter(token__expires_at__gt=since)
+        bloom = BloomFilter(max(self.capacity, 2 * rows.count()), self.error_rate)
+        for jti in rows.values_list('token__jti', flat=True).iterator(chunk_size=2000):
+            bloom.add(jti)
+        now = time.monotonic()
+        with self._lock:
+            self._bloom, self._since, self._generation = bloom, since, generation
+            self._synced_at = self._built_at = now
+        logger.info(f"Built blacklist filter with {bloom.count} tokens ({len(bloom.bits)} bytes)")
+
+    def warm_up(self) -> threading.Thread:
+        """Build the filter in a background thread, so the first refresh does not pay for it"""
+        def build():
+            try:
+                self.rebuild()
+            except Exception as e:
+                logger.warning(f"Could not build the blacklist filter at startup: {e}")
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=build, name='blacklist-filter-warm-up', daemon=True)
+        thread.start()
+        return thread
+
+    def _sync(self) -> None:
+        now = time.monotonic()
+        if (self._bloom is None or now - self._built_at > self.rebuild_interval
+                or self._bloom.count > self._bloom.capacity):
+            self.rebuild()
+            return
+        generation = cache.get(self.GENERATION_KEY)
+        if generation == self._generation and now - self._synced_at < self.max_staleness:
+            return
+        since = timezone.now()
+        rows = BlacklistedToken.objects.filter(blacklisted_at__gte=self._since - self.sync_margin)
+        with self._lock:
+            for jti in rows.values_list('token__jti', flat=True):
+                # Rows inside the margin are read again on every sync; count them once
+                if jti not in self._bloom:
+                    self._bloom.add(jti)
+            self._since, self._generation = since, generation
+            self._synced_at = now
+
+
+blacklist_filter = BlacklistFilter(
+    capacity=getattr(settings, 'JWT_BLACKLIST_FILTER_CAPACITY', 100_000),
+    error_rate=getattr(settings, 'JWT_BLACKLIST_FILTER_ERROR_RATE', 0.001),
+    max_staleness=getattr(settings, 'JWT_BLACKLIST_FILTER_MAX_STALENESS', 5),
+    rebuild_interval=getattr(settings, 'JWT_BLACKLIST_FILTER_REBUILD_INTERVAL', 600),
+    sync_margin=getattr(settings, 'JWT_BLACKLIST_FILTER_SYNC_MARGIN', 60),
+)
+
+
+class FilteredRefreshToken(RefreshToken):
+    """RefreshToken that consults the blacklist filter before the database"""
+
+    def check_blacklist(self):
+        if not blacklist_filter.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            return
+        super().check_blacklist()
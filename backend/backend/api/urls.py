@@ -12,13 +12,28 @@ urlpatterns = [
     
     # AI Model endpoints
     path('models/available/', views.available_models, name='available_models'),
+    path('models/queues/', views.provider_queues, name='provider_queues'),
     
     # Chat endpoints
     path('prompt/', views.prompt_gpt, name='prompt_gpt'),
+    path('generations/<str:generation_id>/', views.resume_generation, name='resume_generation'),
     path('chats/', views.user_chats, name='user_chats'),
     path('chats/create/', views.create_chat, name='create_chat'),
     # Chat history - must come before the generic <str:pk> pattern
     path('chats/history/', views.chat_history, name='chat_history'),
+    path('chats/search/', views.search_messages, name='search_messages'),
+    path('chats/export/', views.export_chats, name='export_chats'),
+    path('chats/import/', views.import_chats, name='import_chats'),
+    path('chats/sync/', views.sync_chats, name='sync_chats'),
     path('chats/<str:pk>/', views.delete_chat, name='delete_chat'),
     path('chats/<str:pk>/messages/', views.get_chat_messages, name='get_chat_messages'),
+    path('chats/<str:pk>/messages/sync/', views.sync_chat_messages, name='sync_chat_messages'),
+    path('chats/<str:pk>/cancel/', views.cancel_generation, name='cancel_generation'),
+
+    # Documents used as context for replies
+    path('documents/', views.user_documents, name='user_documents'),
+    path('documents/<int:pk>/', views.delete_document, name='delete_document'),
+
+    # Token usage per day and model
+    path('usage/', views.user_usage, name='user_usage'),
 ]
\ No newline at end of file
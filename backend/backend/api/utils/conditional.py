@@ -0,0 +1,69 @@
+"""
+Conditional GET support for DRF function views
+"""
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils import timezone
+
+from api.models import Chat
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag over the given validator values"""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+def conditional(validators):
+    """
+    Answer GETs with 304 Not Modified when the client's copy is current
+
+    Place below the DRF decorators so it runs after authentication.
+    ``validators(request, *args, **kwargs)`` must return an ETag (or None)
+    computed without loading the rows the view would serialize. No
+    Last-Modified is sent: its one-second precision would let two writes in
+    the same second answer If-Modified-Since with a stale 304.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag = validators(request, *args, **kwargs)
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                if etag:
+                    response['ETag'] = etag
+                # Private data: allow caching but always revalidate
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def chat_list_validators(request, *args, **kwargs):
+    """Newest update and chat count of the user's chats, plus the query string for pagination"""
+    state = Chat.objects.filter(user=request.user).aggregate(last_updated=Max('updated_at'), total=Count('id'))
+    # The date expires tags daily, as chat_history's 30-day window moves
+    etag = make_etag(
+        request.path, request.user.pk, state['last_updated'], state['total'],
+        request.GET.urlencode(), timezone.now().date(),
+    )
+    return etag
+
+
+def chat_messages_validators(request, pk, *args, **kwargs):
+    """Chat update time and message count; None lets the view return its 404"""
+    state = (
+        Chat.objects.filter(id=pk, user=request.user)
+        .annotate(message_count=Count('messages'))
+        .values_list('updated_at', 'message_count', 'archived_at')
+        .first()
+    )
+    if state is None:
+        return None
+    updated_at, message_count, archived_at = state
+    return make_etag(pk, updated_at, message_count, archived_at)
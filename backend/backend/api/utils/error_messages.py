@@ -22,6 +22,19 @@ class ErrorMessages:
             'user_already_exists': 'A user with this email already exists.',
             'validation_error': 'Please check your input and try again.',
             'server_error': 'An unexpected server error occurred. Please try again later.',
+            'search_query_required': 'Please enter something to search for.',
+            'search_unavailable': 'Message search is not available on this server.',
+            'invalid_sync_cursor': 'The sync position is invalid. Please reload the conversation.',
+            'generation_not_found': 'This reply is no longer available. Please reload the conversation.',
+            'document_required': 'Please attach a document or paste its text.',
+            'document_empty': 'The document has no text to search.',
+            'document_too_large': 'The document is too large to upload.',
+            'unsupported_document': 'Only UTF-8 text documents (such as .txt, .md or .csv) can be uploaded.',
+            'documents_unavailable': 'Document search is not available on this server.',
+            'server_overloaded': 'The server is busy right now. Please try again in a few seconds.',
+            'usage_access_denied': 'You can only view your own usage.',
+            'invalid_import_line': 'The import stopped at an invalid line. Everything before it was imported.',
+            'sync_resync_required': 'Your saved conversations are too old to update. Please reload all conversations.',
         },
         'ar': {
             'chat_id_required': 'معرف المحادثة مطلوب.',
@@ -38,6 +51,19 @@ class ErrorMessages:
             'user_already_exists': 'يوجد مستخدم بهذا البريد الإلكتروني بالفعل.',
             'validation_error': 'يرجى التحقق من المدخلات والمحاولة مرة أخرى.',
             'server_error': 'حدث خطأ غير متوقع في الخادم. يرجى المحاولة لاحقاً.',
+            'search_query_required': 'يرجى إدخال نص للبحث عنه.',
+            'search_unavailable': 'البحث في الرسائل غير متاح على هذا الخادم.',
+            'invalid_sync_cursor': 'موضع المزامنة غير صالح. يرجى إعادة تحميل المحادثة.',
+            'generation_not_found': 'هذا الرد لم يعد متاحاً. يرجى إعادة تحميل المحادثة.',
+            'document_required': 'يرجى إرفاق مستند أو لصق نصه.',
+            'document_empty': 'لا يحتوي المستند على نص يمكن البحث فيه.',
+            'document_too_large': 'المستند كبير جداً بحيث لا يمكن رفعه.',
+            'unsupported_document': 'يمكن رفع المستندات النصية بترميز UTF-8 فقط (مثل .txt أو .md أو .csv).',
+            'documents_unavailable': 'البحث في المستندات غير متاح على هذا الخادم.',
+            'server_overloaded': 'الخادم مشغول حالياً. يرجى المحاولة مرة أخرى بعد بضع ثوانٍ.',
+            'usage_access_denied': 'يمكنك عرض استخدامك فقط.',
+            'invalid_import_line': 'توقف الاستيراد عند سطر غير صالح. تم استيراد كل ما قبله.',
+            'sync_resync_required': 'المحادثات المحفوظة قديمة جداً بحيث لا يمكن تحديثها. يرجى إعادة تحميل جميع المحادثات.',
         }
     }
     
@@ -1,29 +1,42 @@
-import google.generativeai as genai
 #import google.generativeai as genai
+import math
 import os
 
+from django.http import StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes, authentication_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.decorators import api_view, permission_classes, authentication_classes, renderer_classes
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
+from api.renderers import EventStreamRenderer, ORJSONRenderer
+from api.authentication import CachedJWTAuthentication
+from api.token_blacklist import FilteredRefreshToken
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
-from api.models import Chat, ChatMessage, CustomUser, UserProfile
+from api.models import Chat, ChatMessage, CustomUser, Document, UserProfile
 from api.serializers import (
     ChatMessageSerializer, ChatSerializer, UserRegistrationSerializer, 
-    UserLoginSerializer, UserSerializer, UserProfileSerializer, AIModelSerializer
+    UserLoginSerializer, UserSerializer, UserProfileSerializer, AIModelSerializer,
+    DocumentSerializer
 )
 from api.services.ai_service import ai_service_manager
+from api.services import documents, search, sync, usage
+from api.services.chat_transfer import ChatImporter, ChatImportError, export_user_chats
+from api.services.archive import rehydrate_chat
+from api.services.cancellation import request_cancel
+from api.services.chat_turn import TurnError, complete_turn, generate_reply, prepare_turn
+from api.services.generation import GenerationBuffer, parse_offset, start_generation, stream_events
 from api.utils.error_messages import ErrorMessages, get_user_language
+from api.utils.conditional import chat_list_validators, chat_messages_validators, conditional
+from django.db.models import Q
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from datetime import timedelta
 from django.conf import settings
 import logging
 
-from api.services.gemini_provider2 import GeminiProvider
-
 
 logger = logging.getLogger(__name__)
 
@@ -90,7 +103,7 @@ def logout_user(request):
     try:
         refresh_token = request.data.get("refresh")
         if refresh_token:
-            token = RefreshToken(refresh_token)
+            token = FilteredRefreshToken(refresh_token)
             token.blacklist()
         return Response({'message': 'Successfully logged out'}, status=status.HTTP_200_OK)
     except Exception as e:
@@ -122,33 +135,21 @@ def build_gemini_history(chat):
     return history
 
 
-def createChatTitle(user_message, model_name='gemini'):
-    """Generate a chat title using AI"""
-    try:
-        provider = ai_service_manager.get_provider(model_name)
-        messages = [{
-            'role': 'user',
-            'content': f"Give a short, descriptive title for this conversation in not more than 5 words.\n\nUser: {user_message}"
-        }]
-        response = provider.generate_response(messages)
-        title = response.get('content', '').strip()
-        if not title:
-            title = user_message[:50]
-    except Exception as e:
-        logger.warning(f"Failed to generate title: {e}")
-        title = user_message[:50]
-    return title
-
-
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([AllowAny])  # Allow anyone to see available models
 def available_models(request):
     """Get list of available AI models"""
     try:
-        models = ai_service_manager.list_available_models()
-        serializer = AIModelSerializer(models, many=True)
-        return Response(serializer.data)
+        models, etag = ai_service_manager.get_model_catalog()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            serializer = AIModelSerializer(models, many=True)
+            response = Response(serializer.data)
+        # Same catalog for every caller; browsers revalidate with If-None-Match
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=60)
+        return response
     except Exception as e:
         logger.error(f"Error fetching available models: {e}")
         language = get_user_language(request)
@@ -156,9 +157,26 @@ def available_models(request):
         return Response(error_response, status=500)
 
 
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAdminUser])
+def provider_queues(request):
+    """Concurrency limit, load and queue-time statistics of each model in this worker"""
+    return Response(ai_service_manager.scheduler_stats())
+
+
+def event_stream_response(events, generation_id):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    response['X-Generation-Id'] = generation_id
+    return response
+
+
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@renderer_classes([ORJSONRenderer, BrowsableAPIRenderer, EventStreamRenderer])
 def prompt_gpt(request):
     try:
         logger.info(f"=== CHAT REQUEST START ===")
@@ -169,6 +187,7 @@ def prompt_gpt(request):
         content = request.data.get("content")
         model_type = request.data.get("model_type", "gemini")
         language = request.data.get("language", "en")
+        wants_stream = bool(request.data.get("stream")) or request.accepted_renderer.format == 'sse'
 
         # Basic validation first
         if not chat_id:
@@ -189,80 +208,53 @@ def prompt_gpt(request):
         logger.error(f"Full traceback: {traceback.format_exc()}")
         return Response({'error': f'Server error during initialization: {str(e)}'}, status=500)
 
-    # Get or create chat for the authenticated user
-    try:
-        logger.info("Starting chat processing...")
-        
-        chat, created = Chat.objects.get_or_create(
-            id=chat_id, 
-            defaults={
-                'user': request.user,
-                'model_type': model_type,
-                'language': language
-            }
-        )
-        logger.info(f"Chat {'created' if created else 'retrieved'}: {chat.id}")
-    except Exception as e:
-        logger.error(f"Error creating/retrieving chat: {e}")
-        return Response({'error': f'Chat creation error: {str(e)}'}, status=500)
-    
-    # Ensure the chat belongs to the current user
-    if chat.user != request.user:
-        return Response({'error': 'Access denied to this chat.'}, status=403)
-
-    # Generate title if it's a new chat or doesn't have one
-    if created or not chat.title:
-        chat.title = createChatTitle(content, model_type)
-        chat.model_type = model_type
-        chat.language = language
-        chat.save()
-
-    # Create user message
-    try:
-        user_message = ChatMessage.objects.create(role="user", chat=chat, content=content)
-        logger.info(f"User message created: {user_message.id}")
-    except Exception as e:
-        logger.error(f"Error creating user message: {e}")
-        return Response({'error': f'Message creation error: {str(e)}'}, status=500)
-
-    # Get conversation history
+    logger.info("Starting chat processing...")
     try:
-        chat_messages = chat.messages.order_by("created_at")
-        openai_messages = [{"role": msg.role, "content": msg.content} for msg in chat_messages]
-        logger.info(f"Retrieved {len(openai_messages)} messages for context")
-    except Exception as e:
-        logger.error(f"Error retrieving chat messages: {e}")
-        return Response({'error': f'Message retrieval error: {str(e)}'}, status=500)
+        turn = prepare_turn(request.user, chat_id, content, model_type, language)
+    except TurnError as e:
+        return Response({'error': str(e)}, status=e.status)
+    chat = turn.chat
+    openai_messages = turn.history
+
+    if wants_stream:
+        # The reply is generated in the background; a dropped client resumes via resume_generation
+        buffer = start_generation(turn, model_type)
+        start = {
+            'generation_id': buffer.generation_id,
+            'chat_id': str(chat.id),
+            'title': chat.title,
+            'message': ChatMessageSerializer(turn.user_message).data,
+        }
+        return event_stream_response(stream_events(buffer, start=start), buffer.generation_id)
 
     try:
-        # Use the AI service manager to get the appropriate provider
-        logger.info(f"Getting provider for model: {model_type}")
-        provider = ai_service_manager.get_provider(model_type)
-        logger.info(f"Provider obtained: {provider.__class__.__name__}")
-        
-        logger.info(f"Sending {len(openai_messages)} messages to AI provider")
-        response = provider.generate_response(openai_messages)
+        # Streamed through the AI service manager so a cancel request can stop it
+        logger.info(f"Sending {len(openai_messages)} messages to AI provider for model: {model_type}")
+        response = generate_reply(turn, model_type)
         logger.info(f"AI provider response received: {response.keys() if isinstance(response, dict) else 'Invalid response'}")
         
         if 'error' in response:
             error_msg = response['error']
             logger.error(f"AI service returned error: {error_msg}")
+            # A new chat still gets its (fallback) title
+            complete_turn(turn, response)
+            if response.get('status_code') == 429:
+                # Still rate limited after the retries; tell the client when to come back
+                error_response = ErrorMessages.create_error_response('rate_limit_exceeded', user_language)
+                retry_after = math.ceil(response.get('retry_after') or 1)
+                return Response(error_response, status=status.HTTP_429_TOO_MANY_REQUESTS,
+                                headers={'Retry-After': str(retry_after)})
             return Response({'error': f'AI service error: {error_msg}'}, status=500)
         
-        reply = response.get('content', 'Sorry, I could not generate a response.')
+        if not response['content'] and not response['is_truncated']:
+            response['content'] = 'Sorry, I could not generate a response.'
+        reply = response['content']
         tokens_used = response.get('tokens_used', 0)
         model_used = response.get('model_used', model_type)
         
-        # Create assistant message with metadata
+        # Create assistant message with metadata; a reply stopped before any text is not stored
         try:
-            assistant_message = ChatMessage.objects.create(
-                role="assistant", 
-                content=reply, 
-                chat=chat,
-                model_used=model_used,
-                tokens_used=tokens_used
-            )
-            logger.info(f"Assistant message created: {assistant_message.id}")
+            complete_turn(turn, response)
         except Exception as e:
             logger.error(f"Error creating assistant message: {e}")
             # Still return the response even if message saving fails
@@ -270,8 +262,10 @@ def prompt_gpt(request):
         response_data = {
             "reply": reply,
             "chat_id": str(chat.id),
+            "title": chat.title,
             "model_used": model_used,
-            "tokens_used": tokens_used
+            "tokens_used": tokens_used,
+            "is_truncated": response['is_truncated']
         }
         logger.info(f"Sending response: {response_data}")
         return Response(response_data, status=status.HTTP_201_CREATED)
@@ -288,25 +282,123 @@ def prompt_gpt(request):
         return Response({'error': f'Chat processing error: {str(e)}'}, status=500)
 
 
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@renderer_classes([ORJSONRenderer, EventStreamRenderer])
+def resume_generation(request, generation_id):
+    """Stream a reply from the client's Last-Event-ID offset without calling the provider again"""
+    user_language = get_user_language(request)
+    buffer = GenerationBuffer(generation_id)
+    meta = buffer.get_meta()
+    if meta is None or meta['user_id'] != request.user.pk:
+        error_response = ErrorMessages.create_error_response('generation_not_found', user_language)
+        return Response(error_response, status=status.HTTP_404_NOT_FOUND)
+    try:
+        offset = parse_offset(request.headers.get('Last-Event-ID') or request.GET.get('offset'))
+    except ValueError:
+        error_response = ErrorMessages.create_error_response('validation_error', user_language)
+        return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+    buffer.mark_reader()
+    return event_stream_response(stream_events(buffer, offset), generation_id)
+
+
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def cancel_generation(request, pk):
+    """Stop the reply being generated for a chat; the partial reply is kept as truncated"""
+    chat = get_object_or_404(Chat, id=pk, user=request.user)
+    request_cancel(chat.id)
+    return Response({'chat_id': str(chat.id), 'cancelled': True}, status=status.HTTP_202_ACCEPTED)
+
+
 @api_view(["GET"])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@conditional(chat_messages_validators)
 def get_chat_messages(request, pk):
     chat = get_object_or_404(Chat, id=pk, user=request.user)
+    rehydrate_chat(chat)
     chatmessages = chat.messages.all()
     serializer = ChatMessageSerializer(chatmessages, many=True)
     return Response(serializer.data)
 
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
+def sync_chat_messages(request, pk):
+    """Get only the messages of a chat that come after the client's newest one"""
+    user_language = get_user_language(request)
+    chat = get_object_or_404(Chat, id=pk, user=request.user)
+    rehydrate_chat(chat)
+    try:
+        after_id = request.GET.get('after_id')
+        since = request.GET.get('since')
+        page = sync.messages_after(
+            chat,
+            after_id=int(after_id) if after_id else None,
+            since=sync.parse_timestamp(since) if since else None,
+            limit=sync.parse_limit(request.GET.get('limit')),
+        )
+    except (ValueError, ChatMessage.DoesNotExist):
+        error_response = ErrorMessages.create_error_response('invalid_sync_cursor', user_language)
+        return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+
+    messages = page['messages']
+    return Response({
+        'chat_id': str(chat.id),
+        'messages': ChatMessageSerializer(messages, many=True).data,
+        'has_more': page['has_more'],
+        'last_id': page['last_id'] or (int(after_id) if after_id else None),
+    })
+
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def sync_chats(request):
+    """
+    Get the user's chats changed or deleted since the client's last sync
+
+    Answers 410 when the client's position is too old to list every deletion;
+    it must then drop its local chats and sync again without a cursor.
+    """
+    user_language = get_user_language(request)
+    try:
+        since = request.GET.get('since')
+        page = sync.chats_changed(
+            request.user,
+            cursor=request.GET.get('cursor'),
+            since=sync.parse_timestamp(since) if since else None,
+            limit=sync.parse_limit(request.GET.get('limit')),
+        )
+    except ValueError:
+        error_response = ErrorMessages.create_error_response('invalid_sync_cursor', user_language)
+        return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+    except sync.ResyncRequired:
+        error_response = ErrorMessages.create_error_response('sync_resync_required', user_language)
+        return Response(error_response, status=status.HTTP_410_GONE)
+
+    return Response({
+        'chats': ChatSerializer(page['chats'], many=True).data,
+        'deleted': page['deleted'],
+        'has_more': page['has_more'],
+        'cursor': page['cursor'],
+    })
+
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@conditional(chat_list_validators)
 def user_chats(request):
     """Get all chats for the authenticated user with pagination"""
     page_size = int(request.GET.get('page_size', 20))
     page = int(request.GET.get('page', 1))
     
-    chats = Chat.objects.filter(user=request.user).select_related('user').prefetch_related('messages').order_by('-updated_at')
+    chats = Chat.objects.filter(user=request.user).select_related('user', 'archive').defer('archive__payload').prefetch_related('messages').order_by('-updated_at')
     
     # Simple pagination
     start = (page - 1) * page_size
@@ -325,8 +417,9 @@ def user_chats(request):
 
 
 @api_view(["GET"])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@conditional(chat_list_validators)
 def chat_history(request):
     """Get all user's chats with messages for the last 30 days"""
     try:
@@ -335,10 +428,10 @@ def chat_history(request):
         
         # Get chats from the last 30 days that have at least one message
         chats = Chat.objects.filter(
+            Q(messages__isnull=False) | Q(archived_at__isnull=False),
             user=request.user,
             created_at__gte=thirty_days_ago,
-            messages__isnull=False
-        ).select_related('user').prefetch_related('messages').order_by("-updated_at").distinct()
+        ).select_related('user', 'archive').defer('archive__payload').prefetch_related('messages').order_by("-updated_at").distinct()
         
         serializer = ChatSerializer(chats, many=True)
         logger.info(f"Retrieved {len(serializer.data)} chats for history for user {request.user.username}")
@@ -349,8 +442,178 @@ def chat_history(request):
         return Response({'error': 'Failed to retrieve chat history'}, status=500)
 
 
+@api_view(['GET', 'POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def user_documents(request):
+    """List the user's documents, or upload one as a multipart ``file`` or as JSON ``name`` and ``content``"""
+    if request.method == 'GET':
+        return Response(DocumentSerializer(request.user.documents.all(), many=True).data)
+
+    user_language = get_user_language(request)
+    if not documents.available():
+        error_response = ErrorMessages.create_error_response('documents_unavailable', user_language)
+        return Response(error_response, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    max_bytes = getattr(settings, 'RAG_MAX_DOCUMENT_BYTES', 5 * 1024 * 1024)
+    upload = request.FILES.get('file')
+    if upload is not None:
+        name = upload.name
+        if upload.size > max_bytes:
+            error_response = ErrorMessages.create_error_response('document_too_large', user_language)
+            return Response(error_response, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        try:
+            text = upload.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            error_response = ErrorMessages.create_error_response('unsupported_document', user_language)
+            return Response(error_response, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    else:
+        name = request.data.get('name') or 'Untitled'
+        text = request.data.get('content')
+        if not isinstance(text, str) or not text.strip():
+            error_response = ErrorMessages.create_error_response('document_required', user_language)
+            return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+        if len(text.encode('utf-8')) > max_bytes:
+            error_response = ErrorMessages.create_error_response('document_too_large', user_language)
+            return Response(error_response, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    try:
+        document = documents.add_document(request.user, name, text)
+    except documents.DocumentError as e:
+        error_response = ErrorMessages.create_error_response(e.key, user_language)
+        return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+    return Response(DocumentSerializer(document).data, status=status.HTTP_201_CREATED)
+
+
+@api_view(['DELETE'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def delete_document(request, pk):
+    """Delete one of the user's documents"""
+    document = get_object_or_404(Document, id=pk, user=request.user)
+    documents.delete_document(document)
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(["GET"])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def search_messages(request):
+    """
+    Full-text search across the user's messages, best matches first
+
+    Archived chats are not searched; ``archived_chats`` says how many were left out.
+    """
+    user_language = get_user_language(request)
+    query = request.GET.get('q', '').strip()
+    if not query:
+        error_response = ErrorMessages.create_error_response('search_query_required', user_language)
+        return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+        page = search.search_messages(request.user, query, cursor=request.GET.get('cursor'), limit=limit)
+    except ValueError:
+        error_response = ErrorMessages.create_error_response('validation_error', user_language)
+        return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+    except NotImplementedError:
+        # The database has no full-text index
+        error_response = ErrorMessages.create_error_response('search_unavailable', user_language)
+        return Response(error_response, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+    results = page['results']
+    messages = ChatMessage.objects.filter(id__in=[r['message_id'] for r in results]).values('id', 'role', 'created_at')
+    messages = {m['id']: m for m in messages}
+    titles = dict(Chat.objects.filter(id__in={r['chat_id'] for r in results}, user=request.user).values_list('id', 'title'))
+    titles = {str(chat_id): title for chat_id, title in titles.items()}
+    for result in results:
+        message = messages.get(result['message_id'], {})
+        result['role'] = message.get('role')
+        result['created_at'] = message.get('created_at')
+        result['chat_title'] = titles.get(result['chat_id'])
+
+    return Response({
+        'results': results,
+        'next_cursor': page['next_cursor'],
+        'archived_chats': Chat.objects.filter(user=request.user, archived_at__isnull=False).count(),
+    })
+
+
+@api_view(["GET"])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def user_usage(request):
+    """
+    Assistant messages and tokens between ``start`` and ``end`` (inclusive, default the last 30 days)
+
+    ``group_by`` is a comma-separated subset of day, model and user (default
+    day,model). Admins may pass ``user`` to see another user's usage, or
+    user=all for everyone's.
+    """
+    user_language = get_user_language(request)
+    user_id = request.user.id
+    requested_user = request.GET.get('user')
+    if requested_user is not None and requested_user != str(user_id):
+        if not request.user.is_staff:
+            error_response = ErrorMessages.create_error_response('usage_access_denied', user_language)
+            return Response(error_response, status=status.HTTP_403_FORBIDDEN)
+        user_id = None if requested_user == 'all' else requested_user
+
+    try:
+        end = parse_date(request.GET['end']) if 'end' in request.GET else timezone.localdate()
+        start = parse_date(request.GET['start']) if 'start' in request.GET else end - timedelta(days=29)
+        if start is None or end is None or not 0 <= (end - start).days < getattr(settings, 'USAGE_MAX_RANGE_DAYS', 366):
+            raise ValueError("Invalid usage range")
+        group_by = [name for name in request.GET.get('group_by', 'day,model').split(',') if name]
+        if user_id is not None:
+            user_id = int(user_id)
+        report = usage.summarize(user_id, start, end, group_by)
+    except (TypeError, ValueError):
+        error_response = ErrorMessages.create_error_response('validation_error', user_language)
+        return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+    return Response(report)
+
+
+@api_view(["GET"])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def export_chats(request):
+    """Stream every chat and message of the user as NDJSON"""
+    response = StreamingHttpResponse(export_user_chats(request.user), content_type='application/x-ndjson')
+    filename = f"chats-{timezone.now():%Y%m%d}.ndjson"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@api_view(["POST"])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def import_chats(request):
+    """
+    Import an NDJSON export (request body) into the user's account
+
+    An invalid line answers 400 with its number; the lines above it stay imported.
+    """
+    # Language comes from the headers only; reading request.data would parse the body
+    user_language = get_user_language(request._request)
+    try:
+        stats = ChatImporter(request.user).run(request.stream or [])
+    except ChatImportError as e:
+        logger.info(f"Chat import for user {request.user.username} stopped at {e}: {e.stats}")
+        error_response = ErrorMessages.create_error_response(
+            'invalid_import_line', user_language, line=e.line, detail=e.reason, **e.stats,
+        )
+        return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Chat import failed for user {request.user.username}: {e}")
+        error_response = ErrorMessages.create_error_response('server_error', user_language)
+        return Response(error_response, status=500)
+    logger.info(f"Imported chats for user {request.user.username}: {stats}")
+    return Response(stats, status=status.HTTP_201_CREATED)
+
+
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def create_chat(request):
     """Create a new chat for the user"""
@@ -365,7 +628,7 @@ def create_chat(request):
 
 
 @api_view(['DELETE'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def delete_chat(request, pk):
     """Delete a chat (only if it belongs to the user)"""
@@ -383,6 +646,9 @@ def chat_with_gemini(request):
     if not message:
         return Response({"error": "Message is required"}, status=status.HTTP_400_BAD_REQUEST)
 
+    # Imported here so the Gemini SDK is only loaded when this endpoint is used
+    from api.services.gemini_provider2 import GeminiProvider
+
     gemini = GeminiProvider()  # default model
     reply = gemini.generate_response(message)
 
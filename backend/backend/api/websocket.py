@@ -0,0 +1,347 @@
+"""
+WebSocket chat transport, served as a plain ASGI application
+
+One connection per client carries every chat: prompts go up tagged with a
+chat_id, and turn events (stored messages, title updates, streamed deltas)
+come down tagged the same way. Events are fanned out to all of the user's
+connections in this process, which keeps other tabs in sync.
+
+Client messages:
+    {"type": "auth", "token": "<access token>"}   first, and again with each new token
+    {"type": "prompt", "chat_id": ..., "content": ..., "model_type": ..., "language": ...}
+    {"type": "cancel", "chat_id": ...}
+    {"type": "ping"}
+
+Server events:
+    ready, pong, message, title, delta, done, cancelled, error
+
+The token only travels in the auth frame, never in the URL where proxies and
+access logs would keep it. The socket is closed with 4401 when its token
+expires, unless the client has sent a newer one, and when a periodic check
+(every WEBSOCKET_AUTH_RECHECK_INTERVAL seconds) finds the user deleted or
+deactivated.
+
+Closing the socket stops the generations it started. Each connection runs
+at most WEBSOCKET_MAX_TURNS_PER_CONNECTION turns at once, each user at most
+WEBSOCKET_MAX_TURNS_PER_USER across their connections, and the process at
+most WEBSOCKET_MAX_TURNS; beyond those, prompts get a 429 or 503 error event,
+as reply requests over HTTP do from BackpressureMiddleware.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import Counter
+from typing import Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from api.authentication import CachedJWTAuthentication
+from api.models import Chat
+from api.renderers import ORJSONRenderer
+from api.serializers import ChatMessageSerializer
+from api.services.cancellation import request_cancel
+from api.services.chat_turn import TurnError, complete_turn, generate_reply, prepare_turn
+from api.services.realtime import broadcaster
+
+logger = logging.getLogger(__name__)
+
+# Application close codes (4000-4999)
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_TOO_SLOW = 4408
+CLOSE_MESSAGE_TOO_BIG = 1009
+CLOSE_TRY_AGAIN_LATER = 1013
+
+_renderer = ORJSONRenderer()
+
+
+def _parse_chat_id(value) -> Optional[str]:
+    """Canonical string form of a chat id sent by a client, or None if it is not a UUID"""
+    if not isinstance(value, str):
+        return None
+    try:
+        return str(uuid.UUID(value))
+    except ValueError:
+        return None
+
+
+class TurnLimits:
+    """Turns running in this process, in total and per user; used from the event loop only"""
+
+    def __init__(self):
+        self.running = 0
+        self.per_user = Counter()
+
+    def start(self, user_id) -> Optional[int]:
+        """Count a new turn, or return the error status that refuses it"""
+        if self.per_user[user_id] >= getattr(settings, 'WEBSOCKET_MAX_TURNS_PER_USER', 4):
+            return 429
+        if self.running >= getattr(settings, 'WEBSOCKET_MAX_TURNS', 16):
+            return 503
+        self.running += 1
+        self.per_user[user_id] += 1
+        return None
+
+    def finish(self, user_id) -> None:
+        self.running -= 1
+        self.per_user[user_id] -= 1
+        if self.per_user[user_id] <= 0:
+            del self.per_user[user_id]
+
+
+turn_limits = TurnLimits()
+
+
+def _authenticate(raw_token: str) -> Optional[Tuple[object, float]]:
+    """The token's user and its expiry as a Unix timestamp, or None if either is not valid"""
+    authenticator = CachedJWTAuthentication()
+    close_old_connections()
+    try:
+        validated_token = authenticator.get_validated_token(raw_token.encode())
+        return authenticator.get_user(validated_token), float(validated_token['exp'])
+    except (InvalidToken, TokenError, AuthenticationFailed, KeyError):
+        return None
+    finally:
+        close_old_connections()
+
+
+def _cancel_turn(user, chat_id) -> bool:
+    close_old_connections()
+    try:
+        if not Chat.objects.filter(id=chat_id, user=user).exists():
+            return False
+        request_cancel(chat_id)
+        return True
+    except (ValueError, ValidationError):
+        return False
+    finally:
+        close_old_connections()
+
+
+def run_turn(user, payload) -> None:
+    """Run one streamed turn in a worker thread, publishing its events to the user's connections"""
+    chat_id = payload.get('chat_id')
+    model_type = payload.get('model_type') or 'gemini'
+
+    def publish(event_type, **data):
+        broadcaster.publish(user.pk, {'type': event_type, 'chat_id': str(chat_id), **data})
+
+    close_old_connections()
+    try:
+        turn = prepare_turn(
+            user, chat_id, payload['content'], model_type, payload.get('language') or 'en',
+        )
+        publish('message', message=ChatMessageSerializer(turn.user_message).data)
+
+        reply = generate_reply(turn, model_type, on_delta=lambda text: publish('delta', content=text))
+        assistant_message = complete_turn(turn, reply)
+        if turn.title_changed:
+            publish('title', title=turn.chat.title)
+        if 'error' in reply:
+            publish('error', error=f"AI service error: {reply['error']}")
+        elif assistant_message is None:
+            # Stopped before the provider produced anything
+            publish('cancelled')
+        else:
+            publish('done', message=ChatMessageSerializer(assistant_message).data)
+    except TurnError as e:
+        publish('error', error=str(e), status=e.status)
+    except ValueError as e:
+        publish('error', error=f'Model not supported: {str(e)}', status=400)
+    except Exception as e:
+        logger.exception(f"WebSocket turn failed: {e}")
+        publish('error', error=f'Chat processing error: {str(e)}', status=500)
+    finally:
+        close_old_connections()
+
+
+class ChatSocket:
+    """One client connection"""
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.user = None
+        self.token = None
+        self.expires_at = 0.0
+        self.expired = False
+        self.subscription = None
+        self.turns = {}
+        self.max_message_bytes = getattr(settings, 'WEBSOCKET_MAX_MESSAGE_BYTES', 64 * 1024)
+        self.max_turns = getattr(settings, 'WEBSOCKET_MAX_TURNS_PER_CONNECTION', 2)
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        await self.send({'type': 'websocket.accept'})
+
+        self.user = await self._authenticate()
+        if self.user is None:
+            return
+
+        self.subscription = broadcaster.subscribe(self.user.pk)
+        pump = asyncio.create_task(self._pump())
+        watchdog = asyncio.create_task(self._watch_token(asyncio.current_task()))
+        try:
+            await self._send_json({'type': 'ready', 'user_id': self.user.pk})
+            while True:
+                message = await self.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message['type'] == 'websocket.receive':
+                    if not await self._handle(message):
+                        break
+        except asyncio.CancelledError:
+            # Cancelled by the watchdog, which has closed the socket
+            if not self.expired:
+                raise
+        finally:
+            broadcaster.unsubscribe(self.subscription)
+            pump.cancel()
+            watchdog.cancel()
+            # Stop what this connection started; the stored partial replies reach other tabs
+            for chat_id in list(self.turns):
+                await sync_to_async(_cancel_turn)(self.user, chat_id)
+
+    async def _authenticate(self):
+        # Browsers cannot set headers on WebSockets, so the token comes in the first frame
+        timeout = getattr(settings, 'WEBSOCKET_AUTH_TIMEOUT', 10)
+        try:
+            message = await asyncio.wait_for(self.receive(), timeout)
+        except asyncio.TimeoutError:
+            await self._close(CLOSE_TOO_SLOW)
+            return None
+        if message['type'] != 'websocket.receive':
+            return None
+        data = self._decode(message)
+        token = data.get('token') if data and data.get('type') == 'auth' else None
+        result = await sync_to_async(_authenticate)(token) if isinstance(token, str) else None
+        if result is None:
+            await self._close(CLOSE_UNAUTHORIZED)
+            return None
+        self.token, self.expires_at = token, result[1]
+        return result[0]
+
+    async def _reauthenticate(self, token) -> None:
+        """Take a newer token for the same user, so the socket outlives the first one"""
+        result = await sync_to_async(_authenticate)(token) if isinstance(token, str) else None
+        if result is None or result[0].pk != self.user.pk:
+            self._reply({'type': 'error', 'error': 'Invalid token.', 'status': 401})
+            return
+        self.token, self.expires_at = token, result[1]
+        self._reply({'type': 'ready', 'user_id': self.user.pk})
+
+    async def _watch_token(self, connection_task) -> None:
+        """Close the socket once its token expires or no longer resolves to an active user"""
+        recheck_interval = getattr(settings, 'WEBSOCKET_AUTH_RECHECK_INTERVAL', 60)
+        while True:
+            await asyncio.sleep(max(0.0, min(self.expires_at - time.time(), recheck_interval)))
+            if time.time() < self.expires_at and await sync_to_async(_authenticate)(self.token) is not None:
+                continue
+            logger.info(f"Closing WebSocket of user {self.user.pk}: token expired or user no longer valid")
+            self.expired = True
+            await self._close(CLOSE_UNAUTHORIZED)
+            connection_task.cancel()
+            return
+
+    def _decode(self, message):
+        text = message.get('text')
+        if text is None and message.get('bytes') is not None:
+            text = message['bytes'].decode('utf-8', errors='replace')
+        try:
+            data = json.loads(text or '')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    async def _handle(self, message) -> bool:
+        """Process one client frame; returns False to close the connection"""
+        size = len(message.get('text') or '') + len(message.get('bytes') or b'')
+        if size > self.max_message_bytes:
+            await self._close(CLOSE_MESSAGE_TOO_BIG)
+            return False
+        data = self._decode(message)
+        if data is None:
+            self._reply({'type': 'error', 'error': 'Invalid message.', 'status': 400})
+            return True
+
+        if data.get('type') == 'ping':
+            self._reply({'type': 'pong'})
+        elif data.get('type') == 'auth':
+            await self._reauthenticate(data.get('token'))
+        elif data.get('type') == 'prompt':
+            self._start_turn(data)
+        elif data.get('type') == 'cancel':
+            chat_id = _parse_chat_id(data.get('chat_id'))
+            if chat_id is None or not await sync_to_async(_cancel_turn)(self.user, chat_id):
+                self._reply({'type': 'error', 'chat_id': chat_id, 'error': 'Access denied to this chat.', 'status': 403})
+        else:
+            self._reply({'type': 'error', 'error': f"Unknown message type: {data.get('type')}", 'status': 400})
+        return True
+
+    def _start_turn(self, data):
+        if not data.get('chat_id'):
+            self._reply({'type': 'error', 'error': 'Chat ID is required.', 'status': 400})
+            return
+        chat_id = _parse_chat_id(data['chat_id'])
+        if chat_id is None:
+            self._reply({'type': 'error', 'error': 'Invalid chat ID.', 'status': 400})
+            return
+        if not data.get('content'):
+            self._reply({'type': 'error', 'chat_id': chat_id, 'error': 'Message content is required.', 'status': 400})
+            return
+        running = self.turns.get(chat_id)
+        if running is not None and not running.done():
+            self._reply({'type': 'error', 'chat_id': chat_id, 'error': 'A reply is already being generated for this chat.', 'status': 409})
+            return
+        refused = 429 if len(self.turns) >= self.max_turns else turn_limits.start(self.user.pk)
+        if refused is not None:
+            error = ('The server is busy right now. Please try again in a few seconds.' if refused == 503
+                     else 'Too many replies are being generated at once.')
+            self._reply({'type': 'error', 'chat_id': chat_id, 'error': error, 'status': refused})
+            return
+        # Threads outside the request thread pool, so long generations never block other sockets
+        self.turns[chat_id] = asyncio.ensure_future(
+            sync_to_async(run_turn, thread_sensitive=False)(self.user, {**data, 'chat_id': chat_id})
+        )
+        self.turns[chat_id].add_done_callback(lambda task, chat_id=chat_id: self._forget(chat_id, task))
+
+    def _forget(self, chat_id, task):
+        turn_limits.finish(self.user.pk)
+        if self.turns.get(chat_id) is task:
+            del self.turns[chat_id]
+
+    def _reply(self, event):
+        """Send an event to this connection only, in order with broadcast events"""
+        self.subscription.deliver(event)
+
+    async def _pump(self):
+        while True:
+            event = await self.subscription.queue.get()
+            if event is None:
+                await self._close(CLOSE_TRY_AGAIN_LATER)
+                return
+            await self._send_json(event)
+
+    async def _send_json(self, event):
+        await self.send({'type': 'websocket.send', 'text': _renderer.render(event).decode()})
+
+    async def _close(self, code):
+        await self.send({'type': 'websocket.close', 'code': code})
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI entry point for WebSocket connections"""
+    if scope['path'] != getattr(settings, 'WEBSOCKET_PATH', '/ws/chat/'):
+        await receive()
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await ChatSocket(scope, receive, send).run()
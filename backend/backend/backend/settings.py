@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 import os
 from dotenv import load_dotenv
@@ -17,6 +18,9 @@ from dotenv import load_dotenv
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Load environment variables
+load_dotenv()
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -48,6 +52,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'api.middleware.BackpressureMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,15 +81,99 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+#
+# DB_PROFILE selects how connections are managed:
+#   development (default) - one connection per request, stock SQLite settings
+#   production            - persistent connections, SQLite in WAL mode
+# DB_ENGINE=postgres switches to PostgreSQL; in production it uses the
+# psycopg connection pool when ``psycopg[pool]`` is installed, and persistent
+# connections otherwise.
+
+DB_PROFILE = os.getenv("DB_PROFILE", "development")
+DB_ENGINE = os.getenv("DB_ENGINE", "sqlite")
+
+# Applied on every new SQLite connection in the production profile. WAL lets
+# readers proceed while a writer holds the lock, and synchronous=NORMAL only
+# fsyncs at checkpoints, which is safe under WAL. How long writers wait for
+# each other is OPTIONS['timeout'] below; a busy_timeout pragma would
+# silently override it.
+SQLITE_PRODUCTION_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=134217728",
+]
+
+if DB_ENGINE == "postgres":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv("POSTGRES_DB", "chatbot"),
+            'USER': os.getenv("POSTGRES_USER", "postgres"),
+            'PASSWORD': os.getenv("POSTGRES_PASSWORD", ""),
+            'HOST': os.getenv("POSTGRES_HOST", "localhost"),
+            'PORT': os.getenv("POSTGRES_PORT", "5432"),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if DB_PROFILE == "production" and find_spec("psycopg_pool") is None:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv("DB_CONN_MAX_AGE", 600))
+    elif DB_PROFILE == "production":
+        # Pooled connections replace CONN_MAX_AGE, which must stay at 0.
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.getenv("POSTGRES_POOL_MIN_SIZE", 2)),
+                'max_size': int(os.getenv("POSTGRES_POOL_MAX_SIZE", 10)),
+                'timeout': int(os.getenv("POSTGRES_POOL_TIMEOUT", 10)),
+            },
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+    if DB_PROFILE == "production":
+        DATABASES['default'].update({
+            'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", 600)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Seconds a writer waits for the lock before "database is locked"
+                'timeout': 20,
+                # Take the write lock when the transaction starts so two
+                # writers never deadlock while upgrading from a read lock.
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': "; ".join(SQLITE_PRODUCTION_PRAGMAS),
+            },
+        })
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# Cancel flags, generation buffers, the user cache and the token blacklist
+# counter must be seen by every worker process, so the default cache is a
+# SQLite file they all share (see api.cache) rather than per-process memory.
+# Past MAX_ENTRIES, the least recently read entries are evicted.
+#
+# This file, the title IDF table and the RAG and memory indexes default to
+# BASE_DIR and are git-ignored; point them elsewhere in production.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'api.cache.SQLiteCache',
+        'LOCATION': os.getenv("CACHE_LOCATION", BASE_DIR / 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100_000,
+        },
     }
 }
 
@@ -135,20 +225,119 @@ from datetime import timedelta
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
+# Response compression for the API (see api.middleware.CompressionMiddleware)
+API_COMPRESSION_MIN_SIZE = int(os.getenv("API_COMPRESSION_MIN_SIZE", 1024))
+API_COMPRESSION_PATH_PREFIX = '/api/'
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.FilteredTokenRefreshSerializer',
 }
 
+# Bloom filter in front of the token blacklist tables (see api.token_blacklist)
+JWT_BLACKLIST_FILTER_CAPACITY = 100_000
+JWT_BLACKLIST_FILTER_ERROR_RATE = 0.001
+JWT_BLACKLIST_FILTER_MAX_STALENESS = 5
+JWT_BLACKLIST_FILTER_REBUILD_INTERVAL = 600
+# Syncs re-read tokens blacklisted this many seconds before the previous sync,
+# covering rows stamped before a slow transaction committed
+JWT_BLACKLIST_FILTER_SYNC_MARGIN = 60
+
+# Authenticated users are cached per worker for JWT_USER_CACHE_LOCAL_TTL
+# seconds and in the shared cache for JWT_USER_CACHE_SHARED_TTL seconds;
+# saving a user invalidates both.
+JWT_USER_CACHE_LOCAL_TTL = 30
+JWT_USER_CACHE_SHARED_TTL = 300
+
+# WebSocket chat transport (see api.websocket), served by backend.asgi
+WEBSOCKET_PATH = '/ws/chat/'
+WEBSOCKET_AUTH_TIMEOUT = 10
+# Seconds between checks that a connected user still exists and is active
+WEBSOCKET_AUTH_RECHECK_INTERVAL = 60
+WEBSOCKET_MAX_MESSAGE_BYTES = 64 * 1024
+# Events buffered per connection before a client that stopped reading is dropped
+WEBSOCKET_SEND_QUEUE_SIZE = 256
+# Streamed turns running at once per connection, per user and per process
+WEBSOCKET_MAX_TURNS_PER_CONNECTION = 2
+WEBSOCKET_MAX_TURNS_PER_USER = 4
+WEBSOCKET_MAX_TURNS = 16
+
+# Streamed replies run in a background pool and are buffered for resuming (see api.services.generation)
+GENERATION_MAX_WORKERS = 32
+GENERATION_BUFFER_TTL = 300
+# A generation nobody has read for this many seconds is cancelled
+GENERATION_DISCONNECT_GRACE = 30
+
+# Reply requests served at once per worker process, and how many may wait (and for how long)
+# before further ones are shed with 503 (see api.middleware.BackpressureMiddleware)
+BACKPRESSURE_VIEWS = ['prompt_gpt']
+BACKPRESSURE_MAX_IN_FLIGHT = 16
+BACKPRESSURE_MAX_QUEUE = 32
+BACKPRESSURE_QUEUE_TIMEOUT = 2
+
+# Concurrent calls per model adapt between 1 and PROVIDER_CONCURRENCY_MAX (see api.services.provider_limits)
+PROVIDER_CONCURRENCY_INITIAL = 4
+PROVIDER_CONCURRENCY_MAX = 32
+# Seconds a call of each priority class may wait for a slot, backoff between retries included
+# (see api.services.scheduler)
+PROVIDER_QUEUE_DEADLINES = {'interactive': 10, 'title': 5, 'batch': 120}
+# Rate-limited or overloaded calls are retried with jittered exponential backoff
+PROVIDER_MAX_RETRIES = 3
+PROVIDER_RETRY_BASE_DELAY = 0.5
+PROVIDER_RETRY_MAX_DELAY = 10
+
+# Chat titles: 'llm' asks the chat's model; set 'local' to extract keywords from the first
+# message instead, with no provider call. The IDF table for local titles is written by the
+# build_title_idf command.
+CHAT_TITLE_STRATEGY = os.getenv("CHAT_TITLE_STRATEGY", "llm")
+CHAT_TITLE_IDF_PATH = os.getenv("CHAT_TITLE_IDF_PATH", BASE_DIR / 'title_idf.json')
+
+# Documents users upload as context for their chats (see api.services.documents)
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", BASE_DIR / 'rag_index')
+RAG_MAX_DOCUMENT_BYTES = 5 * 1024 * 1024
+RAG_CHUNK_WORDS = 200
+RAG_CHUNK_OVERLAP = 40
+# Passages added to a prompt, and the lexical similarity (cosine of hashed keyword vectors,
+# see api.services.lexical_vectors) they need to qualify
+RAG_TOP_K = 4
+RAG_MIN_SCORE = 0.2
+
+# Cross-chat memory: past messages recalled as context in other chats (see api.services.memory)
+MEMORY_INDEX_DIR = os.getenv("MEMORY_INDEX_DIR", BASE_DIR / 'memory_index')
+MEMORY_SHARD_ROWS = 1_000_000
+# Snippets added to a prompt, and the lexical similarity they need to qualify
+MEMORY_TOP_K = 3
+MEMORY_MIN_SCORE = 0.3
+
+# Sync cursors stay this many seconds behind now, so rows that commit after
+# others stamped later than them are still delivered (see api.services.sync)
+SYNC_SAFETY_LAG = 5
+# Days deleted chats stay in the sync feed; the prune_tombstones command
+# drops older tombstones and clients that last synced before then resync fully
+SYNC_TOMBSTONE_RETENTION_DAYS = 30
+
+# Longest range of days the usage endpoint reports at once (see api.services.usage)
+USAGE_MAX_RANGE_DAYS = 366
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -159,9 +348,6 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
-# Load environment variables
-load_dotenv()
-
 # AI Provider API Keys
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")